@@ -3,8 +3,20 @@ from __future__ import annotations
 import os
 import time
 import uuid
+import random
+import bisect
 import json
 import base64
+import asyncio
+import copy
+import hashlib
+import heapq
+import http.client
+import zlib
+import re
+import sqlite3
+import threading
+import contextvars
 import urllib.request
 import urllib.error
 import urllib.parse
@@ -14,13 +26,18 @@ try:
     load_dotenv(".env.local")
 except Exception:
     pass
-from typing import Any, Dict, List, Optional, Literal
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, Literal
 
 from fastapi import FastAPI, HTTPException, Depends, Header, Query
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel, Field
 
-from huggingface_hub import InferenceClient
+from huggingface_hub import AsyncInferenceClient
 
 # ============================================================
 # ENV
@@ -28,6 +45,9 @@ from huggingface_hub import InferenceClient
 HF_TOKEN = os.getenv("HF_TOKEN", "")
 HF_MODEL = os.getenv("HF_MODEL", "mistralai/Mistral-7B-Instruct-v0.2")
 
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "firestore").lower()  # firestore | sqlite | memory
+SQLITE_PATH = os.getenv("SQLITE_PATH", "mainst.db")
+
 FIREBASE_PROJECT_ID = os.getenv("FIREBASE_PROJECT_ID")
 GOOGLE_APPLICATION_CREDENTIALS = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
 
@@ -40,43 +60,566 @@ SENDGRID_FROM_EMAIL = os.getenv("SENDGRID_FROM_EMAIL", "no-reply@mainst.ai")
 TWILIO_ACCOUNT_SID = os.getenv("TWILIO_ACCOUNT_SID", "")
 TWILIO_AUTH_TOKEN = os.getenv("TWILIO_AUTH_TOKEN", "")
 TWILIO_FROM_NUMBER = os.getenv("TWILIO_FROM_NUMBER", "")
+SENDGRID_API_URL = os.getenv("SENDGRID_API_URL", "https://api.sendgrid.com/v3/mail/send")
+TWILIO_API_URL = os.getenv("TWILIO_API_URL", "https://api.twilio.com")
+DELIVERY_WORKERS = int(os.getenv("DELIVERY_WORKERS", "4"))
+DELIVERY_MAX_ATTEMPTS = int(os.getenv("DELIVERY_MAX_ATTEMPTS", "5"))
+DELIVERY_BACKOFF_SECONDS = float(os.getenv("DELIVERY_BACKOFF_SECONDS", "2"))
+DELIVERY_TIMEOUT_SECONDS = float(os.getenv("DELIVERY_TIMEOUT_SECONDS", "8"))
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "2048"))
+AUTH_CACHE_MAX_TTL = int(os.getenv("AUTH_CACHE_MAX_TTL", "300"))
+CONFIG_CACHE_SIZE = int(os.getenv("CONFIG_CACHE_SIZE", "4096"))
+CONFIG_CACHE_TTL = float(os.getenv("CONFIG_CACHE_TTL", "60"))
+CONFIG_VERSION_CHECK_SECONDS = float(os.getenv("CONFIG_VERSION_CHECK_SECONDS", "5"))
+STATS_FLUSH_SECONDS = float(os.getenv("STATS_FLUSH_SECONDS", "2"))
+GET_ALL_BATCH_SIZE = int(os.getenv("GET_ALL_BATCH_SIZE", "100"))
+FETCH_POOL_WORKERS = int(os.getenv("FETCH_POOL_WORKERS", "8"))
+ORG_SUMMARY_MAX_WORKSPACES = int(os.getenv("ORG_SUMMARY_MAX_WORKSPACES", "50"))
+INBOUND_ASYNC = os.getenv("INBOUND_ASYNC", "false").lower() == "true"
+INBOUND_WORKERS = int(os.getenv("INBOUND_WORKERS", "16"))
+INBOUND_JOB_STALE_SECONDS = float(os.getenv("INBOUND_JOB_STALE_SECONDS", "900"))
+INBOUND_BATCH_MAX = int(os.getenv("INBOUND_BATCH_MAX", "5000"))
+INBOUND_BATCH_CHUNK = int(os.getenv("INBOUND_BATCH_CHUNK", "50"))
+IDEMPOTENCY_TTL_SECONDS = float(os.getenv("IDEMPOTENCY_TTL_SECONDS", "86400"))
+IDEMPOTENCY_CACHE_SIZE = int(os.getenv("IDEMPOTENCY_CACHE_SIZE", "10000"))
+REPLY_CACHE_SIZE = int(os.getenv("REPLY_CACHE_SIZE", "2000"))
+REPLY_CACHE_TTL_SECONDS = float(os.getenv("REPLY_CACHE_TTL_SECONDS", "3600"))
+PROMPT_CACHE_SIZE = int(os.getenv("PROMPT_CACHE_SIZE", "1024"))
+INTENT_MODEL_PATH = os.getenv("INTENT_MODEL_PATH", "intent_model.npz")
+INTENT_MODEL_MIN_PROB = float(os.getenv("INTENT_MODEL_MIN_PROB", "0.6"))
+LAZY_DRAFTS = os.getenv("LAZY_DRAFTS", "false").lower() == "true"
+LAZY_DRAFTS_PER_VIEW = int(os.getenv("LAZY_DRAFTS_PER_VIEW", "10"))
+LAZY_DRAFT_WORKERS = int(os.getenv("LAZY_DRAFT_WORKERS", "4"))
+HF_MAX_CONCURRENCY = int(os.getenv("HF_MAX_CONCURRENCY", "8"))
+HF_TENANT_CONCURRENCY = int(os.getenv("HF_TENANT_CONCURRENCY", "2"))
+HF_MAX_QUEUE = int(os.getenv("HF_MAX_QUEUE", "16"))
+HF_TENANT_MAX_QUEUE = int(os.getenv("HF_TENANT_MAX_QUEUE", str(2 * HF_TENANT_CONCURRENCY)))
+HF_DEADLINE_SECONDS = float(os.getenv("HF_DEADLINE_SECONDS", "8"))
+HF_BREAKER_FAILURES = int(os.getenv("HF_BREAKER_FAILURES", "5"))
+HF_BREAKER_COOLDOWN_SECONDS = float(os.getenv("HF_BREAKER_COOLDOWN_SECONDS", "30"))
+HF_BATCH_URL = os.getenv("HF_BATCH_URL", "")
+# Bearer token for the batch server; never the Hugging Face token.
+HF_BATCH_TOKEN = os.getenv("HF_BATCH_TOKEN", "")
+HF_BATCH_MAX_ITEMS = int(os.getenv("HF_BATCH_MAX_ITEMS", "16"))
+HF_BATCH_WAIT_MS = float(os.getenv("HF_BATCH_WAIT_MS", "5"))
+
+hf_client = AsyncInferenceClient(model=HF_MODEL, token=HF_TOKEN) if HF_TOKEN else None
+
+# Document store. Every helper below talks to it through the Firestore client
+# API subset (document/collection refs, where/order_by/limit/stream, get_all,
+# batch, merge sets with Increment transforms). It is the real Firestore
+# client, SqliteStore or MemoryStore (the DEV fallback), chosen by init_storage().
+_store = None
+_firebase_auth = None
 
-hf_client = InferenceClient(model=HF_MODEL, token=HF_TOKEN) if HF_TOKEN else None
 
-_firestore = None
-_firebase_auth = None
+# ============================================================
+# LOCAL DOCUMENT STORES (in-memory DEV store, durable single-node SQLite)
+# ============================================================
+_SQLITE_FIELD = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+_SQLITE_OPS = {"==": "=", "!=": "!=", "<": "<", "<=": "<=", ">": ">", ">=": ">="}
+_SQLITE_INDEXED_FIELDS = ("contact_id", "status", "created_ts", "last_inbound_ts", "ts")
+
+
+class DocIncrement:
+    def __init__(self, value: int):
+        self.value = value
+
+
+class DocFilter:
+    def __init__(self, field_path: str, op_string: str, value: Any):
+        self.field_path = field_path
+        self.op_string = op_string
+        self.value = value
+
+
+def _is_increment(value: Any) -> bool:
+    return isinstance(value, DocIncrement) or (type(value).__name__ == "Increment" and hasattr(value, "value"))
+
+
+def _apply_write(existing: Optional[Dict[str, Any]], data: Dict[str, Any], merge: bool) -> Dict[str, Any]:
+    out = dict(existing or {}) if merge else {}
+    for key, value in data.items():
+        out[key] = (out.get(key) or 0) + value.value if _is_increment(value) else value
+    return out
+
+
+class DocSnapshot:
+    def __init__(self, reference: "DocRef", data: Optional[Dict[str, Any]]):
+        self.reference = reference
+        self.id = reference.id
+        self._data = data
+
+    @property
+    def exists(self) -> bool:
+        return self._data is not None
+
+    def to_dict(self) -> Optional[Dict[str, Any]]:
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+
+class DocRef:
+    def __init__(self, store: "LocalStore", path: str):
+        self._store = store
+        self.path = path
+        self.id = path.rsplit("/", 1)[-1]
+
+    def get(self) -> DocSnapshot:
+        return DocSnapshot(self, self._store.read(self.path))
+
+    def set(self, data: Dict[str, Any], merge: bool = False):
+        self._store.commit([("set", self.path, data, merge)])
+
+    def update(self, data: Dict[str, Any]):
+        self._store.commit([("set", self.path, data, True)])
+
+    def delete(self):
+        self._store.commit([("delete", self.path, None, False)])
+
+    def collection(self, name: str) -> "DocQuery":
+        return DocQuery(self._store, f"{self.path}/{name}")
+
+
+class DocQuery:
+    def __init__(self, store: "LocalStore", path: str, filters=(), order=None, limit_to=None):
+        self._store = store
+        self.path = path
+        self.id = path.rsplit("/", 1)[-1]
+        self._filters = list(filters)
+        self._order = order
+        self._limit = limit_to
+
+    def document(self, doc_id: Optional[str] = None) -> DocRef:
+        return DocRef(self._store, f"{self.path}/{doc_id or uuid.uuid4().hex}")
+
+    def add(self, data: Dict[str, Any]):
+        ref = self.document()
+        ref.set(data)
+        return time.time(), ref
+
+    def where(self, field_path: Optional[str] = None, op_string: Optional[str] = None, value: Any = None, filter=None):
+        if filter is not None:
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        return DocQuery(self._store, self.path, [*self._filters, (field_path, op_string, value)], self._order, self._limit)
+
+    def order_by(self, field_path: str, direction: str = "ASCENDING"):
+        return DocQuery(self._store, self.path, self._filters, (field_path, str(direction).upper()), self._limit)
+
+    def limit(self, count: int):
+        return DocQuery(self._store, self.path, self._filters, self._order, count)
 
+    def stream(self):
+        for path, data in self._store.query(self.path, self._filters, self._order, self._limit):
+            yield DocSnapshot(DocRef(self._store, path), data)
 
-def init_firestore():
-    global _firestore, _firebase_auth
+    def get(self):
+        return list(self.stream())
+
+
+class DocBatch:
+    def __init__(self, store: "LocalStore"):
+        self._store = store
+        self._ops: List[tuple] = []
+
+    def set(self, ref: DocRef, data: Dict[str, Any], merge: bool = False):
+        self._ops.append(("set", ref.path, data, merge))
+
+    def update(self, ref: DocRef, data: Dict[str, Any]):
+        self._ops.append(("set", ref.path, data, True))
+
+    def delete(self, ref: DocRef):
+        self._ops.append(("delete", ref.path, None, False))
+
+    def commit(self):
+        self._store.commit(self._ops)
+        self._ops = []
+
+
+class LocalStore:
+    """Firestore client surface shared by the local stores.
+
+    Subclasses provide three primitives: read(path), commit(ops) applying a
+    list of ("set" | "delete", path, data, merge) atomically, and
+    query(parent, filters, order, limit) yielding (path, data) pairs.
+    """
+
+    def document(self, *parts: str) -> DocRef:
+        return DocRef(self, "/".join(parts))
+
+    def collection(self, *parts: str) -> DocQuery:
+        return DocQuery(self, "/".join(parts))
+
+    def batch(self) -> DocBatch:
+        return DocBatch(self)
+
+    def get_all(self, refs):
+        for ref in refs:
+            yield DocSnapshot(ref, self.read(ref.path))
+
+    def read(self, path: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def commit(self, ops: List[tuple]):
+        raise NotImplementedError
+
+    def query(self, parent: str, filters: List[tuple], order: Optional[tuple], limit: Optional[int]):
+        raise NotImplementedError
+
+
+# ------------------------------------------------------------
+# In-memory collections. Each collection path holds a MemoryCollection
+# with hash indexes for equality filters and sorted indexes for range
+# filters/ordering, mirroring the Firestore queries the endpoints issue.
+# ------------------------------------------------------------
+class MemoryCollection:
+    HASH_FIELDS = ("contact_id", "status")
+    SORTED_FIELDS = ("created_ts", "last_inbound_ts", "ts")
+
+    def __init__(self):
+        self.docs: Dict[str, Dict[str, Any]] = {}
+        self._hash: Dict[str, Dict[Any, set]] = {f: {} for f in self.HASH_FIELDS}
+        self._sorted: Dict[str, List[tuple]] = {f: [] for f in self.SORTED_FIELDS}
+        self._seq: Dict[str, int] = {}
+        self._next_seq = 0
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def _sortable(value: Any) -> bool:
+        return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+    def _index(self, doc_id: str, data: Dict[str, Any]):
+        for field, index in self._hash.items():
+            value = data.get(field)
+            if value is not None:
+                index.setdefault(value, set()).add(doc_id)
+        for field, rows in self._sorted.items():
+            value = data.get(field)
+            if self._sortable(value):
+                bisect.insort(rows, (value, doc_id))
+
+    def _unindex(self, doc_id: str, data: Dict[str, Any]):
+        for field, index in self._hash.items():
+            ids = index.get(data.get(field))
+            if ids is not None:
+                ids.discard(doc_id)
+        for field, rows in self._sorted.items():
+            value = data.get(field)
+            if self._sortable(value):
+                i = bisect.bisect_left(rows, (value, doc_id))
+                if i < len(rows) and rows[i] == (value, doc_id):
+                    del rows[i]
+
+    def set(self, doc_id: str, doc: Dict[str, Any]):
+        with self._lock:
+            prev = self.docs.get(doc_id)
+            if prev is not None:
+                self._unindex(doc_id, prev)
+            self.docs[doc_id] = doc
+            if doc_id not in self._seq:
+                self._seq[doc_id] = self._next_seq
+                self._next_seq += 1
+            self._index(doc_id, doc)
+
+    def get(self, doc_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            return self.docs.get(doc_id)
+
+    def delete(self, doc_id: str):
+        with self._lock:
+            prev = self.docs.pop(doc_id, None)
+            self._seq.pop(doc_id, None)
+            if prev is not None:
+                self._unindex(doc_id, prev)
+
+    def _range_ids(self, field: str, op: str, value: Any) -> List[str]:
+        rows = self._sorted[field]
+        if op == "==":
+            lo, hi = bisect.bisect_left(rows, (value,)), bisect.bisect_right(rows, (value, "\uffff"))
+        elif op in (">", ">="):
+            lo = bisect.bisect_right(rows, (value, "\uffff")) if op == ">" else bisect.bisect_left(rows, (value,))
+            hi = len(rows)
+        else:
+            lo = 0
+            hi = bisect.bisect_left(rows, (value,)) if op == "<" else bisect.bisect_right(rows, (value, "\uffff"))
+        return [doc_id for _, doc_id in rows[lo:hi]]
+
+    def query(
+        self,
+        filters: Optional[List[tuple]] = None,
+        order_by: Optional[str] = None,
+        descending: bool = False,
+        limit: Optional[int] = None,
+    ) -> List[tuple]:
+        """Firestore-style query returning (doc_id, doc) pairs; docs missing a filtered/ordered field never match."""
+        filters = list(filters or [])
+        with self._lock:
+            candidates: Optional[List[str]] = None
+            for field, op, value in filters:
+                if op == "==" and field in self._hash:
+                    candidates = list(self._hash[field].get(value, ()))
+                    break
+            if candidates is None:
+                for field, op, value in filters:
+                    if field in self._sorted and op in ("==", ">", ">=", "<", "<=") and self._sortable(value):
+                        candidates = self._range_ids(field, op, value)
+                        break
+            if candidates is None:
+                candidates = list(self.docs)
+            else:
+                # Index hits come back in index order; restore insertion order.
+                candidates.sort(key=lambda i: self._seq.get(i, 0))
+            rows = [(i, self.docs[i]) for i in candidates if i in self.docs]
+            rows = [(i, r) for i, r in rows if all(_memory_match(r, f, op, v) for f, op, v in filters)]
+            if order_by:
+                rows = [(i, r) for i, r in rows if r.get(order_by) is not None]
+                rows.sort(key=lambda row: row[1][order_by], reverse=descending)
+            if limit is not None:
+                rows = rows[:limit]
+            return rows
+
+
+def _memory_match(row: Dict[str, Any], field: str, op: str, value: Any) -> bool:
+    current = row.get(field)
+    if current is None:
+        return False
     try:
-        import firebase_admin
-        from firebase_admin import credentials, auth
-        from google.cloud import firestore
+        if op == "==":
+            return current == value
+        if op == "!=":
+            return current != value
+        if op == ">":
+            return current > value
+        if op == ">=":
+            return current >= value
+        if op == "<":
+            return current < value
+        if op == "<=":
+            return current <= value
+        if op == "in":
+            return current in value
+        if op == "array_contains":
+            return value in current
+    except TypeError:
+        return False
+    raise ValueError(f"Unsupported query operator: {op}")
+
+
+class MemoryStore(LocalStore):
+    """In-process document store (STORAGE_BACKEND=memory and the DEV fallback); lost on restart.
+
+    Stored docs are never mutated in place: writes store a fresh copy and
+    snapshots deep-copy on to_dict(). A store-wide lock makes each write set
+    (single set, merge, batch) atomic.
+    """
+
+    # Nothing to save by buffering counter increments in process memory.
+    write_through_counters = True
+
+    def __init__(self):
+        self._collections: Dict[str, MemoryCollection] = {}
+        self._lock = threading.RLock()
+
+    def read(self, path: str) -> Optional[Dict[str, Any]]:
+        parent, _, doc_id = path.rpartition("/")
+        col = self._collections.get(parent)
+        return col.get(doc_id) if col is not None else None
+
+    def commit(self, ops: List[tuple]):
+        with self._lock:
+            for kind, path, data, merge in ops:
+                parent, _, doc_id = path.rpartition("/")
+                if kind == "delete":
+                    col = self._collections.get(parent)
+                    if col is not None:
+                        col.delete(doc_id)
+                    continue
+                col = self._collections.setdefault(parent, MemoryCollection())
+                col.set(doc_id, _apply_write(col.get(doc_id), copy.deepcopy(data), merge))
+
+    def query(self, parent: str, filters: List[tuple], order: Optional[tuple], limit: Optional[int]):
+        col = self._collections.get(parent)
+        if col is None:
+            return
+        field, direction = order or (None, "ASCENDING")
+        for doc_id, data in col.query(filters, field, direction.startswith("DESC"), limit):
+            yield f"{parent}/{doc_id}", data
+
+
+class SqliteStore(LocalStore):
+    """Durable document store on SQLite (WAL), exposing the Firestore client subset the app uses.
+
+    Documents live in one table keyed by full path with their parent collection
+    path; JSON expression indexes cover the fields the endpoints filter and order on.
+    Every write set (single set, merge, batch) is one IMMEDIATE transaction, so
+    merges and Increment transforms are atomic across threads and processes.
+    """
+
+    def __init__(self, path: str):
+        self.db_path = path
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS docs ("
+            "path TEXT PRIMARY KEY, parent TEXT NOT NULL, data TEXT NOT NULL, updated_ts REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS docs_parent ON docs(parent)")
+        for field in _SQLITE_INDEXED_FIELDS:
+            conn.execute(
+                f"CREATE INDEX IF NOT EXISTS docs_{field} ON docs(parent, json_extract(data, '$.{field}'))"
+            )
 
-        if not firebase_admin._apps:
-            if GOOGLE_APPLICATION_CREDENTIALS and os.path.exists(GOOGLE_APPLICATION_CREDENTIALS):
-                cred = credentials.Certificate(GOOGLE_APPLICATION_CREDENTIALS)
-                firebase_admin.initialize_app(
-                    cred,
-                    {"projectId": FIREBASE_PROJECT_ID} if FIREBASE_PROJECT_ID else None,
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get_all(self, refs):
+        refs = list(refs)
+        found: Dict[str, Dict[str, Any]] = {}
+        paths = [r.path for r in refs]
+        for start in range(0, len(paths), 500):
+            chunk = paths[start:start + 500]
+            marks = ",".join("?" * len(chunk))
+            for path, data in self._conn().execute(f"SELECT path, data FROM docs WHERE path IN ({marks})", chunk):
+                found[path] = json.loads(data)
+        for ref in refs:
+            yield DocSnapshot(ref, found.get(ref.path))
+
+    def read(self, path: str) -> Optional[Dict[str, Any]]:
+        row = self._conn().execute("SELECT data FROM docs WHERE path = ?", (path,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def commit(self, ops: List[tuple]):
+        if not ops:
+            return
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for kind, path, data, merge in ops:
+                if kind == "delete":
+                    conn.execute("DELETE FROM docs WHERE path = ?", (path,))
+                    continue
+                existing = None
+                if merge:
+                    row = conn.execute("SELECT data FROM docs WHERE path = ?", (path,)).fetchone()
+                    existing = json.loads(row[0]) if row else None
+                doc = _apply_write(existing, data, merge)
+                conn.execute(
+                    "INSERT INTO docs(path, parent, data, updated_ts) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT(path) DO UPDATE SET data = excluded.data, updated_ts = excluded.updated_ts",
+                    (path, path.rpartition("/")[0], json.dumps(doc), time.time()),
                 )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def query(self, parent: str, filters: List[tuple], order: Optional[tuple], limit: Optional[int]):
+        sql = ["SELECT path, data FROM docs WHERE parent = ?"]
+        params: List[Any] = [parent]
+        for field, op, value in filters:
+            if not _SQLITE_FIELD.match(field or ""):
+                raise ValueError(f"Unsupported field path: {field}")
+            expr = f"json_extract(data, '$.{field}')"
+            if op in _SQLITE_OPS:
+                sql.append(f"AND {expr} {_SQLITE_OPS[op]} ?")
+                params.append(value)
+            elif op == "in":
+                values = list(value or [])
+                sql.append(f"AND {expr} IN ({','.join('?' * len(values)) or 'NULL'})")
+                params.extend(values)
+            elif op == "array_contains":
+                sql.append(f"AND EXISTS (SELECT 1 FROM json_each(data, '$.{field}') WHERE value = ?)")
+                params.append(value)
             else:
-                firebase_admin.initialize_app(
-                    options={"projectId": FIREBASE_PROJECT_ID} if FIREBASE_PROJECT_ID else None
-                )
-        _firebase_auth = auth
-        _firestore = firestore.Client(project=FIREBASE_PROJECT_ID) if FIREBASE_PROJECT_ID else firestore.Client()
+                raise ValueError(f"Unsupported query operator: {op}")
+        if order:
+            field, direction = order
+            if not _SQLITE_FIELD.match(field):
+                raise ValueError(f"Unsupported field path: {field}")
+            expr = f"json_extract(data, '$.{field}')"
+            sql.append(f"AND {expr} IS NOT NULL ORDER BY {expr} {'DESC' if direction.startswith('DESC') else 'ASC'}")
+        else:
+            sql.append("ORDER BY path")
+        if limit is not None:
+            sql.append("LIMIT ?")
+            params.append(int(limit))
+        for path, data in self._conn().execute(" ".join(sql), params).fetchall():
+            yield path, json.loads(data)
+
+
+def fs_increment(amount: int):
+    """Atomic counter transform for the active document store."""
+    if isinstance(_store, LocalStore):
+        return DocIncrement(amount)
+    from google.cloud.firestore import Increment
+    return Increment(amount)
+
+
+def fs_filter(field_path: str, op_string: str, value: Any):
+    if isinstance(_store, LocalStore):
+        return DocFilter(field_path, op_string, value)
+    from google.cloud.firestore import FieldFilter
+    return FieldFilter(field_path, op_string, value)
+
+
+def init_firebase_auth():
+    import firebase_admin
+    from firebase_admin import credentials, auth
+
+    if not firebase_admin._apps:
+        if GOOGLE_APPLICATION_CREDENTIALS and os.path.exists(GOOGLE_APPLICATION_CREDENTIALS):
+            cred = credentials.Certificate(GOOGLE_APPLICATION_CREDENTIALS)
+            firebase_admin.initialize_app(
+                cred,
+                {"projectId": FIREBASE_PROJECT_ID} if FIREBASE_PROJECT_ID else None,
+            )
+        else:
+            firebase_admin.initialize_app(
+                options={"projectId": FIREBASE_PROJECT_ID} if FIREBASE_PROJECT_ID else None
+            )
+    return auth
+
+
+def init_storage():
+    """Select the document store from STORAGE_BACKEND (firestore falls back to MemoryStore)."""
+    global _store, _firebase_auth
+    if STORAGE_BACKEND == "firestore":
+        init_store()
+        return
+    _store = SqliteStore(SQLITE_PATH) if STORAGE_BACKEND == "sqlite" else MemoryStore()
+    try:
+        _firebase_auth = init_firebase_auth()
+    except Exception as e:
+        _firebase_auth = None
+        print("Firebase Admin auth not initialized. DEV tokens only.")
+        print("Reason:", repr(e))
+
+
+def init_store():
+    global _store, _firebase_auth
+    try:
+        from google.cloud import firestore
+
+        _firebase_auth = init_firebase_auth()
+        _store = firestore.Client(project=FIREBASE_PROJECT_ID) if FIREBASE_PROJECT_ID else firestore.Client()
     except Exception as e:
-        _firestore = None
+        _store = MemoryStore()
         _firebase_auth = None
         print("Firebase/Firestore not initialized. DEV fallback mode.")
         print("Reason:", repr(e))
 
 
-init_firestore()
+init_storage()
+
 
-DEV_DB: Dict[str, Any] = {"users": {}}
+def dev_mode() -> bool:
+    """True when running on the in-memory store (explicitly or as the Firestore fallback)."""
+    return isinstance(_store, MemoryStore)
 
 # ============================================================
 # AUTH
@@ -88,7 +631,161 @@ class AuthedUser(BaseModel):
     email: Optional[str] = None
 
 
-def get_user(authorization: Optional[str] = Header(default=None)) -> AuthedUser:
+# Verified ID tokens keyed by sha256(token) -> (expires_at, AuthedUser). Entries never
+# outlive the token's own `exp` claim, and are capped at AUTH_CACHE_MAX_TTL so a
+# disabled account stops working within a bounded window.
+_TOKEN_CACHE: "OrderedDict[str, tuple]" = OrderedDict()
+_BOOTSTRAPPED_UIDS: set = set()
+_AUTH_LOCK = threading.Lock()
+AUTH_STATS: Dict[str, int] = {"token_hits": 0, "token_misses": 0, "token_evictions": 0, "bootstrap_runs": 0, "bootstrap_skips": 0}
+
+
+def _token_key(token: str) -> str:
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+def _cached_token_user(token: str) -> Optional[AuthedUser]:
+    key = _token_key(token)
+    now = time.time()
+    with _AUTH_LOCK:
+        entry = _TOKEN_CACHE.get(key)
+        if entry is None:
+            AUTH_STATS["token_misses"] += 1
+            return None
+        expires_at, user = entry
+        if expires_at <= now:
+            del _TOKEN_CACHE[key]
+            AUTH_STATS["token_misses"] += 1
+            return None
+        _TOKEN_CACHE.move_to_end(key)
+        AUTH_STATS["token_hits"] += 1
+        return user
+
+
+def _remember_token(token: str, user: AuthedUser, exp: Optional[float]):
+    expires_at = time.time() + AUTH_CACHE_MAX_TTL
+    if exp:
+        expires_at = min(expires_at, float(exp))
+    if AUTH_CACHE_SIZE <= 0 or expires_at <= time.time():
+        return
+    key = _token_key(token)
+    with _AUTH_LOCK:
+        _TOKEN_CACHE[key] = (expires_at, user)
+        _TOKEN_CACHE.move_to_end(key)
+        while len(_TOKEN_CACHE) > AUTH_CACHE_SIZE:
+            _TOKEN_CACHE.popitem(last=False)
+            AUTH_STATS["token_evictions"] += 1
+
+
+def bootstrap_user(uid: str, email: Optional[str] = None):
+    """Create the user doc and workspace membership once per process."""
+    with _AUTH_LOCK:
+        if uid in _BOOTSTRAPPED_UIDS:
+            AUTH_STATS["bootstrap_skips"] += 1
+            return
+    ensure_user(uid)
+    ensure_workspace_member(uid, email)
+    with _AUTH_LOCK:
+        _BOOTSTRAPPED_UIDS.add(uid)
+        AUTH_STATS["bootstrap_runs"] += 1
+
+
+def invalidate_bootstrap(uid: str):
+    with _AUTH_LOCK:
+        _BOOTSTRAPPED_UIDS.discard(uid)
+
+
+class RequestContext:
+    """Per-request memo of the caller's access config, workspace and membership.
+
+    Built once by get_user; the scoped helpers consult it through current_context()
+    so one request resolves config/access and config/members at most once.
+    """
+
+    def __init__(self, user: AuthedUser):
+        self.user = user
+        self.uid = user.uid
+        self._access: Optional[AccessConfig] = None
+        self._members: Dict[str, List[Dict[str, Any]]] = {}
+        self._roles: Dict[str, str] = {}
+        self.prefetched: Dict[str, Optional[Dict[str, Any]]] = {}
+        self.uow: Optional[UnitOfWork] = None
+
+    @property
+    def access(self) -> AccessConfig:
+        if self._access is None:
+            self._access = get_root_cfg(self.uid, "access", AccessConfig, AccessConfig())
+        return self._access
+
+    @property
+    def workspace_id(self) -> str:
+        return self.access.workspace_id or "primary"
+
+    def members(self, ws_id: str) -> List[Dict[str, Any]]:
+        if ws_id not in self._members:
+            self._members[ws_id] = _load_workspace_members(self.uid, ws_id)
+        return list(self._members[ws_id])
+
+    def role(self, ws_id: Optional[str] = None) -> str:
+        workspace_id = ws_id or self.workspace_id
+        if workspace_id not in self._roles:
+            self._roles[workspace_id] = _resolve_role(self.access, self.members(workspace_id), self.uid)
+        return self._roles[workspace_id]
+
+    def set_access(self, access: AccessConfig):
+        self._access = access
+        self._roles.clear()
+
+    def set_members(self, ws_id: str, items: List[Dict[str, Any]]):
+        self._members[ws_id] = list(items)
+        self._roles.pop(ws_id, None)
+
+    def fork(self) -> "RequestContext":
+        """Same caller, access and members, with its own unit of work for work on another thread."""
+        ctx = RequestContext(self.user)
+        ctx._access = self._access
+        ctx._members = dict(self._members)
+        ctx._roles = dict(self._roles)
+        return ctx
+
+
+_REQUEST_CTX: contextvars.ContextVar[Optional[RequestContext]] = contextvars.ContextVar("request_ctx", default=None)
+
+
+def current_context(uid: str) -> Optional[RequestContext]:
+    ctx = _REQUEST_CTX.get()
+    if ctx is not None and ctx.uid == uid:
+        return ctx
+    return None
+
+
+def workspace_context(uid: str, ws_id: str) -> RequestContext:
+    """Context for background work, pinned to the workspace the work was created in
+    so a later workspace switch can't redirect it."""
+    ctx = RequestContext(AuthedUser(uid=uid))
+    access = get_root_cfg(uid, "access", AccessConfig, AccessConfig())
+    ctx.set_access(access.model_copy(update={"workspace_id": ws_id}))
+    return ctx
+
+
+@contextmanager
+def use_context(ctx: RequestContext):
+    """Install `ctx` for code running outside the request task (pool threads, streams)."""
+    token = _REQUEST_CTX.set(ctx)
+    try:
+        yield ctx
+    finally:
+        _REQUEST_CTX.reset(token)
+
+
+async def get_user(authorization: Optional[str] = Header(default=None)) -> AuthedUser:
+    # Async so the context var set here is visible to the (threadpooled) endpoint.
+    user = await run_in_threadpool(authenticate, authorization)
+    _REQUEST_CTX.set(RequestContext(user))
+    return user
+
+
+def authenticate(authorization: Optional[str]) -> AuthedUser:
     if not authorization:
         raise HTTPException(status_code=401, detail="Missing Authorization header")
     parts = authorization.split(" ", 1)
@@ -104,19 +801,20 @@ def get_user(authorization: Optional[str] = Header(default=None)) -> AuthedUser:
             if not ALLOW_DEV_TOKENS:
                 raise HTTPException(status_code=401, detail="Dev tokens are disabled")
             uid = token.replace("dev-", "", 1)
-            ensure_user(uid)
-            ensure_workspace_member(uid)
+            bootstrap_user(uid)
             return AuthedUser(uid=uid)
         raise HTTPException(status_code=401, detail="Firebase Admin not configured. Use Bearer dev-<uid> in DEV.")
 
-    try:
-        decoded = _firebase_auth.verify_id_token(token)
-        user = AuthedUser(uid=decoded["uid"], email=decoded.get("email"))
-        ensure_user(user.uid)
-        ensure_workspace_member(user.uid, user.email)
-        return user
-    except Exception:
-        raise HTTPException(status_code=401, detail="Invalid Firebase ID token")
+    user = _cached_token_user(token)
+    if user is None:
+        try:
+            decoded = _firebase_auth.verify_id_token(token)
+            user = AuthedUser(uid=decoded["uid"], email=decoded.get("email"))
+        except Exception:
+            raise HTTPException(status_code=401, detail="Invalid Firebase ID token")
+        _remember_token(token, user, decoded.get("exp"))
+    bootstrap_user(user.uid, user.email)
+    return user
 
 
 # ============================================================
@@ -244,10 +942,33 @@ class NotificationRouting(BaseModel):
     min_severity: Literal["low", "medium", "high"] = "high"
 
 
+class DeliveryJob(BaseModel):
+    id: str
+    uid: str
+    workspace_id: str
+    notification_id: Optional[str] = None
+    channel: Literal["email", "sms"]
+    to: str
+    subject: str = ""
+    body: str
+    status: Literal["queued", "retrying", "sent", "failed"] = "queued"
+    attempts: int = 0
+    last_error: Optional[str] = None
+    created_ts: float = Field(default_factory=lambda: time.time())
+    updated_ts: float = Field(default_factory=lambda: time.time())
+
+
 class WorkspaceSelect(BaseModel):
     id: str
 
 
+class StatsSettings(BaseModel):
+    shard_count: int = Field(default=1, ge=1, le=64)
+    # Highest shard count ever used; readers sum this many shards so lowering
+    # shard_count never hides counts already written to the upper shards.
+    shard_high_water: int = Field(default=1, ge=1, le=64)
+
+
 class Contact(BaseModel):
     id: str
     name: str = ""
@@ -276,11 +997,25 @@ class Message(BaseModel):
     ts: float = Field(default_factory=lambda: time.time())
 
 
+class IntentKeywords(BaseModel):
+    # Per-category keyword edits on top of INTENT_KEYWORDS, e.g.
+    # {"add": {"booking": ["reserve"]}, "remove": {"hours": ["close"]}}.
+    add: Dict[str, List[str]] = {}
+    remove: Dict[str, List[str]] = {}
+
+
 class InboundMessage(BaseModel):
     contact_id: str
     channel: Channel = "webchat"
     text: str
     ts: float = Field(default_factory=lambda: time.time())
+    # Provider message id (Twilio MessageSid, SendGrid Message-ID, ...) or any
+    # client key; redeliveries with the same key return the first result.
+    idempotency_key: Optional[str] = None
+
+
+class InboundBatchRequest(BaseModel):
+    items: List[InboundMessage]
 
 
 class ChatRequest(BaseModel):
@@ -307,6 +1042,26 @@ class Decision(BaseModel):
     reason: str
     draft: str
     created_ts: float = Field(default_factory=lambda: time.time())
+    # Kept for offline intent model training; intent_model is the scoring model's version
+    # and intent_source says whether the keywords or the model named the intent.
+    inbound_text: str = ""
+    intent_model: str = ""
+    intent_source: Literal["keywords", "model"] = "keywords"
+    draft_pending: bool = False
+
+
+class InboundJob(BaseModel):
+    id: str
+    status: Literal["queued", "processing", "done", "error"] = "queued"
+    workspace_id: str
+    contact_id: str
+    thread_id: str
+    inbound: InboundMessage
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    attempts: int = 0
+    created_ts: float = Field(default_factory=lambda: time.time())
+    updated_ts: float = Field(default_factory=lambda: time.time())
 
 
 class ActionQueueItem(BaseModel):
@@ -321,6 +1076,14 @@ class ActionQueueItem(BaseModel):
     confidence: float
     created_ts: float = Field(default_factory=lambda: time.time())
     sent_ts: Optional[float] = None
+    # LAZY_DRAFTS: the draft is generated from these when the queue is viewed or the action approved.
+    draft_pending: bool = False
+    intent: str = ""
+    inbound_text: str = ""
+    # Set when an owner approves or blocks the action; corrected_intent is the
+    # intent they said the message really had. Both feed intent model training.
+    reviewed_ts: Optional[float] = None
+    corrected_intent: str = ""
 
 
 class Outcome(BaseModel):
@@ -342,14 +1105,14 @@ class Outcome(BaseModel):
 
 
 # ============================================================
-# FIRESTORE HELPERS (with DEV fallback)
+# DOCUMENT STORE HELPERS
 # ============================================================
 def fs_doc(path: str):
-    return _firestore.document(path)
+    return _store.document(path)
 
 
 def fs_col(path: str):
-    return _firestore.collection(path)
+    return _store.collection(path)
 
 
 def root_path(uid: str, subpath: str = "") -> str:
@@ -357,19 +1120,17 @@ def root_path(uid: str, subpath: str = "") -> str:
     return f"{base}/{subpath}" if subpath else base
 
 
-def get_root_scope(uid: str) -> Dict[str, Any]:
-    u = DEV_DB["users"].setdefault(uid, {})
-    return u.setdefault("_root", {})
-
-
 def get_access_config(uid: str) -> AccessConfig:
+    ctx = current_context(uid)
+    if ctx is not None:
+        return ctx.access
     return get_root_cfg(uid, "access", AccessConfig, AccessConfig())
 
 
 def require_role(user: AuthedUser, allowed: List[str]):
     access = get_access_config(user.uid)
     role = get_workspace_role(user.uid, access.workspace_id)
-    if _firestore is None and role == "Agent" and "Owner" in allowed and ALLOW_DEV_TOKENS:
+    if dev_mode() and role == "Agent" and "Owner" in allowed and ALLOW_DEV_TOKENS:
         return access
     if role not in allowed:
         raise HTTPException(status_code=403, detail="Insufficient role for this action")
@@ -422,19 +1183,6 @@ def scoped_path_for(uid: str, ws_id: str, subpath: str = "") -> str:
     return f"{base}/{subpath}" if subpath else base
 
 
-def get_ws_scope(uid: str) -> Dict[str, Any]:
-    u = DEV_DB["users"].setdefault(uid, {})
-    workspaces = u.setdefault("_workspaces", {})
-    ws = get_workspace_id(uid)
-    return workspaces.setdefault(ws, {})
-
-
-def get_ws_scope_for(uid: str, ws_id: str) -> Dict[str, Any]:
-    u = DEV_DB["users"].setdefault(uid, {})
-    workspaces = u.setdefault("_workspaces", {})
-    return workspaces.setdefault(ws_id, {})
-
-
 def fs_doc_uid(uid: str, subpath: str):
     return fs_doc(scoped_path(uid, subpath))
 
@@ -452,82 +1200,670 @@ def fs_col_ws(uid: str, ws_id: str, subpath: str):
 
 
 def ensure_user(uid: str):
-    if _firestore is None:
-        DEV_DB["users"].setdefault(uid, {})
-        return
+    with _AUTH_LOCK:
+        if uid in _BOOTSTRAPPED_UIDS:
+            return
     ref = fs_doc(root_path(uid))
     if not ref.get().exists:
         ref.set({"created_ts": time.time()})
 
 
+# ------------------------------------------------------------
+# Config cache. Rarely-changing config docs are cached per
+# process with TTL + LRU eviction and written through by the set_* helpers.
+# Every write also bumps `{scope}/config/_version`; other processes compare
+# that stamp at most every CONFIG_VERSION_CHECK_SECONDS and drop the scope's
+# entries when it moves, which bounds cross-worker staleness. Missing docs
+# are cached as None so optional configs don't cost a read per lookup.
+# ------------------------------------------------------------
+CACHED_CONFIGS = {
+    "access",
+    "businessProfile",
+    "ownerCover",
+    "notificationRouting",
+    "billing",
+    "integrations",
+    "team",
+    "automationRules",
+    "guardrails",
+    "securityPolicies",
+    "workspaces",
+    "members",
+    "stats",
+    "intentKeywords",
+}
+
+_CONFIG_CACHE: "OrderedDict[str, tuple]" = OrderedDict()
+_CONFIG_VERSIONS: "OrderedDict[str, tuple]" = OrderedDict()
+_CONFIG_LOCK = threading.Lock()
+CONFIG_CACHE_STATS: Dict[str, int] = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0, "version_checks": 0}
+
+
+def _config_scope(path: str) -> str:
+    return path.rsplit("/config/", 1)[0]
+
+
+def _config_cacheable(path: str) -> bool:
+    return CONFIG_CACHE_SIZE > 0 and "/config/" in path and path.rsplit("/", 1)[-1] in CACHED_CONFIGS
+
+
+def _drop_config_scope_locked(scope: str):
+    prefix = f"{scope}/config/"
+    for key in [k for k in _CONFIG_CACHE if k.startswith(prefix)]:
+        del _CONFIG_CACHE[key]
+    CONFIG_CACHE_STATS["invalidations"] += 1
+
+
+def _remember_config_version_locked(scope: str, version: Optional[str]):
+    # Bounded like the entries themselves. A scope whose stamp is evicted
+    # loses its entries too, so it can't come back holding stale data that
+    # the next (unknown-baseline) version check would accept.
+    _CONFIG_VERSIONS[scope] = (time.time(), version)
+    _CONFIG_VERSIONS.move_to_end(scope)
+    while len(_CONFIG_VERSIONS) > max(CONFIG_CACHE_SIZE, 1):
+        old_scope, _ = _CONFIG_VERSIONS.popitem(last=False)
+        _drop_config_scope_locked(old_scope)
+
+
+def _config_version_due(scope: str) -> bool:
+    with _CONFIG_LOCK:
+        seen = _CONFIG_VERSIONS.get(scope)
+    return seen is None or time.time() - seen[0] >= CONFIG_VERSION_CHECK_SECONDS
+
+
+def _apply_config_version(scope: str, version: Optional[str]):
+    with _CONFIG_LOCK:
+        seen = _CONFIG_VERSIONS.get(scope)
+        CONFIG_CACHE_STATS["version_checks"] += 1
+        if seen is not None and seen[1] != version:
+            _drop_config_scope_locked(scope)
+        _remember_config_version_locked(scope, version)
+
+
+def _check_config_version(scope: str):
+    if not _config_version_due(scope):
+        return
+    snap = fs_doc(f"{scope}/config/_version").get()
+    _apply_config_version(scope, (snap.to_dict() or {}).get("v") if snap.exists else None)
+
+
+def config_version_stamp(scope: str) -> Optional[str]:
+    """The scope's config version as of the last check; None if it has none or none is known yet."""
+    with _CONFIG_LOCK:
+        seen = _CONFIG_VERSIONS.get(scope)
+    return seen[1] if seen is not None else None
+
+
+def _config_fresh(path: str) -> bool:
+    with _CONFIG_LOCK:
+        entry = _CONFIG_CACHE.get(path)
+        return entry is not None and entry[0] > time.time()
+
+
+def _store_config(path: str, data: Optional[Dict[str, Any]]):
+    with _CONFIG_LOCK:
+        _CONFIG_CACHE[path] = (time.time() + CONFIG_CACHE_TTL, copy.deepcopy(data))
+        _CONFIG_CACHE.move_to_end(path)
+        while len(_CONFIG_CACHE) > CONFIG_CACHE_SIZE:
+            _CONFIG_CACHE.popitem(last=False)
+            CONFIG_CACHE_STATS["evictions"] += 1
+
+
+def read_config_doc(path: str) -> Optional[Dict[str, Any]]:
+    """Return the config doc at `path` (None if missing), served from cache when fresh."""
+    found, data = take_prefetched(path)
+    if found:
+        return data
+    if not _config_cacheable(path):
+        snap = fs_doc(path).get()
+        return (snap.to_dict() or {}) if snap.exists else None
+    _check_config_version(_config_scope(path))
+    with _CONFIG_LOCK:
+        entry = _CONFIG_CACHE.get(path)
+        if entry is not None and entry[0] > time.time():
+            _CONFIG_CACHE.move_to_end(path)
+            CONFIG_CACHE_STATS["hits"] += 1
+            return copy.deepcopy(entry[1])
+        CONFIG_CACHE_STATS["misses"] += 1
+    snap = fs_doc(path).get()
+    data = (snap.to_dict() or {}) if snap.exists else None
+    _store_config(path, data)
+    return data
+
+
+def write_config_doc(path: str, data: Dict[str, Any]):
+    forget_prefetched(path)
+    fs_doc(path).set(data)
+    if not _config_cacheable(path):
+        return
+    _store_config(path, data)
+    scope = _config_scope(path)
+    version = uuid.uuid4().hex
+    fs_doc(f"{scope}/config/_version").set({"v": version, "ts": time.time()})
+    with _CONFIG_LOCK:
+        _remember_config_version_locked(scope, version)
+
+
+def config_cache_stats() -> Dict[str, Any]:
+    with _CONFIG_LOCK:
+        size = len(_CONFIG_CACHE)
+    lookups = CONFIG_CACHE_STATS["hits"] + CONFIG_CACHE_STATS["misses"]
+    return {
+        **CONFIG_CACHE_STATS,
+        "size": size,
+        "hit_ratio": round(CONFIG_CACHE_STATS["hits"] / lookups, 4) if lookups else 0.0,
+    }
+
+
+# ------------------------------------------------------------
+# Bulk document loading. get_docs() fetches many docs in one get_all RPC.
+# prefetch_docs() stashes the results on the request context so the regular
+# read helpers pick them up instead of issuing their own round trips.
+# ------------------------------------------------------------
+_FETCH_POOL: Optional[ThreadPoolExecutor] = None
+_FETCH_POOL_LOCK = threading.Lock()
+
+
+def fetch_pool() -> ThreadPoolExecutor:
+    global _FETCH_POOL
+    if _FETCH_POOL is None:
+        with _FETCH_POOL_LOCK:
+            if _FETCH_POOL is None:
+                _FETCH_POOL = ThreadPoolExecutor(max_workers=FETCH_POOL_WORKERS, thread_name_prefix="fs-fetch")
+    return _FETCH_POOL
+
+
+def _get_all_chunk(paths: List[str]) -> List[tuple]:
+    return [
+        (snap.reference.path, (snap.to_dict() or {}) if snap.exists else None)
+        for snap in _store.get_all([fs_doc(p) for p in paths])
+    ]
+
+
+def get_docs(paths: List[str]) -> Dict[str, Optional[Dict[str, Any]]]:
+    """Fetch documents by full path; missing docs map to None.
+
+    Large lists are split into GET_ALL_BATCH_SIZE chunks fetched concurrently on
+    the shared fetch pool, so latency tracks the number of batches.
+    """
+    out: Dict[str, Optional[Dict[str, Any]]] = {p: None for p in paths}
+    if not paths:
+        return out
+    unique = list(dict.fromkeys(paths))
+    size = max(1, GET_ALL_BATCH_SIZE)
+    chunks = [unique[i:i + size] for i in range(0, len(unique), size)]
+    if len(chunks) == 1:
+        results = [_get_all_chunk(chunks[0])]
+    else:
+        results = list(fetch_pool().map(_get_all_chunk, chunks))
+    for rows in results:
+        for path, data in rows:
+            out[path] = data
+    return out
+
+
+def take_prefetched(path: str):
+    ctx = _REQUEST_CTX.get()
+    if ctx is None or path not in ctx.prefetched:
+        return False, None
+    return True, ctx.prefetched.pop(path)
+
+
+def forget_prefetched(path: str):
+    ctx = _REQUEST_CTX.get()
+    if ctx is not None:
+        ctx.prefetched.pop(path, None)
+
+
+def prefetch_docs(uid: str, paths: List[str]):
+    """Load `paths` in one round trip; fresh cached configs are skipped."""
+    ctx = current_context(uid)
+    if ctx is None:
+        return
+    wanted: List[str] = []
+    version_scopes: Dict[str, str] = {}
+    for path in paths:
+        if _config_cacheable(path):
+            scope = _config_scope(path)
+            if _config_version_due(scope):
+                version_scopes[f"{scope}/config/_version"] = scope
+            elif _config_fresh(path):
+                continue
+        wanted.append(path)
+    fetched = get_docs([*version_scopes, *wanted])
+    for version_path, scope in version_scopes.items():
+        _apply_config_version(scope, (fetched.get(version_path) or {}).get("v"))
+    for path in wanted:
+        data = fetched.get(path)
+        if data is not None and _config_cacheable(path):
+            _store_config(path, data)
+        else:
+            ctx.prefetched[path] = data
+
+
 def get_root_cfg(uid: str, name: str, model_cls, default_obj):
-    if _firestore is None:
-        u = get_root_scope(uid)
-        raw = u.get(name)
-        return model_cls(**raw) if raw else default_obj
-    ref = fs_doc(root_path(uid, f"config/{name}"))
-    snap = ref.get()
-    if snap.exists:
-        return model_cls(**snap.to_dict())
-    ref.set(default_obj.model_dump())
+    path = root_path(uid, f"config/{name}")
+    raw = read_config_doc(path)
+    if raw is not None:
+        return model_cls(**raw)
+    write_config_doc(path, default_obj.model_dump())
     return default_obj
 
 
 def set_root_cfg(uid: str, name: str, obj):
-    if _firestore is None:
-        u = get_root_scope(uid)
-        u[name] = obj.model_dump()
-        return
-    fs_doc(root_path(uid, f"config/{name}")).set(obj.model_dump())
+    if name == "access":
+        invalidate_bootstrap(uid)
+        ctx = current_context(uid)
+        if ctx is not None:
+            ctx.set_access(obj)
+    write_config_doc(root_path(uid, f"config/{name}"), obj.model_dump())
 
 
 def get_cfg(uid: str, name: str, model_cls, default_obj):
-    if _firestore is None:
-        u = get_ws_scope(uid)
-        raw = u.get(name)
-        return model_cls(**raw) if raw else default_obj
-    ref = fs_doc_uid(uid, f"config/{name}")
-    snap = ref.get()
-    if snap.exists:
-        return model_cls(**snap.to_dict())
-    ref.set(default_obj.model_dump())
+    path = scoped_path(uid, f"config/{name}")
+    raw = read_config_doc(path)
+    if raw is not None:
+        return model_cls(**raw)
+    write_config_doc(path, default_obj.model_dump())
     return default_obj
 
 
 def set_cfg(uid: str, name: str, obj):
-    if _firestore is None:
-        u = get_ws_scope(uid)
-        u[name] = obj.model_dump()
+    write_config_doc(scoped_path(uid, f"config/{name}"), obj.model_dump())
+
+
+def get_cfg_ws(uid: str, ws_id: str, name: str, model_cls, default_obj):
+    raw = read_config_doc(scoped_path_for(uid, ws_id, f"config/{name}"))
+    return model_cls(**raw) if raw is not None else default_obj
+
+
+# ------------------------------------------------------------
+# Unit of work. Inside `with unit_of_work(uid):` the document writers below
+# stage their writes instead of issuing them; repeated writes to one doc are
+# merged and everything is committed in one WriteBatch when the block exits
+# cleanly. If the block raises, nothing is written. Side effects such as
+# outbound notifications are registered with after_commit() and run only
+# after a successful commit. savepoint() nests a unit whose writes and
+# side effects join the enclosing one only if its own block succeeds.
+# ------------------------------------------------------------
+FIRESTORE_BATCH_LIMIT = 500
+UOW_STATS: Dict[str, int] = {"commits": 0, "split_commits": 0}
+
+
+class UnitOfWork:
+    def __init__(self):
+        self.writes: "OrderedDict[str, tuple]" = OrderedDict()
+        self.after: List[Callable[[], None]] = []
+        self.collected: "OrderedDict[str, tuple]" = OrderedDict()
+        self.coalesced = 0
+
+    def set(self, path: str, data: Dict[str, Any], merge: bool = False):
+        prev = self.writes.get(path)
+        if prev is not None:
+            self.coalesced += 1
+            if merge:
+                prev_data, prev_merge = prev
+                data, merge = {**prev_data, **data}, prev_merge
+        self.writes[path] = (data, merge)
+        self.writes.move_to_end(path)
+
+    def collect(self, key: str, item: Any, flush: Callable[[List[Any]], None]):
+        """Accumulate `item` under `key`; flush(items) runs once when the unit commits."""
+        if key not in self.collected:
+            self.collected[key] = ([], flush)
+        else:
+            self.coalesced += 1
+        self.collected[key][0].append(item)
+
+    def absorb(self, other: "UnitOfWork"):
+        """Fold a savepoint's staged writes, collected items and callbacks into this unit."""
+        for path, (data, merge) in other.writes.items():
+            self.set(path, data, merge=merge)
+        for key, (items, flush) in other.collected.items():
+            if key in self.collected:
+                self.collected[key][0].extend(items)
+                self.coalesced += 1
+            else:
+                self.collected[key] = (list(items), flush)
+        self.after.extend(other.after)
+        self.coalesced += other.coalesced
+
+    def commit(self):
+        for items, flush in self.collected.values():
+            flush(items)
+        items = list(self.writes.items())
+        UOW_STATS["commits"] += 1
+        # A single WriteBatch caps at 500 writes. Larger units commit in chunks
+        # and are not atomic; callers that need atomicity size their units to fit.
+        if len(items) > FIRESTORE_BATCH_LIMIT:
+            UOW_STATS["split_commits"] += 1
+            print("Unit of work split:", len(items), "writes")
+        for start in range(0, len(items), FIRESTORE_BATCH_LIMIT):
+            batch = _store.batch()
+            for path, (data, merge) in items[start:start + FIRESTORE_BATCH_LIMIT]:
+                batch.set(fs_doc(path), data, merge=merge)
+            batch.commit()
+        for fn in self.after:
+            try:
+                fn()
+            except Exception as exc:
+                print("after_commit error:", repr(exc))
+
+
+@contextmanager
+def unit_of_work(uid: str):
+    ctx = current_context(uid)
+    if ctx is None or ctx.uow is not None:
+        yield ctx.uow if ctx is not None else None
         return
-    fs_doc_uid(uid, f"config/{name}").set(obj.model_dump())
+    uow = UnitOfWork()
+    ctx.uow = uow
+    try:
+        yield uow
+    finally:
+        ctx.uow = None
+    uow.commit()
+
+
+@contextmanager
+def savepoint(uid: str):
+    """Stage the block's writes separately; they join the open unit of work only if it succeeds."""
+    ctx = current_context(uid)
+    parent = ctx.uow if ctx is not None else None
+    if parent is None:
+        with unit_of_work(uid) as uow:
+            yield uow
+        return
+    child = UnitOfWork()
+    ctx.uow = child
+    try:
+        yield child
+    finally:
+        ctx.uow = parent
+    parent.absorb(child)
+
+
+def current_uow(uid: str) -> Optional[UnitOfWork]:
+    ctx = current_context(uid)
+    return ctx.uow if ctx is not None else None
+
+
+def stage_set(uid: str, path: str, data: Dict[str, Any], merge: bool = False) -> bool:
+    """Stage a Firestore write on the active unit of work; False means write now."""
+    uow = current_uow(uid)
+    if uow is None:
+        return False
+    uow.set(path, data, merge=merge)
+    return True
+
+
+def after_commit(uid: str, fn: Callable[[], None]):
+    uow = current_uow(uid)
+    if uow is None:
+        fn()
+    else:
+        uow.after.append(fn)
 
 
-def write_doc(uid: str, path: str, data: Dict[str, Any]):
-    if _firestore is None:
-        u = get_ws_scope(uid)
-        u.setdefault("_docs", {})[path] = data
+def write_doc(uid: str, path: str, data: Dict[str, Any], merge: bool = False):
+    if stage_set(uid, scoped_path(uid, path), data, merge=merge):
         return
-    fs_doc_uid(uid, path).set(data)
+    fs_doc_uid(uid, path).set(data, merge=merge)
 
 
 def add_doc(uid: str, path: str, data: Dict[str, Any]):
-    if _firestore is None:
-        u = get_ws_scope(uid)
-        u.setdefault("_cols", {}).setdefault(path, []).append(data)
+    ref = fs_col_uid(uid, path).document()
+    if stage_set(uid, ref.path, data):
+        return
+    ref.set(data)
+
+
+# ------------------------------------------------------------
+# Stat counters. Firestore increments are buffered per process and flushed
+# every STATS_FLUSH_SECONDS as atomic Increment transforms, one write per
+# stats doc per flush regardless of how many increments it absorbed. Workers
+# never overwrite each other's counts. STATS_FLUSH_SECONDS=0 (and the
+# in-memory store) writes each increment straight through.
+# ------------------------------------------------------------
+_STAT_DELTAS: Dict[str, Dict[str, int]] = {}
+_STAT_SHARDS: Dict[str, int] = {}
+_STATS_LOCK = threading.Lock()
+_STATS_FLUSHER: Optional[threading.Thread] = None
+STATS_BUFFER_STATS: Dict[str, int] = {"increments": 0, "flushes": 0, "docs_written": 0, "errors": 0}
+
+
+def _stats_day(path: str) -> str:
+    return path.rsplit("/shards/", 1)[0].rsplit("daily_", 1)[-1]
+
+
+def stat_week(day: str) -> str:
+    """ISO week of a YYYYMMDD day, e.g. 2026W42."""
+    return time.strftime("%GW%V", time.strptime(day, "%Y%m%d"))
+
+
+def stat_rollup_names(day: str) -> List[str]:
+    return [f"weekly_{stat_week(day)}", f"monthly_{day[:6]}", f"yearly_{day[:4]}"]
+
+
+def stat_rollup_paths(path: str) -> List[str]:
+    """Rollup docs that absorb a workspace daily doc's deltas.
+
+    The workspace gets week, month and year docs; the org (users/{uid}/stats) gets day,
+    month and year docs summed over all of its workspaces. Rollups are not
+    sharded: the flusher already coalesces them to one write per process per flush.
+    """
+    scope, name = path.rsplit("/stats/", 1)
+    day = name[len("daily_"):]
+    org = scope.split("/workspaces/", 1)[0]
+    out = [f"{scope}/stats/{n}" for n in stat_rollup_names(day)]
+    if org != scope:
+        out += [f"{org}/stats/{n}" for n in [name, *stat_rollup_names(day)]]
+    return out
+
+
+def _stats_marker(path: str) -> Dict[str, str]:
+    name = path.rsplit("/shards/", 1)[0].rsplit("/", 1)[-1]
+    kind, period = name.split("_", 1)
+    return {"day": period} if kind == "daily" else {"period": period}
+
+
+def stat_shard_path(path: str, shards: int) -> str:
+    """Pick a counter doc for `path`: the doc itself, or a random one of its shards."""
+    if shards <= 1:
+        return path
+    return f"{path}/shards/{random.randrange(shards)}"
+
+
+def record_stat(path: str, key: str, amount: int, shards: int = 1):
+    if STATS_FLUSH_SECONDS <= 0 or getattr(_store, "write_through_counters", False):
+        _write_stat_deltas([(path, {key: amount})], {path: shards})
+        return
+    with _STATS_LOCK:
+        deltas = _STAT_DELTAS.setdefault(path, {})
+        deltas[key] = deltas.get(key, 0) + amount
+        _STAT_SHARDS[path] = shards
+        STATS_BUFFER_STATS["increments"] += 1
+    _ensure_stats_flusher()
+
+
+def _write_stat_deltas(items: List[tuple], shards: Dict[str, int]) -> int:
+    """Commit (daily path, deltas) pairs plus their rollups as one batch of Increments."""
+    targets: Dict[str, Dict[str, int]] = {}
+    for path, deltas in items:
+        for target in [stat_shard_path(path, shards.get(path, 1)), *stat_rollup_paths(path)]:
+            merged = targets.setdefault(target, {})
+            for k, v in deltas.items():
+                merged[k] = merged.get(k, 0) + v
+    batch = _store.batch()
+    for target, deltas in targets.items():
+        payload: Dict[str, Any] = {k: fs_increment(v) for k, v in deltas.items() if v}
+        payload.update(_stats_marker(target))
+        batch.set(fs_doc(target), payload, merge=True)
+    batch.commit()
+    return len(targets)
+
+
+def flush_stats() -> int:
+    """Write all buffered deltas; returns the number of stats docs written."""
+    global _STAT_DELTAS
+    with _STATS_LOCK:
+        pending, _STAT_DELTAS = _STAT_DELTAS, {}
+        # Shard counts travel with their deltas so the map only holds paths
+        # that still have something buffered.
+        shards = {path: _STAT_SHARDS.pop(path, 1) for path in pending}
+    if not pending:
+        return 0
+    items = list(pending.items())
+    written = 0
+    # Each daily doc writes itself plus its rollups; size chunks so a batch stays under the cap.
+    fanout = 1 + max(len(stat_rollup_paths(path)) for path in pending)
+    step = max(1, FIRESTORE_BATCH_LIMIT // fanout)
+    for start in range(0, len(items), step):
+        chunk = items[start:start + step]
+        try:
+            written += _write_stat_deltas(chunk, shards)
+        except Exception as exc:
+            print("Stats flush error:", repr(exc))
+            STATS_BUFFER_STATS["errors"] += 1
+            with _STATS_LOCK:
+                for path, deltas in chunk:
+                    _STAT_SHARDS.setdefault(path, shards.get(path, 1))
+                    merged = _STAT_DELTAS.setdefault(path, {})
+                    for k, v in deltas.items():
+                        merged[k] = merged.get(k, 0) + v
+    with _STATS_LOCK:
+        STATS_BUFFER_STATS["flushes"] += 1
+        STATS_BUFFER_STATS["docs_written"] += written
+    return written
+
+
+def _stats_flush_loop():
+    while True:
+        time.sleep(STATS_FLUSH_SECONDS)
+        try:
+            flush_stats()
+        except Exception as exc:
+            print("Stats flush error:", repr(exc))
+
+
+def _ensure_stats_flusher():
+    global _STATS_FLUSHER
+    if _STATS_FLUSHER is not None:
         return
-    fs_col_uid(uid, path).add(data)
+    with _STATS_LOCK:
+        if _STATS_FLUSHER is None:
+            _STATS_FLUSHER = threading.Thread(target=_stats_flush_loop, name="stats-flusher", daemon=True)
+            _STATS_FLUSHER.start()
 
 
 def inc_stat(uid: str, key: str, amount: int = 1):
     day = time.strftime("%Y%m%d")
     doc_path = f"stats/daily_{day}"
-    if _firestore is None:
-        u = get_ws_scope(uid)
-        stats = u.setdefault(doc_path, {})
-        stats[key] = int(stats.get(key, 0)) + amount
-        return
-    ref = fs_doc_uid(uid, doc_path)
-    ref.set({key: amount, "day": day}, merge=True)
+    path = scoped_path(uid, doc_path)
+    shards = get_stats_settings(uid, get_workspace_id(uid)).shard_count
+    after_commit(uid, lambda: record_stat(path, key, amount, shards))
+
+
+def get_stats_settings(uid: str, ws_id: str) -> StatsSettings:
+    return get_cfg_ws(uid, ws_id, "stats", StatsSettings, StatsSettings())
+
+
+def _sum_stat_docs(docs: List[Optional[Dict[str, Any]]]) -> Dict[str, Any]:
+    out: Dict[str, Any] = {}
+    for data in docs:
+        for key, value in (data or {}).items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                out[key] = out.get(key, 0) + value
+            else:
+                out.setdefault(key, value)
+    return out
+
+
+def _stat_doc_paths(uid: str, ws_id: Optional[str], name: str, shards: int) -> List[str]:
+    base = scoped_path_for(uid, ws_id, f"stats/{name}") if ws_id else root_path(uid, f"stats/{name}")
+    if shards > 1 and name.startswith("daily_"):
+        return [base] + [f"{base}/shards/{i}" for i in range(shards)]
+    return [base]
+
+
+def read_stat_docs(uid: str, ws_id: Optional[str], names: List[str]) -> Dict[str, Dict[str, Any]]:
+    """Stats docs (daily_*, weekly_*, monthly_*, yearly_*) in one round trip, summing daily shards.
+
+    ws_id=None reads the org-level rollups under users/{uid}/stats.
+    """
+    shards = get_stats_settings(uid, ws_id).shard_high_water if ws_id else 1
+    paths = {name: _stat_doc_paths(uid, ws_id, name, shards) for name in names}
+    fetched = get_docs([p for group in paths.values() for p in group])
+    return {name: _sum_stat_docs([fetched.get(p) for p in group]) for name, group in paths.items()}
+
+
+def read_workspaces_stat_docs(uid: str, ws_ids: List[str], names: List[str]) -> Dict[str, Dict[str, Dict[str, Any]]]:
+    """The (workspace x stats doc) grid in one pass: ws_id -> name -> stats."""
+    prefetch_docs(uid, [scoped_path_for(uid, ws_id, "config/stats") for ws_id in ws_ids])
+    paths: Dict[tuple, List[str]] = {}
+    for ws_id in ws_ids:
+        shards = get_stats_settings(uid, ws_id).shard_high_water
+        for name in names:
+            paths[(ws_id, name)] = _stat_doc_paths(uid, ws_id, name, shards)
+    fetched = get_docs([p for group in paths.values() for p in group])
+    out: Dict[str, Dict[str, Dict[str, Any]]] = {ws_id: {} for ws_id in ws_ids}
+    for (ws_id, name), group in paths.items():
+        out[ws_id][name] = _sum_stat_docs([fetched.get(p) for p in group])
+    return out
+
+
+def read_stats_days(uid: str, ws_id: Optional[str], days: List[str]) -> Dict[str, Dict[str, Any]]:
+    by_name = read_stat_docs(uid, ws_id, [f"daily_{day}" for day in days])
+    return {day: by_name[f"daily_{day}"] for day in days}
+
+
+def read_stats(uid: str, ws_id: str, day: str) -> Dict[str, Any]:
+    return read_stats_days(uid, ws_id, [day])[day]
+
+
+def range_stat_names(period: str, now: Optional[float] = None) -> List[str]:
+    """The rollup doc covering a dashboard range: ISO week, month or year to date."""
+    now = time.time() if now is None else now
+    today = time.strftime("%Y%m%d", time.localtime(now))
+    if period == "month":
+        return [f"monthly_{today[:6]}"]
+    if period == "ytd":
+        return [f"yearly_{today[:4]}"]
+    return [f"weekly_{stat_week(today)}"]
+
+
+def rebuild_stat_rollups(uid: str, since: str, until: Optional[str] = None) -> int:
+    """Recompute every rollup fed by daily docs from `since` through `until` (YYYYMMDD).
+
+    Rollups only absorb deltas flushed after they were introduced, so this
+    backfills them from the daily docs. Each rebuilt rollup is overwritten with
+    the sum of its days, so `since` must reach back to the start of the oldest
+    period to rebuild (1 January for yearly docs). Increments flushed while it
+    runs can be lost; run it when traffic is quiet. Returns the docs written.
+    """
+    start = time.mktime(time.strptime(since, "%Y%m%d")) + 43200
+    end = time.mktime(time.strptime(until or time.strftime("%Y%m%d"), "%Y%m%d")) + 43200
+    days: List[str] = []
+    while start <= end:
+        days.append(time.strftime("%Y%m%d", time.localtime(start)))
+        start += 86400
+    ws_ids = [ws.get("id", "primary") for ws in get_workspaces(uid)]
+    grid = read_workspaces_stat_docs(uid, ws_ids, [f"daily_{day}" for day in days])
+    targets: Dict[str, Dict[str, int]] = {}
+    for ws_id in ws_ids:
+        for name, stats in grid[ws_id].items():
+            for target in stat_rollup_paths(scoped_path_for(uid, ws_id, f"stats/{name}")):
+                merged = targets.setdefault(target, {})
+                for key, value in stats.items():
+                    if isinstance(value, (int, float)) and not isinstance(value, bool):
+                        merged[key] = merged.get(key, 0) + int(value)
+    items = [(target, totals) for target, totals in targets.items() if totals]
+    for start_at in range(0, len(items), FIRESTORE_BATCH_LIMIT):
+        batch = _store.batch()
+        for target, totals in items[start_at:start_at + FIRESTORE_BATCH_LIMIT]:
+            batch.set(fs_doc(target), {**totals, **_stats_marker(target)})
+        batch.commit()
+    return len(items)
 
 
 def get_business_profile(uid: str) -> BusinessProfile:
@@ -693,105 +2029,81 @@ def default_members(uid: str) -> List[WorkspaceMember]:
 
 
 def get_list_cfg(uid: str, name: str, default_items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-    if _firestore is None:
-        u = get_ws_scope(uid)
-        if name not in u:
-            u[name] = {"items": default_items}
-        return list(u.get(name, {}).get("items", default_items))
-    ref = fs_doc_uid(uid, f"config/{name}")
-    snap = ref.get()
-    if snap.exists:
-        data = snap.to_dict() or {}
+    path = scoped_path(uid, f"config/{name}")
+    data = read_config_doc(path)
+    if data is not None:
         return list(data.get("items", []))
-    ref.set({"items": default_items})
+    write_config_doc(path, {"items": default_items})
     return default_items
 
 
 def set_list_cfg(uid: str, name: str, items: List[Dict[str, Any]]):
-    if _firestore is None:
-        u = get_ws_scope(uid)
-        u[name] = {"items": items}
-        return
-    fs_doc_uid(uid, f"config/{name}").set({"items": items})
+    write_config_doc(scoped_path(uid, f"config/{name}"), {"items": items})
 
 
 def get_root_list_cfg(uid: str, name: str, default_items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-    if _firestore is None:
-        u = get_root_scope(uid)
-        if name not in u:
-            u[name] = {"items": default_items}
-        return list(u.get(name, {}).get("items", default_items))
-    ref = fs_doc(root_path(uid, f"config/{name}"))
-    snap = ref.get()
-    if snap.exists:
-        data = snap.to_dict() or {}
+    path = root_path(uid, f"config/{name}")
+    data = read_config_doc(path)
+    if data is not None:
         return list(data.get("items", []))
-    ref.set({"items": default_items})
+    write_config_doc(path, {"items": default_items})
     return default_items
 
 
 def set_root_list_cfg(uid: str, name: str, items: List[Dict[str, Any]]):
-    if _firestore is None:
-        u = get_root_scope(uid)
-        u[name] = {"items": items}
-        return
-    fs_doc(root_path(uid, f"config/{name}")).set({"items": items})
+    write_config_doc(root_path(uid, f"config/{name}"), {"items": items})
 
 
 def get_list_cfg_ws(uid: str, ws_id: str, name: str, default_items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-    if _firestore is None:
-        u = get_ws_scope_for(uid, ws_id)
-        if name not in u:
-            u[name] = {"items": default_items}
-        return list(u.get(name, {}).get("items", default_items))
-    ref = fs_doc_ws(uid, ws_id, f"config/{name}")
-    snap = ref.get()
-    if snap.exists:
-        data = snap.to_dict() or {}
+    path = scoped_path_for(uid, ws_id, f"config/{name}")
+    data = read_config_doc(path)
+    if data is not None:
         return list(data.get("items", []))
-    ref.set({"items": default_items})
+    write_config_doc(path, {"items": default_items})
     return default_items
 
 
 def set_list_cfg_ws(uid: str, ws_id: str, name: str, items: List[Dict[str, Any]]):
-    if _firestore is None:
-        u = get_ws_scope_for(uid, ws_id)
-        u[name] = {"items": items}
-        return
-    fs_doc_ws(uid, ws_id, f"config/{name}").set({"items": items})
+    write_config_doc(scoped_path_for(uid, ws_id, f"config/{name}"), {"items": items})
 
 
 def get_workspace_members(uid: str, ws_id: str) -> List[Dict[str, Any]]:
-    if _firestore is None:
-        u = get_ws_scope_for(uid, ws_id)
-        if "members" not in u:
-            u["members"] = {"items": [m.model_dump() for m in default_members(uid)], "uids": [uid]}
-        return list(u.get("members", {}).get("items", []))
-    ref = fs_doc_ws(uid, ws_id, "config/members")
-    snap = ref.get()
-    if snap.exists:
-        return list((snap.to_dict() or {}).get("items", []))
+    ctx = current_context(uid)
+    if ctx is not None:
+        return ctx.members(ws_id)
+    return _load_workspace_members(uid, ws_id)
+
+
+def _load_workspace_members(uid: str, ws_id: str) -> List[Dict[str, Any]]:
+    data = read_config_doc(scoped_path_for(uid, ws_id, "config/members"))
+    if data is not None:
+        return list(data.get("items", []))
     items = [m.model_dump() for m in default_members(uid)]
     set_workspace_members(uid, ws_id, items)
     return items
 
 
 def set_workspace_members(uid: str, ws_id: str, items: List[Dict[str, Any]]):
-    if _firestore is None:
-        u = get_ws_scope_for(uid, ws_id)
-        u["members"] = {"items": items, "uids": [m.get("uid") for m in items if m.get("uid")]}
-        return
-    ref = fs_doc_ws(uid, ws_id, "config/members")
-    ref.set({
+    invalidate_bootstrap(uid)
+    ctx = current_context(uid)
+    if ctx is not None:
+        ctx.set_members(ws_id, items)
+    write_config_doc(scoped_path_for(uid, ws_id, "config/members"), {
         "items": items,
         "uids": [m.get("uid") for m in items if m.get("uid")]
     })
 
 
 def get_workspace_role(uid: str, ws_id: Optional[str]) -> str:
+    ctx = current_context(uid)
+    if ctx is not None:
+        return ctx.role(ws_id)
     access = get_access_config(uid)
     workspace_id = ws_id or access.workspace_id or "primary"
-    members = get_workspace_members(uid, workspace_id)
+    return _resolve_role(access, get_workspace_members(uid, workspace_id), uid)
+
+
+def _resolve_role(access: AccessConfig, members: List[Dict[str, Any]], uid: str) -> str:
     for member in members:
         if member.get("uid") == uid:
             return member.get("role") or access.role
@@ -817,33 +2129,64 @@ ensure_firebase_configured()
 
 
 def add_notification(uid: str, alert: Dict[str, Any]):
-    base = get_list_cfg(uid, "notifications", [n.model_dump() for n in default_alerts()])
     payload = {**alert}
     payload.setdefault("ts", time.time())
     payload.setdefault("tags", [])
     payload.setdefault("link", None)
     payload.setdefault("action_id", None)
     payload.setdefault("decision_id", None)
-    updated = upsert_alert(base, payload)
-    set_list_cfg(uid, "notifications", updated)
-    deliver_notification(uid, payload)
+    jobs = delivery_jobs(uid, payload)
+    if jobs and payload.get("id"):
+        queued = {job.channel: {"status": "queued", "attempts": 0, "ts": job.created_ts} for job in jobs}
+        write_doc(uid, f"notificationDelivery/{payload['id']}", queued, merge=True)
+    # Inside a unit of work the list is read and rewritten once per commit.
+    uow = current_uow(uid)
+    if uow is None:
+        store_notifications(uid, [payload])
+    else:
+        uow.collect("notifications", payload, lambda alerts: store_notifications(uid, alerts))
+    if jobs:
+        after_commit(uid, lambda: enqueue_deliveries(jobs))
+
+
+def store_notifications(uid: str, alerts: List[Dict[str, Any]]):
+    base = get_list_cfg(uid, "notifications", [n.model_dump() for n in default_alerts()])
+    set_list_cfg(uid, "notifications", upsert_alerts(base, alerts))
+
+
+def with_delivery(uid: str, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Join each notification's notificationDelivery/{id} doc in as its `delivery` field.
+
+    Delivery status is only stored there (per channel: status, attempts, ts,
+    error), never on the notification list, so it can't go stale.
+    """
+    ids = [row["id"] for row in rows if row.get("id")]
+    if not ids:
+        return rows
+    docs = get_docs([scoped_path(uid, f"notificationDelivery/{nid}") for nid in ids])
+    return [
+        {**row, "delivery": docs.get(scoped_path(uid, f"notificationDelivery/{row.get('id')}")) or {}}
+        if row.get("id") else row
+        for row in rows
+    ]
 
 
 def severity_rank(level: str) -> int:
     return {"low": 1, "medium": 2, "high": 3}.get(level, 1)
 
 
-def deliver_notification(uid: str, alert: Dict[str, Any]):
+def delivery_jobs(uid: str, alert: Dict[str, Any]) -> List[DeliveryJob]:
+    """The email/SMS sends this alert needs under the workspace's routing config."""
     try:
         routing = get_cfg(uid, "notificationRouting", NotificationRouting, NotificationRouting())
     except Exception:
-        return
+        return []
 
     if alert.get("status") != "new":
-        return
+        return []
 
     if severity_rank(alert.get("severity", "low")) < severity_rank(routing.min_severity):
-        return
+        return []
 
     subject = f"Main St AI Alert: {alert.get('title', 'Notification')}"
     body = alert.get("detail", "")
@@ -851,78 +2194,311 @@ def deliver_notification(uid: str, alert: Dict[str, Any]):
     if link:
         body = f"{body}\n\nOpen: {link}"
 
+    common = {"uid": uid, "workspace_id": get_workspace_id(uid), "notification_id": alert.get("id")}
+    jobs: List[DeliveryJob] = []
     if routing.email_enabled and routing.email and SENDGRID_API_KEY:
-        send_email(routing.email, subject, body)
+        jobs.append(DeliveryJob(id=str(uuid.uuid4()), channel="email", to=routing.email, subject=subject, body=body, **common))
 
     if routing.sms_enabled and routing.sms and TWILIO_ACCOUNT_SID and TWILIO_AUTH_TOKEN and TWILIO_FROM_NUMBER:
-        send_sms(routing.sms, f"{alert.get('title', 'Alert')}: {alert.get('detail', '')}")
+        sms = f"{alert.get('title', 'Alert')}: {alert.get('detail', '')}"
+        jobs.append(DeliveryJob(id=str(uuid.uuid4()), channel="sms", to=routing.sms, body=sms, **common))
+    return jobs
+
+
+# ------------------------------------------------------------
+# Outbound delivery. Alert emails/SMS are sent by a few background workers,
+# never on the request that raised the alert. Requests go over a keep-alive
+# connection pool (one TLS handshake per connection, not per message).
+# Network errors, 429 and 5xx are retried with exponential backoff up to
+# DELIVERY_MAX_ATTEMPTS; other 4xx fail at once. Failed jobs are written to
+# deliveryDeadLetters/{id}, and each outcome is merged into
+# notificationDelivery/{notification_id} under its channel, so the email and
+# SMS workers never rewrite the notification list (GET /notifications joins
+# it back in). Jobs still waiting at shutdown are dead-lettered rather than
+# dropped, and jobs raised after shutdown are dead-lettered straight away. SENDGRID_API_URL / TWILIO_API_URL point the senders
+# at a local fake server in tests.
+# ------------------------------------------------------------
+class KeepAliveHttp:
+    def __init__(self, max_idle_per_host: int, timeout: float):
+        self.max_idle = max(1, max_idle_per_host)
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._idle: Dict[tuple, List[http.client.HTTPConnection]] = {}
+        self.stats: Dict[str, int] = {"requests": 0, "connections": 0, "reused": 0}
+
+    def _checkout(self, key: tuple) -> tuple:
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                self.stats["reused"] += 1
+                return idle.pop(), True
+            self.stats["connections"] += 1
+        scheme, host, port = key
+        conn_cls = http.client.HTTPSConnection if scheme == "https" else http.client.HTTPConnection
+        return conn_cls(host, port, timeout=self.timeout), False
+
+    def _checkin(self, key: tuple, conn: http.client.HTTPConnection):
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_idle:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def request(self, method: str, url: str, body: bytes, headers: Dict[str, str]) -> tuple:
+        """Send one request; returns (status, headers, body). Raises on network errors."""
+        parts = urllib.parse.urlsplit(url)
+        key = (parts.scheme, parts.hostname, parts.port or (443 if parts.scheme == "https" else 80))
+        path = parts.path + (f"?{parts.query}" if parts.query else "")
+        with self._lock:
+            self.stats["requests"] += 1
+        for attempt in range(2):
+            conn, reused = self._checkout(key)
+            try:
+                conn.request(method, path, body=body, headers=headers)
+                resp = conn.getresponse()
+                data = resp.read()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                conn.close()
+                # The server dropped an idle keep-alive connection; retry once on a fresh one.
+                if reused and attempt == 0:
+                    continue
+                raise
+            except Exception:
+                conn.close()
+                raise
+            if resp.will_close:
+                conn.close()
+            else:
+                self._checkin(key, conn)
+            return resp.status, dict(resp.getheaders()), data
+        raise RuntimeError("unreachable")
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
 
 
-def send_email(to_email: str, subject: str, content: str):
+DELIVERY_HTTP = KeepAliveHttp(DELIVERY_WORKERS, DELIVERY_TIMEOUT_SECONDS)
+
+
+def send_email(to_email: str, subject: str, content: str) -> tuple:
     payload = {
         "personalizations": [{"to": [{"email": to_email}]}],
         "from": {"email": SENDGRID_FROM_EMAIL},
         "subject": subject,
         "content": [{"type": "text/plain", "value": content}],
     }
-    data = json.dumps(payload).encode("utf-8")
-    req = urllib.request.Request("https://api.sendgrid.com/v3/mail/send", data=data, method="POST")
-    req.add_header("Authorization", f"Bearer {SENDGRID_API_KEY}")
-    req.add_header("Content-Type", "application/json")
-    try:
-        urllib.request.urlopen(req, timeout=8)
-    except Exception as exc:
-        print("SendGrid error:", repr(exc))
+    headers = {"Authorization": f"Bearer {SENDGRID_API_KEY}", "Content-Type": "application/json"}
+    return DELIVERY_HTTP.request("POST", SENDGRID_API_URL, json.dumps(payload).encode("utf-8"), headers)
 
 
-def send_sms(to_number: str, body: str):
-    url = f"https://api.twilio.com/2010-04-01/Accounts/{TWILIO_ACCOUNT_SID}/Messages.json"
+def send_sms(to_number: str, body: str) -> tuple:
+    url = f"{TWILIO_API_URL}/2010-04-01/Accounts/{TWILIO_ACCOUNT_SID}/Messages.json"
     payload = urllib.parse.urlencode({
         "To": to_number,
         "From": TWILIO_FROM_NUMBER,
         "Body": body,
     }).encode("utf-8")
-    req = urllib.request.Request(url, data=payload, method="POST")
     token = base64.b64encode(f"{TWILIO_ACCOUNT_SID}:{TWILIO_AUTH_TOKEN}".encode("utf-8")).decode("utf-8")
-    req.add_header("Authorization", f"Basic {token}")
-    req.add_header("Content-Type", "application/x-www-form-urlencoded")
+    headers = {"Authorization": f"Basic {token}", "Content-Type": "application/x-www-form-urlencoded"}
+    return DELIVERY_HTTP.request("POST", url, payload, headers)
+
+
+class DeliveryQueue:
+    """Due-time ordered job heap served by a fixed set of worker threads."""
+
+    def __init__(self, workers: int, handle: Callable[[DeliveryJob], None]):
+        self.handle = handle
+        self._cond = threading.Condition()
+        self._heap: List[tuple] = []
+        self._seq = 0
+        self._busy = 0
+        self._stopping = False
+        self._threads = [
+            threading.Thread(target=self._work, name=f"delivery-{i}", daemon=True) for i in range(max(1, workers))
+        ]
+        for t in self._threads:
+            t.start()
+
+    def submit(self, job: DeliveryJob, delay: float = 0.0) -> bool:
+        with self._cond:
+            if self._stopping:
+                return False
+            self._seq += 1
+            heapq.heappush(self._heap, (time.time() + delay, self._seq, job))
+            self._cond.notify()
+            return True
+
+    def _next(self) -> Optional[DeliveryJob]:
+        with self._cond:
+            while True:
+                now = time.time()
+                if self._heap and self._heap[0][0] <= now:
+                    self._busy += 1
+                    return heapq.heappop(self._heap)[2]
+                if self._stopping:
+                    return None
+                self._cond.wait(self._heap[0][0] - now if self._heap else None)
+
+    def _work(self):
+        while True:
+            job = self._next()
+            if job is None:
+                return
+            try:
+                self.handle(job)
+            except Exception as exc:
+                print("Delivery worker error:", repr(exc))
+            finally:
+                with self._cond:
+                    self._busy -= 1
+
+    def shutdown(self, timeout: float) -> List[DeliveryJob]:
+        """Finish jobs that are already due, stop, and return the ones still waiting."""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        deadline = time.time() + timeout
+        for t in self._threads:
+            t.join(max(0.0, deadline - time.time()))
+        with self._cond:
+            left, self._heap = [entry[2] for entry in self._heap], []
+        return left
+
+    def pending(self) -> Dict[str, int]:
+        with self._cond:
+            return {"waiting": len(self._heap), "sending": self._busy}
+
+
+_DELIVERY_QUEUE: Optional[DeliveryQueue] = None
+_DELIVERY_LOCK = threading.Lock()
+_DELIVERY_STOPPED = False
+DELIVERY_STATS: Dict[str, int] = {"queued": 0, "sent": 0, "retries": 0, "dead_lettered": 0}
+
+
+def delivery_queue() -> Optional[DeliveryQueue]:
+    """The shared queue, started on first use; None once drain_deliveries has run."""
+    global _DELIVERY_QUEUE
+    if _DELIVERY_QUEUE is None and not _DELIVERY_STOPPED:
+        with _DELIVERY_LOCK:
+            if _DELIVERY_QUEUE is None and not _DELIVERY_STOPPED:
+                _DELIVERY_QUEUE = DeliveryQueue(DELIVERY_WORKERS, run_delivery)
+    return None if _DELIVERY_STOPPED else _DELIVERY_QUEUE
+
+
+def enqueue_deliveries(jobs: List[DeliveryJob]):
+    for job in jobs:
+        queue = delivery_queue()
+        if queue is not None and queue.submit(job):
+            DELIVERY_STATS["queued"] += 1
+        else:
+            finish_delivery(job, "failed", "Server shutting down")
+
+
+def delivery_backoff(attempts: int, retry_after: Optional[str] = None) -> float:
+    if retry_after and retry_after.isdigit():
+        return float(retry_after)
+    return min(300.0, DELIVERY_BACKOFF_SECONDS * (2 ** (attempts - 1))) * random.uniform(0.8, 1.2)
+
+
+def run_delivery(job: DeliveryJob):
+    job.attempts += 1
+    retry_after = None
+    try:
+        if job.channel == "email":
+            status, headers, _ = send_email(job.to, job.subject, job.body)
+        else:
+            status, headers, _ = send_sms(job.to, job.body)
+    except Exception as exc:
+        error, retryable = repr(exc), True
+    else:
+        if 200 <= status < 300:
+            finish_delivery(job, "sent")
+            return
+        error, retryable = f"HTTP {status}", status == 429 or status >= 500
+        retry_after = headers.get("Retry-After")
+    print("Delivery error:", job.channel, error)
+    if retryable and job.attempts < DELIVERY_MAX_ATTEMPTS:
+        job.last_error = error
+        DELIVERY_STATS["retries"] += 1
+        record_delivery_status(job, "retrying")
+        queue = delivery_queue()
+        if queue is not None and queue.submit(job, delivery_backoff(job.attempts, retry_after)):
+            return
+        error = f"{error} (not retried: shutting down)"
+    finish_delivery(job, "failed", error)
+
+
+def finish_delivery(job: DeliveryJob, status: str, error: Optional[str] = None):
+    job.last_error = error or job.last_error
+    if status == "sent":
+        DELIVERY_STATS["sent"] += 1
+    else:
+        DELIVERY_STATS["dead_lettered"] += 1
+    record_delivery_status(job, status)
+
+
+def record_delivery_status(job: DeliveryJob, status: str):
+    """Merge the job's outcome into its notification's delivery doc (and dead-letter it when it failed)."""
+    job.status = status
+    job.updated_ts = time.time()
+    entry = {"status": status, "attempts": job.attempts, "ts": job.updated_ts, "error": job.last_error}
     try:
-        urllib.request.urlopen(req, timeout=8)
+        # One merge write per channel: email and SMS outcomes never clobber each other.
+        with use_context(workspace_context(job.uid, job.workspace_id)), unit_of_work(job.uid):
+            if status == "failed":
+                write_doc(job.uid, f"deliveryDeadLetters/{job.id}", job.model_dump())
+            if job.notification_id:
+                write_doc(job.uid, f"notificationDelivery/{job.notification_id}", {job.channel: entry}, merge=True)
     except Exception as exc:
-        print("Twilio error:", repr(exc))
+        print("Delivery status error:", repr(exc))
+
+
+def drain_deliveries(timeout: float = 10.0):
+    global _DELIVERY_STOPPED
+    with _DELIVERY_LOCK:
+        _DELIVERY_STOPPED = True
+        queue = _DELIVERY_QUEUE
+    if queue is None:
+        return
+    for job in queue.shutdown(timeout):
+        finish_delivery(job, "failed", f"Undelivered at shutdown after {job.attempts} attempts: {job.last_error}")
+    DELIVERY_HTTP.close()
 
 
 def get_contact(uid: str, contact_id: str) -> Optional[Contact]:
-    if _firestore is None:
-        u = get_ws_scope(uid)
-        raw = u.get(f"contacts/{contact_id}")
+    found, raw = take_prefetched(scoped_path(uid, f"contacts/{contact_id}"))
+    if found:
         return Contact(**raw) if raw else None
     snap = fs_doc_uid(uid, f"contacts/{contact_id}").get()
     return Contact(**snap.to_dict()) if snap.exists else None
 
 
 def upsert_contact(uid: str, c: Contact):
-    if _firestore is None:
-        u = get_ws_scope(uid)
-        u[f"contacts/{c.id}"] = c.model_dump()
+    data = c.model_dump()
+    path = scoped_path(uid, f"contacts/{c.id}")
+    forget_prefetched(path)
+    if stage_set(uid, path, data):
         return
-    fs_doc_uid(uid, f"contacts/{c.id}").set(c.model_dump())
+    fs_doc(path).set(data)
 
 
 def upsert_thread(uid: str, t: Thread):
-    if _firestore is None:
-        u = get_ws_scope(uid)
-        u[f"threads/{t.id}"] = t.model_dump()
+    data = t.model_dump()
+    if stage_set(uid, scoped_path(uid, f"threads/{t.id}"), data):
         return
-    fs_doc_uid(uid, f"threads/{t.id}").set(t.model_dump())
+    fs_doc_uid(uid, f"threads/{t.id}").set(data)
 
 
 def save_message(uid: str, thread_id: str, msg: Message):
-    if _firestore is None:
-        u = get_ws_scope(uid)
-        u.setdefault(f"threads/{thread_id}/messages", []).append(msg.model_dump())
+    data = msg.model_dump()
+    if stage_set(uid, scoped_path(uid, f"threads/{thread_id}/messages/{msg.id}"), data):
         return
-    fs_doc_uid(uid, f"threads/{thread_id}/messages/{msg.id}").set(msg.model_dump())
+    fs_doc_uid(uid, f"threads/{thread_id}/messages/{msg.id}").set(data)
 
 
 def audit(uid: str, payload: Dict[str, Any]):
@@ -930,34 +2506,144 @@ def audit(uid: str, payload: Dict[str, Any]):
     add_doc(uid, "auditLog", payload)
 
 
-def list_dev_docs(u: Dict[str, Any], prefix: str) -> List[Dict[str, Any]]:
-    out = []
-    for key, value in u.items():
-        if key.startswith(prefix):
-            out.append(value)
-    return out
-
-
-def list_action_queue_items(uid: str) -> List[Dict[str, Any]]:
-    if _firestore is None:
-        u = get_ws_scope(uid)
-        return list_dev_docs(u, "actionQueue/")
-    docs = fs_col_uid(uid, "actionQueue").stream()
-    return [d.to_dict() for d in docs]
+def list_action_queue_items(uid: str, status: Optional[str] = None) -> List[Dict[str, Any]]:
+    query = fs_col_uid(uid, "actionQueue")
+    if status:
+        query = query.where("status", "==", status)
+    return [d.to_dict() for d in query.stream()]
 
 
 # ============================================================
 # INTENT + RISK (cheap classifier)
 # ============================================================
-def classify_intent(text: str) -> Dict[str, Any]:
-    t = text.lower()
-    mentions_money = any(k in t for k in ["price", "cost", "how much", "$", "payment", "invoice", "refund", "chargeback"])
-    booking = any(k in t for k in ["book", "schedule", "appointment", "availability"])
-    hours = any(k in t for k in ["hours", "open", "close", "when are you open"])
-    services = any(k in t for k in ["services", "do you", "offer", "can you"])
-    legal = any(k in t for k in ["lawsuit", "attorney", "legal", "sue"])
-    complaint = any(k in t for k in ["complaint", "angry", "bad service", "refund", "chargeback"])
-    status = any(k in t for k in ["status", "update", "where is", "eta", "when will"])
+# Substring keywords per category (matched against the lowercased text).
+# Workspaces can add/remove keywords via config/intentKeywords.
+INTENT_KEYWORDS: Dict[str, List[str]] = {
+    "money": ["price", "cost", "how much", "$", "payment", "invoice", "refund", "chargeback"],
+    "booking": ["book", "schedule", "appointment", "availability"],
+    "hours": ["hours", "open", "close", "when are you open"],
+    "services": ["services", "do you", "offer", "can you"],
+    "legal": ["lawsuit", "attorney", "legal", "sue"],
+    "complaint": ["complaint", "angry", "bad service", "refund", "chargeback"],
+    "status": ["status", "update", "where is", "eta", "when will"],
+}
+
+
+class IntentMatcher:
+    """Finds every keyword category present in a text with one compiled regex.
+
+    The keywords are compiled as a trie-shaped alternation, so the engine
+    branches on one character per position instead of trying each keyword,
+    and the longest keyword starting at a position wins. Scanning resumes one
+    character after each match start, so overlapping keywords are all seen,
+    and each keyword also credits the categories of keywords that are its
+    prefixes. The result is the set of categories `keyword in text` would
+    find for the same keyword lists.
+    """
+
+    def __init__(self, keywords: Dict[str, List[str]]):
+        owners: Dict[str, set] = {}
+        for category, words in keywords.items():
+            for word in words:
+                if word:
+                    owners.setdefault(word.lower(), set()).add(category)
+        self.categories: Dict[str, frozenset] = {
+            word: frozenset().union(*(cats for prefix, cats in owners.items() if word.startswith(prefix)))
+            for word in owners
+        }
+        self._all = frozenset(keywords)
+        self._search = re.compile(self._trie_pattern(owners)).search if owners else None
+
+    @staticmethod
+    def _trie_pattern(words) -> str:
+        trie: Dict[str, Any] = {}
+        for word in words:
+            node = trie
+            for ch in word:
+                node = node.setdefault(ch, {})
+            node[""] = {}
+
+        def emit(node: Dict[str, Any]) -> str:
+            branches = [re.escape(ch) + emit(child) for ch, child in sorted(node.items()) if ch]
+            if not branches:
+                return ""
+            if len(branches) == 1 and "" not in node:
+                return branches[0]
+            # Greedy optional group: a longer keyword is preferred over its prefix.
+            return "(?:" + "|".join(branches) + ")" + ("?" if "" in node else "")
+
+        return emit(trie)
+
+    def match(self, text: str) -> set:
+        found: set = set()
+        if self._search is None:
+            return found
+        t = text.lower()
+        m = self._search(t)
+        while m is not None:
+            found |= self.categories[m.group()]
+            if len(found) == len(self._all):
+                break
+            m = self._search(t, m.start() + 1)
+        return found
+
+
+DEFAULT_INTENT_MATCHER = IntentMatcher(INTENT_KEYWORDS)
+_INTENT_MATCHERS: "OrderedDict[str, IntentMatcher]" = OrderedDict()
+_INTENT_MATCHERS_LOCK = threading.Lock()
+INTENT_MATCHER_CACHE_SIZE = 256
+
+
+def effective_intent_keywords(cfg: "IntentKeywords") -> Dict[str, List[str]]:
+    out: Dict[str, List[str]] = {}
+    for category, words in INTENT_KEYWORDS.items():
+        drop = {w.lower() for w in cfg.remove.get(category, [])}
+        extra = [w.lower() for w in cfg.add.get(category, []) if w]
+        out[category] = [w for w in words if w not in drop] + [w for w in extra if w not in drop]
+    return out
+
+
+def compiled_intent_matcher(sig: str, cfg: "IntentKeywords") -> IntentMatcher:
+    """Matcher for the overrides identified by `sig`, compiled once and kept in an LRU."""
+    with _INTENT_MATCHERS_LOCK:
+        matcher = _INTENT_MATCHERS.get(sig)
+        if matcher is not None:
+            _INTENT_MATCHERS.move_to_end(sig)
+            return matcher
+    matcher = IntentMatcher(effective_intent_keywords(cfg))
+    with _INTENT_MATCHERS_LOCK:
+        _INTENT_MATCHERS[sig] = matcher
+        while len(_INTENT_MATCHERS) > INTENT_MATCHER_CACHE_SIZE:
+            _INTENT_MATCHERS.popitem(last=False)
+    return matcher
+
+
+def intent_matcher(uid: str) -> IntentMatcher:
+    # Matchers are keyed by the workspace's config version stamp, which every
+    # config write bumps and every worker re-checks, so an override edit maps
+    # to a freshly compiled matcher without hashing the keyword set per call.
+    # Scopes with no stamp yet fall back to a hash of the overrides.
+    cfg = get_cfg(uid, "intentKeywords", IntentKeywords, IntentKeywords())
+    if not cfg.add and not cfg.remove:
+        return DEFAULT_INTENT_MATCHER
+    scope = _config_scope(scoped_path(uid, "config/intentKeywords"))
+    version = config_version_stamp(scope)
+    if version is not None:
+        sig = f"{scope}@{version}"
+    else:
+        sig = hashlib.sha1(json.dumps(cfg.model_dump(), sort_keys=True).encode()).hexdigest()
+    return compiled_intent_matcher(sig, cfg)
+
+
+def classify_intent(text: str, matcher: Optional[IntentMatcher] = None) -> Dict[str, Any]:
+    found = (matcher or DEFAULT_INTENT_MATCHER).match(text)
+    mentions_money = "money" in found
+    booking = "booking" in found
+    hours = "hours" in found
+    services = "services" in found
+    legal = "legal" in found
+    complaint = "complaint" in found
+    status = "status" in found
 
     if legal:
         intent = "legal"
@@ -975,7 +2661,10 @@ def classify_intent(text: str) -> Dict[str, Any]:
         intent = "status"
     else:
         intent = "default"
+    return {"intent": intent, "risk": intent_risk(intent, mentions_money), "mentions_money": mentions_money}
 
+
+def intent_risk(intent: str, mentions_money: bool) -> float:
     risk = 0.15
     if intent in ["legal"]:
         risk = 0.95
@@ -985,55 +2674,1038 @@ def classify_intent(text: str) -> Dict[str, Any]:
         risk = 0.55
     elif intent in ["booking"]:
         risk = 0.25
-    return {"intent": intent, "risk": risk, "mentions_money": mentions_money}
+    return risk
+
+
+def classify_intents(texts: List[str], matcher: Optional[IntentMatcher] = None) -> List[Dict[str, Any]]:
+    """classify_intent for many texts, refined by the local intent model when one is loaded.
+
+    The model scores the whole list in one matrix multiply and may name an
+    intent for texts no keyword matched; it never overrides a keyword intent,
+    so legal/complaint routing stays rule-based. Its probability becomes the
+    decision confidence ("confidence" key) only for those texts or when its
+    top label agrees with the keywords. On disagreement decision_core keeps
+    the rule-based confidence, so a keyword the model never saw (e.g. one a
+    workspace added) isn't queued as low confidence.
+    """
+    out = [classify_intent(text, matcher) for text in texts]
+    model = intent_model()
+    if model is None or not texts:
+        return out
+    try:
+        probs = model.predict_proba(texts)
+    except Exception as exc:
+        print("Intent model error:", repr(exc))
+        return out
+    for cls, row in zip(out, probs):
+        scores = dict(zip(model.labels, (float(p) for p in row)))
+        best = max(scores, key=scores.get)
+        keyword_intent = cls["intent"]
+        if keyword_intent == "default" and best != "default" and scores[best] >= INTENT_MODEL_MIN_PROB:
+            cls["intent"] = best
+            cls["risk"] = intent_risk(best, cls["mentions_money"])
+            cls["intent_source"] = "model"
+        if keyword_intent == "default" or best == keyword_intent:
+            cls["confidence"] = round(scores.get(cls["intent"], 0.0), 4)
+        cls["model"] = model.version
+    return out
 
 
 # ============================================================
-# AI GENERATION (HF + fallbacks)
+# INTENT MODEL (optional local classifier)
 # ============================================================
-def hf_reply(bp: BusinessProfile, oc: OwnerCoverSettings, contact: Contact, inbound: str, mode: str) -> Optional[str]:
-    if hf_client is None:
-        return None
+# Multinomial logistic regression over hashed word uni/bigrams and character
+# trigrams, run with NumPy on CPU. It is trained offline from stored decisions
+# and outcomes (scripts/train_intent_model.py), loaded lazily from
+# INTENT_MODEL_PATH on first use, and skipped (keyword classifier only) when
+# NumPy or the model file is missing.
+# ------------------------------------------------------------
+INTENT_LABELS = ["legal", "complaint", "booking", "pricing_basic", "hours", "services", "status", "default"]
+_WORD_RE = re.compile(r"[a-z0-9$']+")
+
+
+def _mix(np_mod, h, salt: int):
+    """Spread 64-bit feature hashes (Fibonacci hashing), salted per feature family."""
+    return ((h ^ np_mod.uint64(salt)) * np_mod.uint64(0x9E3779B97F4A7C15)) >> np_mod.uint64(32)
+
+
+def intent_features(texts: List[str], dim: int) -> tuple:
+    """Sparse, L2-normalized log-count features as (rows, cols, vals), sorted by row.
+
+    Word unigrams and bigrams hash each word with crc32; character trigrams
+    are rolled over the bytes of all texts at once. Every row carries a
+    constant feature so no text comes out empty.
+    """
+    np_mod = _numpy()
+    u64 = np_mod.uint64
+    n = len(texts)
+    word_lists = [_WORD_RE.findall(t.lower()) for t in texts]
+    word_rows = np_mod.repeat(np_mod.arange(n), [len(w) for w in word_lists])
+    word_h = np_mod.fromiter(
+        (zlib.crc32(w.encode()) for words in word_lists for w in words), dtype=u64, count=len(word_rows)
+    )
+    same = word_rows[:-1] == word_rows[1:]
+    bigram_h = (word_h[:-1] * u64(1000003) + word_h[1:])[same]
+
+    joined = [(" " + " ".join(words) + " ").encode() for words in word_lists]
+    chars = np_mod.frombuffer(b"".join(joined), dtype=np_mod.uint8).astype(u64)
+    char_rows = np_mod.repeat(np_mod.arange(n), [len(j) for j in joined])
+    tri_ok = char_rows[:-2] == char_rows[2:]
+    tri_h = (chars[:-2] << u64(16) | chars[1:-1] << u64(8) | chars[2:])[tri_ok]
+
+    rows = np_mod.concatenate([word_rows, word_rows[:-1][same], char_rows[:-2][tri_ok], np_mod.arange(n)])
+    hashes = np_mod.concatenate([
+        _mix(np_mod, word_h, 1),
+        _mix(np_mod, bigram_h, 2),
+        _mix(np_mod, tri_h, 3),
+        np_mod.zeros(n, dtype=u64),
+    ])
+    keys, counts = np_mod.unique(rows.astype(u64) * u64(dim) + hashes % u64(dim), return_counts=True)
+    rows = (keys // u64(dim)).astype(np_mod.int64)
+    cols = (keys % u64(dim)).astype(np_mod.int64)
+    vals = np_mod.log1p(counts.astype(np_mod.float32))
+    norms = np_mod.sqrt(np_mod.bincount(rows, weights=vals * vals, minlength=n)).astype(np_mod.float32)
+    return rows, cols, vals / norms[rows]
+
+
+class IntentModel:
+    def __init__(self, weights, bias, labels: List[str], temperature: float = 1.0, version: str = ""):
+        self.weights = weights
+        self.bias = bias
+        self.labels = list(labels)
+        self.dim = int(weights.shape[0])
+        self.temperature = float(temperature)
+        self.version = version or hashlib.sha1(weights.tobytes()).hexdigest()[:12]
+
+    def logits(self, texts: List[str]):
+        """Sparse feature matrix times the weight matrix, for the whole batch at once."""
+        np_mod = _numpy()
+        rows, cols, vals = intent_features(texts, self.dim)
+        starts = np_mod.flatnonzero(np_mod.r_[True, rows[1:] != rows[:-1]])
+        return np_mod.add.reduceat(self.weights[cols] * vals[:, None], starts, axis=0) + self.bias
+
+    def predict_proba(self, texts: List[str]):
+        np_mod = _numpy()
+        z = self.logits(texts) / self.temperature
+        z -= z.max(axis=1, keepdims=True)
+        e = np_mod.exp(z)
+        return e / e.sum(axis=1, keepdims=True)
+
+    def save(self, path: str):
+        _numpy().savez_compressed(
+            path,
+            weights=self.weights,
+            bias=self.bias,
+            labels=_numpy().array(self.labels),
+            temperature=self.temperature,
+            version=self.version,
+        )
 
-    system = f"""You are Main St AI - a front-office operator for a small business.
+    @classmethod
+    def load(cls, path: str) -> "IntentModel":
+        data = _numpy().load(path, allow_pickle=False)
+        return cls(
+            data["weights"],
+            data["bias"],
+            [str(x) for x in data["labels"]],
+            float(data["temperature"]),
+            str(data["version"]),
+        )
 
-Business:
-- Name: {bp.business_name}
-- Services: {", ".join(bp.services) if bp.services else "N/A"}
-- Service area: {bp.service_area or "N/A"}
-- Hours: {bp.hours}
-- Pricing notes: {bp.pricing_notes or "N/A"}
-- Policies: {bp.policies or "N/A"}
-Tone: {bp.tone}
 
-Operating Rules:
-- Be concise and professional.
+def _numpy():
+    import numpy
+    return numpy
+
+
+_INTENT_MODEL: Optional[IntentModel] = None
+_INTENT_MODEL_TRIED = False
+_INTENT_MODEL_LOCK = threading.Lock()
+
+
+def intent_model() -> Optional[IntentModel]:
+    global _INTENT_MODEL, _INTENT_MODEL_TRIED
+    if _INTENT_MODEL_TRIED:
+        return _INTENT_MODEL
+    with _INTENT_MODEL_LOCK:
+        if not _INTENT_MODEL_TRIED:
+            if INTENT_MODEL_PATH and os.path.exists(INTENT_MODEL_PATH):
+                try:
+                    _INTENT_MODEL = IntentModel.load(INTENT_MODEL_PATH)
+                    print("Intent model loaded:", INTENT_MODEL_PATH, _INTENT_MODEL.version)
+                except Exception as exc:
+                    print("Intent model load error:", repr(exc))
+            _INTENT_MODEL_TRIED = True
+    return _INTENT_MODEL
+
+
+# Sample weights: an owner's explicit intent correction counts double an
+# approval; outcomes on the thread scale either.
+OWNER_APPROVED_STATUSES = {"approved", "sent"}
+CORRECTED_SAMPLE_WEIGHT = 2.0
+OUTCOME_SAMPLE_WEIGHTS = {
+    "won": 1.5,
+    "resolved": 1.5,
+    "satisfied": 1.5,
+    "follow_up_success": 1.25,
+    "lost": 0.75,
+    "follow_up_failed": 0.75,
+    "unsatisfied": 0.5,
+    "owner_intervened": 0.5,
+}
+
+
+def _collection_rows(uid: str, path: str) -> List[Dict[str, Any]]:
+    return [d.to_dict() for d in fs_col_uid(uid, path).stream()]
+
+
+def intent_training_samples(uid: str) -> tuple:
+    """(texts, labels, weights) from the owner-reviewed decisions of the workspace.
+
+    Labels come from operators, not from the rules the model backs up: an
+    intent the owner corrected on approve/block is the label; an action they
+    approved as-is confirms the decision's intent. Blocked actions without a
+    correction, unreviewed queue items and auto-sent replies say nothing about
+    the intent and are skipped. Thread outcomes scale the weights.
+    """
+    actions = {a.get("decision_id"): a for a in _collection_rows(uid, "actionQueue")}
+    outcomes: Dict[str, List[str]] = {}
+    for o in _collection_rows(uid, "outcomes"):
+        outcomes.setdefault(o.get("thread_id"), []).append(o.get("type"))
+    texts: List[str] = []
+    labels: List[str] = []
+    weights: List[float] = []
+    for d in _collection_rows(uid, "decisions"):
+        text = d.get("inbound_text")
+        action = actions.get(d.get("id")) or {}
+        if not text or not action.get("reviewed_ts"):
+            continue
+        if action.get("corrected_intent"):
+            label, weight = action["corrected_intent"], CORRECTED_SAMPLE_WEIGHT
+        elif action.get("status") in OWNER_APPROVED_STATUSES:
+            label, weight = d.get("intent"), 1.0
+        else:
+            continue
+        if label not in INTENT_LABELS:
+            continue
+        for kind in outcomes.get(d.get("thread_id"), []):
+            weight *= OUTCOME_SAMPLE_WEIGHTS.get(kind, 1.0)
+        texts.append(text)
+        labels.append(label)
+        weights.append(weight)
+    return texts, labels, weights
+
+
+def train_intent_model(
+    texts: List[str],
+    labels: List[str],
+    sample_weights: Optional[List[float]] = None,
+    dim: int = 1 << 14,
+    epochs: int = 30,
+    lr: float = 0.5,
+    l2: float = 1e-4,
+    batch_size: int = 256,
+    seed: int = 0,
+) -> IntentModel:
+    """Fit softmax regression with minibatch gradient descent, then temperature-scale
+    the probabilities on a 10% holdout so confidence thresholds mean what they say."""
+    np_mod = _numpy()
+    rng = np_mod.random.default_rng(seed)
+    index = {label: i for i, label in enumerate(INTENT_LABELS)}
+    keep = [i for i, label in enumerate(labels) if label in index]
+    y = np_mod.array([index[labels[i]] for i in keep], dtype=np_mod.int64)
+    sw = np_mod.array([sample_weights[i] if sample_weights else 1.0 for i in keep], dtype=np_mod.float32)
+    if not len(y):
+        raise ValueError("No labelled samples")
+
+    order = rng.permutation(len(y))
+    n_hold = len(y) // 10 if len(y) >= 50 else 0
+    hold, train = order[:n_hold], order[n_hold:]
+
+    k = len(INTENT_LABELS)
+    w = np_mod.zeros((dim, k), dtype=np_mod.float32)
+    b = np_mod.zeros(k, dtype=np_mod.float32)
+    for _ in range(epochs):
+        rng.shuffle(train)
+        for start in range(0, len(train), batch_size):
+            batch = train[start:start + batch_size]
+            rows, cols, vals = intent_features([texts[keep[i]] for i in batch], dim)
+            x = np_mod.zeros((len(batch), dim), dtype=np_mod.float32)
+            x[rows, cols] = vals
+            z = x @ w + b
+            z -= z.max(axis=1, keepdims=True)
+            p = np_mod.exp(z)
+            p /= p.sum(axis=1, keepdims=True)
+            p[np_mod.arange(len(batch)), y[batch]] -= 1.0
+            g = p * (sw[batch] / sw[batch].sum())[:, None]
+            w -= lr * (x.T @ g + l2 * w)
+            b -= lr * g.sum(axis=0)
+
+    model = IntentModel(w, b, INTENT_LABELS)
+    if n_hold:
+        z = model.logits([texts[keep[i]] for i in hold])
+        best_t, best_nll = 1.0, float("inf")
+        for t in np_mod.geomspace(0.05, 5.0, 41):
+            zt = z / t
+            zt -= zt.max(axis=1, keepdims=True)
+            logp = zt - np_mod.log(np_mod.exp(zt).sum(axis=1, keepdims=True))
+            nll = float(-(logp[np_mod.arange(len(hold)), y[hold]] * sw[hold]).sum() / sw[hold].sum())
+            if nll < best_nll:
+                best_t, best_nll = float(t), nll
+        model.temperature = best_t
+    return model
+
+
+# ============================================================
+# AI GENERATION (HF + fallbacks)
+# ============================================================
+# ------------------------------------------------------------
+# Reply cache. Most inbound messages are the same handful of questions, so
+# hf_reply results are kept (LRU + TTL) under a hash of everything that goes
+# into the prompt plus the normalized message text. A changed profile hashes
+# differently, so edits take effect immediately; set_bp also drops the old
+# profile's entries. The prompt carries the customer's name, so the name is
+# part of the key: only contacts with the same name (or none) and lead status
+# share a reply, and no customer is ever greeted with another's name.
+# ------------------------------------------------------------
+_REPLY_CACHE: "OrderedDict[str, tuple]" = OrderedDict()
+_REPLY_LOCK = threading.Lock()
+REPLY_CACHE_STATS: Dict[str, int] = {"hits": 0, "misses": 0, "stored": 0, "evictions": 0, "expired": 0, "invalidations": 0}
+_REPLY_NORMALIZE_RE = re.compile(r"[^a-z0-9$']+")
+
+
+def normalize_inbound(text: str) -> str:
+    return _REPLY_NORMALIZE_RE.sub(" ", (text or "").lower()).strip()
+
+
+def profile_fingerprint(bp: BusinessProfile) -> str:
+    return hashlib.sha1(bp.model_dump_json().encode()).hexdigest()
+
+
+def _reply_cache_key(profile_fp: str, oc: OwnerCoverSettings, contact: Contact, text: str, mode: str) -> str:
+    parts = [profile_fp, oc.model_dump(), mode, contact.lead_status, contact.name or "", normalize_inbound(text)]
+    return hashlib.sha1(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def cached_reply(
+    bp: BusinessProfile, oc: OwnerCoverSettings, contact: Contact, inbound: str, mode: str, profile_fp: str = ""
+) -> Optional[str]:
+    if REPLY_CACHE_SIZE <= 0:
+        return None
+    key = _reply_cache_key(profile_fp or profile_fingerprint(bp), oc, contact, inbound, mode)
+    with _REPLY_LOCK:
+        entry = _REPLY_CACHE.get(key)
+        if entry is not None and entry[0] <= time.time():
+            del _REPLY_CACHE[key]
+            REPLY_CACHE_STATS["expired"] += 1
+            entry = None
+        if entry is None:
+            REPLY_CACHE_STATS["misses"] += 1
+            return None
+        _REPLY_CACHE.move_to_end(key)
+        REPLY_CACHE_STATS["hits"] += 1
+        return entry[2]
+
+
+def remember_reply(
+    bp: BusinessProfile, oc: OwnerCoverSettings, contact: Contact, inbound: str, mode: str, reply: str, profile_fp: str = ""
+):
+    if REPLY_CACHE_SIZE <= 0:
+        return
+    fp = profile_fp or profile_fingerprint(bp)
+    key = _reply_cache_key(fp, oc, contact, inbound, mode)
+    with _REPLY_LOCK:
+        _REPLY_CACHE[key] = (time.time() + REPLY_CACHE_TTL_SECONDS, fp, reply)
+        _REPLY_CACHE.move_to_end(key)
+        REPLY_CACHE_STATS["stored"] += 1
+        while len(_REPLY_CACHE) > REPLY_CACHE_SIZE:
+            _REPLY_CACHE.popitem(last=False)
+            REPLY_CACHE_STATS["evictions"] += 1
+
+
+def forget_replies(bp: BusinessProfile) -> int:
+    """Drop every cached reply generated from this profile."""
+    fp = profile_fingerprint(bp)
+    with _REPLY_LOCK:
+        stale = [k for k, entry in _REPLY_CACHE.items() if entry[1] == fp]
+        for key in stale:
+            del _REPLY_CACHE[key]
+        REPLY_CACHE_STATS["invalidations"] += len(stale)
+    return len(stale)
+
+
+def reply_cache_stats() -> Dict[str, Any]:
+    with _REPLY_LOCK:
+        size = len(_REPLY_CACHE)
+    lookups = REPLY_CACHE_STATS["hits"] + REPLY_CACHE_STATS["misses"]
+    return {
+        **REPLY_CACHE_STATS,
+        "size": size,
+        "hit_ratio": round(REPLY_CACHE_STATS["hits"] / lookups, 4) if lookups else 0.0,
+    }
+
+
+# ------------------------------------------------------------
+# Prompt registry. A template is a static part rendered from the business
+# profile and a dynamic part rendered per call (mode, customer). The static
+# part comes first and is cached per profile fingerprint, so a call only
+# formats the short dynamic tail, and every prompt for one profile starts
+# with the same bytes, which inference servers can reuse through prefix
+# caching. Token counts are estimates (words + punctuation); no tokenizer is
+# loaded.
+# ------------------------------------------------------------
+PROMPT_TEMPLATES: Dict[str, Dict[str, str]] = {
+    "reply": {
+        "static": """You are Main St AI - a front-office operator for a small business.
+
+Business:
+- Name: {business_name}
+- Services: {services}
+- Service area: {service_area}
+- Hours: {hours}
+- Pricing notes: {pricing_notes}
+- Policies: {policies}
+Tone: {tone}
+
+Operating Rules:
+- Be concise and professional.
 - Ask at most ONE follow-up question.
 - Never claim actions were performed unless you explicitly did them.
 - For booking: ask for preferred day/time; reference hours.
 - For pricing: give a general range using pricing notes; request one detail.
 - For complaints/legal/refunds: respond calmly and escalate to owner; ask for details and best contact method.
-Mode: {mode}
+""",
+        "dynamic": """Mode: {mode}
 
 Customer context:
-- Name: {contact.name or "Unknown"}
-- Lead status: {contact.lead_status}
-"""
+- Name: {contact_name}
+- Lead status: {lead_status}
+""",
+    },
+}
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+
+
+def estimate_tokens(text: str) -> int:
+    return len(_TOKEN_RE.findall(text))
+
+
+def business_prompt_fields(bp: BusinessProfile) -> Dict[str, Any]:
+    return {
+        "business_name": bp.business_name,
+        "services": ", ".join(bp.services) if bp.services else "N/A",
+        "service_area": bp.service_area or "N/A",
+        "hours": bp.hours,
+        "pricing_notes": bp.pricing_notes or "N/A",
+        "policies": bp.policies or "N/A",
+        "tone": bp.tone,
+    }
+
+
+class PromptRegistry:
+    def __init__(self, templates: Dict[str, Dict[str, str]], size: int):
+        self.templates = templates
+        self.size = size
+        self._lock = threading.Lock()
+        self._prefixes: "OrderedDict[tuple, tuple]" = OrderedDict()
+        # Tokens in each dynamic part's fixed text; the per-call values are word-counted.
+        self._tail_tokens = {n: estimate_tokens(re.sub(r"\{\w+\}", "", t["dynamic"])) for n, t in templates.items()}
+        self.stats: Dict[str, int] = {"hits": 0, "misses": 0, "evictions": 0, "rendered": 0, "prompt_tokens": 0, "prefix_tokens": 0}
+
+    def prefix(self, name: str, bp: BusinessProfile, profile_fp: str = "") -> tuple:
+        """(static text, estimated tokens) for template `name` under this profile."""
+        key = (name, profile_fp or profile_fingerprint(bp))
+        with self._lock:
+            entry = self._prefixes.get(key)
+            if entry is not None:
+                self._prefixes.move_to_end(key)
+                self.stats["hits"] += 1
+                return entry
+            self.stats["misses"] += 1
+        text = self.templates[name]["static"].format(**business_prompt_fields(bp))
+        entry = (text, estimate_tokens(text))
+        with self._lock:
+            self._prefixes[key] = entry
+            while len(self._prefixes) > max(1, self.size):
+                self._prefixes.popitem(last=False)
+                self.stats["evictions"] += 1
+        return entry
+
+    def render(self, name: str, bp: BusinessProfile, profile_fp: str = "", **fields: Any) -> str:
+        prefix, prefix_tokens = self.prefix(name, bp, profile_fp)
+        tail = self.templates[name]["dynamic"].format(**fields)
+        tail_tokens = self._tail_tokens[name] + sum(len(str(v).split()) for v in fields.values())
+        with self._lock:
+            self.stats["rendered"] += 1
+            self.stats["prefix_tokens"] += prefix_tokens
+            self.stats["prompt_tokens"] += prefix_tokens + tail_tokens
+        return prefix + tail
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            out: Dict[str, Any] = {**self.stats, "size": len(self._prefixes)}
+        rendered = out["rendered"]
+        out["avg_prompt_tokens"] = round(out["prompt_tokens"] / rendered, 1) if rendered else 0.0
+        out["cached_prefix_share"] = round(out["prefix_tokens"] / out["prompt_tokens"], 4) if out["prompt_tokens"] else 0.0
+        return out
+
+
+PROMPTS = PromptRegistry(PROMPT_TEMPLATES, PROMPT_CACHE_SIZE)
+
+
+def reply_system_prompt(bp: BusinessProfile, contact: Contact, mode: str, profile_fp: str = "") -> str:
+    return PROMPTS.render(
+        "reply", bp, profile_fp, mode=mode, contact_name=contact.name or "Unknown", lead_status=contact.lead_status
+    )
 
+
+# ------------------------------------------------------------
+# Inference gate. Model calls run with the async client on one background
+# event loop. Async endpoints (/chat, /ownercover/handleInbound) await the
+# call with acall() and hold no thread while it runs; sync callers (batch and
+# background work, streaming) use call() and wait on their thread. Either
+# way the wait is capped at HF_DEADLINE_SECONDS, queueing included, and then
+# the fallback reply is used. Concurrency is capped globally and per
+# workspace. Once a workspace has HF_TENANT_MAX_QUEUE calls waiting, or
+# HF_MAX_QUEUE are waiting overall, new ones go straight to the fallback.
+# After HF_BREAKER_FAILURES consecutive model errors or timeouts (time spent
+# queueing does not count) the breaker opens and the model is skipped for
+# HF_BREAKER_COOLDOWN_SECONDS, then a single trial call decides whether it
+# closes again.
+# ------------------------------------------------------------
+class InferenceGate:
+    def __init__(
+        self,
+        max_concurrency: int,
+        tenant_concurrency: int,
+        max_queue: int,
+        tenant_max_queue: int,
+        failures: int,
+        cooldown: float,
+    ):
+        self.max_concurrency = max(1, max_concurrency)
+        self.tenant_concurrency = max(1, tenant_concurrency)
+        self.max_queue = max_queue
+        # Kept below max_queue so one busy workspace can't fill the shared queue.
+        self.tenant_max_queue = min(tenant_max_queue, max_queue)
+        self.failure_threshold = max(1, failures)
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._global: Optional[asyncio.Semaphore] = None
+        self._tenants: Dict[str, asyncio.Semaphore] = {}
+        self._failures = 0
+        self._open_until = 0.0
+        self._trial = False
+        self.queued = 0
+        self._tenant_queued: Dict[str, int] = {}
+        self.inflight = 0
+        self.stats: Dict[str, int] = {
+            "calls": 0,
+            "ok": 0,
+            "errors": 0,
+            "timeouts": 0,
+            "cancelled": 0,
+            "shed": 0,
+            "tenant_shed": 0,
+            "short_circuited": 0,
+            "breaker_opened": 0,
+        }
+
+    def loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="hf-inference", daemon=True).start()
+                self._global = asyncio.Semaphore(self.max_concurrency)
+                self._loop = loop
+            return self._loop
+
+    def state(self) -> str:
+        if self._open_until == 0.0:
+            return "closed"
+        return "open" if time.time() < self._open_until else "half_open"
+
+    def _admit(self, tenant: str) -> bool:
+        with self._lock:
+            self.stats["calls"] += 1
+            state = self.state()
+            if state == "open" or (state == "half_open" and self._trial):
+                self.stats["short_circuited"] += 1
+                return False
+            waiting = self._tenant_queued.get(tenant, 0)
+            if waiting >= self.tenant_max_queue:
+                self.stats["tenant_shed"] += 1
+                return False
+            if self.queued >= self.max_queue:
+                self.stats["shed"] += 1
+                return False
+            if state == "half_open":
+                self._trial = True
+            self.queued += 1
+            self._tenant_queued[tenant] = waiting + 1
+            return True
+
+    def _record(self, ok: Optional[bool], outcome: str):
+        """Count the outcome; ok=None (never reached the model) leaves the breaker alone."""
+        with self._lock:
+            self.stats[outcome] += 1
+            self._trial = False
+            if ok is None:
+                return
+            if ok:
+                self._failures = 0
+                self._open_until = 0.0
+                return
+            self._failures += 1
+            if self._failures >= self.failure_threshold or self._open_until:
+                if self.state() != "open":
+                    self.stats["breaker_opened"] += 1
+                self._open_until = time.time() + self.cooldown
+
+    def _claim(self, ticket: Dict[str, Any], start: bool) -> bool:
+        """Take a queued call off the queue. Exactly one of the loop (on acquiring
+        permits) and the waiting caller (on giving up) wins."""
+        with self._lock:
+            if ticket["claimed"]:
+                return False
+            ticket["claimed"] = True
+            self.queued -= 1
+            tenant = ticket["tenant"]
+            waiting = self._tenant_queued.get(tenant, 0) - 1
+            if waiting > 0:
+                self._tenant_queued[tenant] = waiting
+            else:
+                self._tenant_queued.pop(tenant, None)
+            self.inflight += int(start)
+            return True
+
+    async def _acquire(self, tenant: str, ticket: Dict[str, Any]) -> asyncio.Semaphore:
+        sem = self._tenants.get(tenant)
+        if sem is None:
+            sem = self._tenants[tenant] = asyncio.Semaphore(self.tenant_concurrency)
+        await sem.acquire()
+        try:
+            await self._global.acquire()
+        except BaseException:
+            sem.release()
+            raise
+        if not self._claim(ticket, True):
+            self._global.release()
+            sem.release()
+            raise asyncio.CancelledError()
+        return sem
+
+    def _release(self, sem: asyncio.Semaphore):
+        self._global.release()
+        sem.release()
+        with self._lock:
+            self.inflight -= 1
+
+    async def _call(self, tenant: str, factory: Callable[[], Any], ticket: Dict[str, Any]):
+        sem = await self._acquire(tenant, ticket)
+        try:
+            return await factory()
+        finally:
+            self._release(sem)
+
+    def call(self, tenant: str, factory: Callable[[], Any], deadline: float) -> Any:
+        """Run the coroutine made by `factory()` under the limits; None on shed, timeout or error."""
+        if not self._admit(tenant):
+            return None
+        ticket = {"claimed": False, "tenant": tenant}
+        fut = asyncio.run_coroutine_threadsafe(self._call(tenant, factory, ticket), self.loop())
+        try:
+            result = fut.result(timeout=deadline)
+        except FutureTimeout:
+            fut.cancel()
+            queued = self._claim(ticket, False)
+            self._record(None if queued else False, "timeouts")
+            return None
+        except Exception as exc:
+            print("HF error:", repr(exc))
+            self._record(False, "errors")
+            return None
+        self._record(True, "ok")
+        return result
+
+    async def acall(self, tenant: str, factory: Callable[[], Any], deadline: float) -> Any:
+        """call() for async callers: awaits the result on the caller's loop instead of blocking a thread."""
+        if not self._admit(tenant):
+            return None
+        ticket = {"claimed": False, "tenant": tenant}
+        fut = asyncio.run_coroutine_threadsafe(self._call(tenant, factory, ticket), self.loop())
+        try:
+            result = await asyncio.wait_for(asyncio.wrap_future(fut), deadline)
+        except asyncio.TimeoutError:
+            queued = self._claim(ticket, False)
+            self._record(None if queued else False, "timeouts")
+            return None
+        except asyncio.CancelledError:
+            # The request went away; says nothing about the model's health.
+            fut.cancel()
+            self._claim(ticket, False)
+            self._record(None, "cancelled")
+            raise
+        except Exception as exc:
+            print("HF error:", repr(exc))
+            self._record(False, "errors")
+            return None
+        self._record(True, "ok")
+        return result
+
+    def stream(self, tenant: str, factory: Callable[[], Any], deadline: float) -> Iterator[Any]:
+        """Iterate the async stream made by `factory()` under the limits.
+
+        `deadline` bounds the wait for each chunk (the first one includes
+        queueing). Raises RuntimeError when skipped or timed out; model errors
+        propagate.
+        """
+        if not self._admit(tenant):
+            raise RuntimeError("HF unavailable (breaker open or queue full)")
+        ticket = {"claimed": False, "tenant": tenant}
+        loop = self.loop()
+        held: Dict[str, Any] = {}
+
+        async def open_stream():
+            held["sem"] = await self._acquire(tenant, ticket)
+            held["it"] = (await factory()).__aiter__()
+
+        async def close_stream():
+            it = held.pop("it", None)
+            if it is not None and hasattr(it, "aclose"):
+                await it.aclose()
+            if "sem" in held:
+                self._release(held.pop("sem"))
+
+        outcome = "errors"
+        fut = asyncio.run_coroutine_threadsafe(open_stream(), loop)
+        try:
+            fut.result(timeout=deadline)
+            while True:
+                fut = asyncio.run_coroutine_threadsafe(held["it"].__anext__(), loop)
+                try:
+                    chunk = fut.result(timeout=deadline)
+                except StopAsyncIteration:
+                    break
+                yield chunk
+            outcome = "ok"
+        except FutureTimeout:
+            fut.cancel()
+            outcome = "timeouts"
+            raise RuntimeError("HF deadline exceeded")
+        except GeneratorExit:
+            # The client went away; says nothing about the model's health.
+            outcome = "cancelled"
+            raise
+        finally:
+            queued = self._claim(ticket, False)
+            try:
+                asyncio.run_coroutine_threadsafe(close_stream(), loop).result(timeout=5)
+            except Exception as exc:
+                print("HF stream close error:", repr(exc))
+            self._record(None if queued or outcome == "cancelled" else outcome == "ok", outcome)
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                **self.stats,
+                "breaker": self.state(),
+                "consecutive_failures": self._failures,
+                "queued": self.queued,
+                "tenants_queued": len(self._tenant_queued),
+                "inflight": self.inflight,
+                "tenants": len(self._tenants),
+            }
+
+
+INFERENCE_GATE = InferenceGate(
+    HF_MAX_CONCURRENCY,
+    HF_TENANT_CONCURRENCY,
+    HF_MAX_QUEUE,
+    HF_TENANT_MAX_QUEUE,
+    HF_BREAKER_FAILURES,
+    HF_BREAKER_COOLDOWN_SECONDS,
+)
+
+
+# ------------------------------------------------------------
+# Single-flight. Concurrent hf_reply calls with the same rendered prompt share
+# one model call: the first caller makes it, the rest wait for its result.
+# ------------------------------------------------------------
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[str, Future] = {}
+        self.stats: Dict[str, int] = {"leaders": 0, "followers": 0}
+
+    def do(self, key: str, fn: Callable[[], Any], timeout: Optional[float] = None) -> Any:
+        with self._lock:
+            fut = self._calls.get(key)
+            leader = fut is None
+            if leader:
+                fut = self._calls[key] = Future()
+                self.stats["leaders"] += 1
+            else:
+                self.stats["followers"] += 1
+        if not leader:
+            return fut.result(timeout=timeout)
+        try:
+            result = fn()
+        except BaseException as exc:
+            fut.set_exception(exc)
+            raise
+        else:
+            fut.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+
+    async def ado(self, key: str, fn: Callable[[], Awaitable[Any]], timeout: Optional[float] = None) -> Any:
+        """do() for async callers; shares in-flight calls with sync callers of the same key."""
+        with self._lock:
+            fut = self._calls.get(key)
+            leader = fut is None
+            if leader:
+                fut = self._calls[key] = Future()
+                self.stats["leaders"] += 1
+            else:
+                self.stats["followers"] += 1
+        if not leader:
+            return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(fut)), timeout)
+        try:
+            result = await fn()
+        except BaseException as exc:
+            fut.set_exception(exc)
+            raise
+        else:
+            fut.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+
+    def metrics(self) -> Dict[str, int]:
+        with self._lock:
+            return {"coalesced_leaders": self.stats["leaders"], "coalesced_followers": self.stats["followers"], "prompts_in_flight": len(self._calls)}
+
+
+HF_SINGLE_FLIGHT = SingleFlight()
+
+
+# ------------------------------------------------------------
+# Micro-batching (HF_BATCH_URL). For self-hosted generation servers that take
+# several conversations per request. hf_reply prompts from every workspace
+# are collected on the inference loop for up to HF_BATCH_WAIT_MS or
+# HF_BATCH_MAX_ITEMS, whichever comes first, and POSTed together:
+#   request:  [{"messages": [...], "max_tokens": n, "temperature": t}, ...]
+#   response: one entry per item, an OpenAI-style chat completion
+#             ({"choices": [{"message": {"content": "..."}}]}) or {"error": "..."}
+# The gate's limits still apply per prompt, so HF_MAX_CONCURRENCY should be
+# at least HF_BATCH_MAX_ITEMS for batches to fill.
+# ------------------------------------------------------------
+class MicroBatcher:
+    def __init__(self, url: str, max_items: int, wait_ms: float, token: str = ""):
+        self.url = url
+        self.max_items = max(1, max_items)
+        self.wait = max(0.0, wait_ms) / 1000.0
+        self.token = token
+        self._pending: List[tuple] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self.stats: Dict[str, int] = {"batches": 0, "items": 0, "max_batch": 0, "full": 0, "timed": 0, "errors": 0, "bad_rows": 0}
+
+    async def complete(self, messages: List[Dict[str, str]], max_tokens: int, temperature: float) -> str:
+        """Queue one conversation for the next batch and wait for its reply (runs on the inference loop)."""
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        self._pending.append(({"messages": messages, "max_tokens": max_tokens, "temperature": temperature}, fut))
+        if len(self._pending) >= self.max_items:
+            self.stats["full"] += 1
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.wait, self._flush_timed)
+        return await fut
+
+    def _flush_timed(self):
+        self.stats["timed"] += 1
+        self._flush()
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        # Callers that hit their deadline cancel their future; drop those.
+        batch = [(item, fut) for item, fut in self._pending if not fut.done()]
+        self._pending = []
+        while batch:
+            chunk, batch = batch[:self.max_items], batch[self.max_items:]
+            asyncio.get_running_loop().create_task(self._dispatch(chunk))
+
+    def _post(self, items: List[Dict[str, Any]]) -> List[Any]:
+        req = urllib.request.Request(self.url, data=json.dumps(items).encode(), method="POST")
+        req.add_header("Content-Type", "application/json")
+        if self.token:
+            req.add_header("Authorization", f"Bearer {self.token}")
+        with urllib.request.urlopen(req, timeout=HF_DEADLINE_SECONDS) as resp:
+            return json.loads(resp.read())
+
+    async def _dispatch(self, chunk: List[tuple]):
+        self.stats["batches"] += 1
+        self.stats["items"] += len(chunk)
+        self.stats["max_batch"] = max(self.stats["max_batch"], len(chunk))
+        try:
+            rows = await asyncio.get_running_loop().run_in_executor(None, self._post, [item for item, _ in chunk])
+            if not isinstance(rows, list) or len(rows) != len(chunk):
+                raise ValueError(f"Batch response has {len(rows) if isinstance(rows, list) else 'no'} items, expected {len(chunk)}")
+        except Exception as exc:
+            self.stats["errors"] += 1
+            for _, fut in chunk:
+                if not fut.done():
+                    fut.set_exception(exc)
+            return
+        for (_, fut), row in zip(chunk, rows):
+            if fut.done():
+                continue
+            # One malformed row fails its own caller, not the rest of the batch.
+            try:
+                fut.set_result(self._reply_text(row))
+            except Exception as exc:
+                self.stats["bad_rows"] += 1
+                fut.set_exception(exc)
+
+    @staticmethod
+    def _reply_text(row: Any) -> str:
+        if not isinstance(row, dict) or not row.get("choices"):
+            raise RuntimeError(f"Batch item failed: {row.get('error') if isinstance(row, dict) else row!r}")
+        message = row["choices"][0].get("message") or {}
+        content = message.get("content") or ""
+        if not isinstance(content, str):
+            raise RuntimeError(f"Batch item has non-text content: {content!r}")
+        return content
+
+    def metrics(self) -> Dict[str, Any]:
+        batches = self.stats["batches"]
+        return {**self.stats, "avg_batch": round(self.stats["items"] / batches, 2) if batches else 0.0, "pending": len(self._pending)}
+
+
+HF_BATCHER = MicroBatcher(HF_BATCH_URL, HF_BATCH_MAX_ITEMS, HF_BATCH_WAIT_MS, HF_BATCH_TOKEN) if HF_BATCH_URL else None
+
+
+def inference_tenant() -> str:
+    ctx = _REQUEST_CTX.get()
+    return f"{ctx.uid}/{ctx.workspace_id}" if ctx is not None else "-"
+
+
+def close_inference():
+    if hf_client is not None and INFERENCE_GATE._loop is not None:
+        asyncio.run_coroutine_threadsafe(hf_client.close(), INFERENCE_GATE._loop).result(timeout=5)
+
+
+def reply_messages(bp: BusinessProfile, contact: Contact, inbound: str, mode: str, profile_fp: str) -> List[Dict[str, str]]:
+    return [
+        {"role": "system", "content": reply_system_prompt(bp, contact, mode, profile_fp=profile_fp)},
+        {"role": "user", "content": inbound},
+    ]
+
+
+def completion_factory(messages: List[Dict[str, str]]) -> Callable[[], Any]:
+    """The coroutine factory the gate runs for one reply, through the batcher when configured."""
+    if HF_BATCHER is not None:
+        return lambda: HF_BATCHER.complete(messages, max_tokens=320, temperature=0.4)
+    return lambda: hf_client.chat_completion(messages=messages, max_tokens=320, temperature=0.4)
+
+
+def completion_text(out: Any) -> str:
+    if out is None:
+        return ""
+    if HF_BATCHER is not None:
+        return out.strip()
+    return (out.choices[0].message.content or "").strip()
+
+
+def hf_reply(bp: BusinessProfile, oc: OwnerCoverSettings, contact: Contact, inbound: str, mode: str) -> Optional[str]:
+    if hf_client is None and HF_BATCHER is None:
+        return None
+    fp = profile_fingerprint(bp)
+    cached = cached_reply(bp, oc, contact, inbound, mode, profile_fp=fp)
+    if cached is not None:
+        return cached
+
+    messages = reply_messages(bp, contact, inbound, mode, fp)
+    tenant = inference_tenant()
+
+    def generate() -> str:
+        return completion_text(INFERENCE_GATE.call(tenant, completion_factory(messages), HF_DEADLINE_SECONDS))
+
+    prompt_key = hashlib.sha1(json.dumps(messages).encode()).hexdigest()
     try:
-        resp = hf_client.chat_completion(
-            messages=[
-                {"role": "system", "content": system},
-                {"role": "user", "content": inbound},
-            ],
-            max_tokens=320,
-            temperature=0.4,
-        )
-        out = (resp.choices[0].message.content or "").strip()
-        return out if out else None
-    except Exception as e:
-        print("HF error:", repr(e))
+        out = HF_SINGLE_FLIGHT.do(prompt_key, generate, timeout=HF_DEADLINE_SECONDS)
+    except FutureTimeout:
+        out = ""
+    if not out:
         return None
+    remember_reply(bp, oc, contact, inbound, mode, out, profile_fp=fp)
+    return out
+
+
+async def hf_reply_async(bp: BusinessProfile, oc: OwnerCoverSettings, contact: Contact, inbound: str, mode: str) -> Optional[str]:
+    """hf_reply for async endpoints: the model call is awaited, so no thread waits on it."""
+    if hf_client is None and HF_BATCHER is None:
+        return None
+    fp = profile_fingerprint(bp)
+    cached = cached_reply(bp, oc, contact, inbound, mode, profile_fp=fp)
+    if cached is not None:
+        return cached
+
+    messages = reply_messages(bp, contact, inbound, mode, fp)
+    tenant = inference_tenant()
+
+    async def generate() -> str:
+        return completion_text(await INFERENCE_GATE.acall(tenant, completion_factory(messages), HF_DEADLINE_SECONDS))
+
+    prompt_key = hashlib.sha1(json.dumps(messages).encode()).hexdigest()
+    try:
+        out = await HF_SINGLE_FLIGHT.ado(prompt_key, generate, timeout=HF_DEADLINE_SECONDS)
+    except asyncio.TimeoutError:
+        out = ""
+    if not out:
+        return None
+    remember_reply(bp, oc, contact, inbound, mode, out, profile_fp=fp)
+    return out
+
+
+def hf_reply_stream(bp: BusinessProfile, oc: OwnerCoverSettings, contact: Contact, inbound: str, mode: str) -> Iterator[str]:
+    """Yield reply text deltas as the model produces them.
+
+    A cached reply comes back as one delta. Raises if the model is unavailable
+    or fails; text already yielded is then incomplete and the caller decides
+    what to show instead.
+    """
+    if hf_client is None:
+        raise RuntimeError("HF client not configured")
+    fp = profile_fingerprint(bp)
+    cached = cached_reply(bp, oc, contact, inbound, mode, profile_fp=fp)
+    if cached is not None:
+        yield cached
+        return
+
+    messages = reply_messages(bp, contact, inbound, mode, fp)
+    parts: List[str] = []
+    stream = INFERENCE_GATE.stream(
+        inference_tenant(),
+        lambda: hf_client.chat_completion(messages=messages, max_tokens=320, temperature=0.4, stream=True),
+        HF_DEADLINE_SECONDS,
+    )
+    for chunk in stream:
+        delta = chunk.choices[0].delta.content if chunk.choices else None
+        if delta:
+            parts.append(delta)
+            yield delta
+    out = "".join(parts).strip()
+    if not out:
+        raise RuntimeError("HF returned an empty reply")
+    remember_reply(bp, oc, contact, inbound, mode, out, profile_fp=fp)
 
 
 def fallback_reply(bp: BusinessProfile, oc: OwnerCoverSettings, intent: str) -> str:
@@ -1063,19 +3735,58 @@ def decision_core(
     oc: OwnerCoverSettings,
     contact: Contact,
     thread_id: str,
+    cls: Optional[Dict[str, Any]] = None,
+    reply: Optional[str] = None,
 ) -> Decision:
-    cls = classify_intent(inbound.text)
+    """Route one inbound message. `reply` is a model reply the caller already
+    awaited ("" if the model gave none); None means call the model here."""
+    cls = cls or classify_intents([inbound.text], intent_matcher(uid))[0]
     intent = cls["intent"]
     risk = float(cls["risk"])
-    mentions_money = bool(cls["mentions_money"])
+    confidence, decision, reason = route_decision(cls, oc)
 
-    draft = hf_reply(bp, oc, contact, inbound.text, mode="ownercover") or fallback_reply(bp, oc, intent)
+    # Routing never looks at the draft, so a queued decision can leave it for later.
+    draft_pending = LAZY_DRAFTS and decision == "queue"
+    if draft_pending:
+        draft = ""
+    else:
+        if reply is None:
+            reply = hf_reply(bp, oc, contact, inbound.text, mode="ownercover")
+        draft = reply or fallback_reply(bp, oc, intent)
 
-    confidence = 0.82 if intent in ["hours", "services", "booking", "status", "pricing_basic"] else 0.62
-    if intent in ["complaint"]:
-        confidence = 0.72
-    if intent in ["legal"]:
-        confidence = 0.55
+    d = Decision(
+        id=str(uuid.uuid4()),
+        uid=uid,
+        contact_id=inbound.contact_id,
+        thread_id=thread_id,
+        channel=inbound.channel,
+        intent=intent,
+        risk=risk,
+        confidence=confidence,
+        decision=decision,
+        reason=reason,
+        draft=draft,
+        inbound_text=inbound.text,
+        intent_model=cls.get("model", ""),
+        intent_source=cls.get("intent_source", "keywords"),
+        draft_pending=draft_pending,
+    )
+    return d
+
+
+def route_decision(cls: Dict[str, Any], oc: OwnerCoverSettings) -> tuple:
+    """(confidence, "send"/"queue", reason) for a classified message under the Owner Cover settings."""
+    intent = cls["intent"]
+    mentions_money = bool(cls["mentions_money"])
+
+    if cls.get("confidence") is not None:
+        confidence = float(cls["confidence"])
+    else:
+        confidence = 0.82 if intent in ["hours", "services", "booking", "status", "pricing_basic"] else 0.62
+        if intent in ["complaint"]:
+            confidence = 0.72
+        if intent in ["legal"]:
+            confidence = 0.55
 
     if oc.mode == "off":
         decision = "queue"
@@ -1099,27 +3810,27 @@ def decision_core(
         else:
             decision = "queue"
             reason = "Not in autosend topics"
-
-    d = Decision(
-        id=str(uuid.uuid4()),
-        uid=uid,
-        contact_id=inbound.contact_id,
-        thread_id=thread_id,
-        channel=inbound.channel,
-        intent=intent,
-        risk=risk,
-        confidence=confidence,
-        decision=decision,
-        reason=reason,
-        draft=draft,
-    )
-    return d
+    return confidence, decision, reason
 
 
 # ============================================================
 # APP
 # ============================================================
-app = FastAPI(title="Main St AI Platform", version="1.0.0")
+# Run in order when the server shuts down (buffered stats, background queues).
+SHUTDOWN_HOOKS: List[Callable[[], Any]] = [drain_deliveries, flush_stats, close_inference]
+
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    yield
+    for hook in SHUTDOWN_HOOKS:
+        try:
+            await run_in_threadpool(hook)
+        except Exception as exc:
+            print("Shutdown hook error:", repr(exc))
+
+
+app = FastAPI(title="Main St AI Platform", version="1.0.0", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -1134,14 +3845,47 @@ app.add_middleware(
 def health():
     return {
         "ok": True,
-        "firestore": _firestore is not None,
+        "firestore": not isinstance(_store, LocalStore),
+        "storage": "memory" if dev_mode() else ("sqlite" if isinstance(_store, SqliteStore) else "firestore"),
         "firebase_admin_auth": _firebase_auth is not None,
         "hf_configured": bool(HF_TOKEN),
         "hf_model": HF_MODEL,
+        "intent_model": _INTENT_MODEL.version if _INTENT_MODEL else None,
+        "inference": {
+            **INFERENCE_GATE.metrics(),
+            **HF_SINGLE_FLIGHT.metrics(),
+            "batching": HF_BATCHER.metrics() if HF_BATCHER else None,
+        },
+        "auth_cache": {**AUTH_STATS, "size": len(_TOKEN_CACHE)},
+        "delivery": {
+            **DELIVERY_STATS,
+            **(_DELIVERY_QUEUE.pending() if _DELIVERY_QUEUE else {}),
+            "http": dict(DELIVERY_HTTP.stats),
+        },
+        "inbound_jobs": {
+            **INBOUND_JOB_STATS,
+            "inflight": len(_INBOUND_INFLIGHT),
+            **(_INBOUND_SCHEDULER.pending() if _INBOUND_SCHEDULER else {}),
+        },
         "ts": time.time(),
     }
 
 
+@app.get("/debug/cache")
+def debug_cache(user: AuthedUser = Depends(get_user)):
+    ensure_user(user.uid)
+    require_role(user, ["Owner"])
+    return {
+        "auth": {**AUTH_STATS, "size": len(_TOKEN_CACHE)},
+        "config": config_cache_stats(),
+        "stats_buffer": {**STATS_BUFFER_STATS, "pending_docs": len(_STAT_DELTAS)},
+        "units_of_work": dict(UOW_STATS),
+        "idempotency": {**IDEMPOTENCY_STATS, "size": len(_IDEMPOTENCY_CACHE)},
+        "replies": reply_cache_stats(),
+        "prompts": PROMPTS.metrics(),
+    }
+
+
 # ============================================================
 # CONFIG
 # ============================================================
@@ -1154,6 +3898,7 @@ def get_bp(user: AuthedUser = Depends(get_user)):
 @app.post("/config/businessProfile", response_model=BusinessProfile)
 def set_bp(bp: BusinessProfile, user: AuthedUser = Depends(get_user)):
     ensure_user(user.uid)
+    forget_replies(get_business_profile(user.uid))
     set_cfg(user.uid, "businessProfile", bp)
     audit(user.uid, {"type": "businessProfile_update", "bp": bp.model_dump()})
     return bp
@@ -1196,6 +3941,29 @@ def set_oc(oc: OwnerCoverSettings, user: AuthedUser = Depends(get_user)):
     return oc
 
 
+@app.get("/ownercover/intentKeywords")
+def get_intent_keywords(user: AuthedUser = Depends(get_user)):
+    ensure_user(user.uid)
+    cfg = get_cfg(user.uid, "intentKeywords", IntentKeywords, IntentKeywords())
+    return {**cfg.model_dump(), "effective": effective_intent_keywords(cfg)}
+
+
+@app.post("/ownercover/intentKeywords", response_model=IntentKeywords)
+def set_intent_keywords(cfg: IntentKeywords, user: AuthedUser = Depends(get_user)):
+    ensure_user(user.uid)
+    require_role(user, ["Owner", "Manager"])
+    unknown = (set(cfg.add) | set(cfg.remove)) - set(INTENT_KEYWORDS)
+    if unknown:
+        raise HTTPException(400, f"Unknown intent categories: {', '.join(sorted(unknown))}")
+    cfg = IntentKeywords(
+        add={k: sorted({w.lower() for w in v if w.strip()}) for k, v in cfg.add.items()},
+        remove={k: sorted({w.lower() for w in v if w.strip()}) for k, v in cfg.remove.items()},
+    )
+    set_cfg(user.uid, "intentKeywords", cfg)
+    audit(user.uid, {"type": "intentKeywords_update", "intent_keywords": cfg.model_dump()})
+    return cfg
+
+
 @app.get("/billing", response_model=BillingSettings)
 def get_billing(user: AuthedUser = Depends(get_user)):
     ensure_user(user.uid)
@@ -1407,14 +4175,25 @@ def upsert_alert(base: List[Dict[str, Any]], alert: Dict[str, Any]) -> List[Dict
     return [alert, *base]
 
 
+def upsert_alerts(base: List[Dict[str, Any]], alerts: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Same result as applying upsert_alert for each alert in turn, in one pass over base."""
+    updates: Dict[Any, Dict[str, Any]] = {}
+    for alert in alerts:
+        key = alert.get("id")
+        updates[key] = {**updates.get(key, {}), **alert}
+    existing = {row.get("id") for row in base}
+    merged = [{**row, **updates[row.get("id")]} if row.get("id") in updates else row for row in base]
+    fresh = [updates[key] for key in reversed(updates) if key not in existing]
+    return [*fresh, *merged]
+
+
 @app.get("/notifications")
 def get_notifications(user: AuthedUser = Depends(get_user)):
     ensure_user(user.uid)
     base = get_list_cfg(user.uid, "notifications", [n.model_dump() for n in default_alerts()])
     now = time.time()
 
-    action_items = list_action_queue_items(user.uid)
-    pending = [a for a in action_items if a.get("status") == "needs_approval"]
+    pending = list_action_queue_items(user.uid, status="needs_approval")
     if pending:
         oldest = min(a.get("created_ts", now) for a in pending)
         age_min = int((now - oldest) // 60)
@@ -1452,7 +4231,7 @@ def get_notifications(user: AuthedUser = Depends(get_user)):
         )
 
     set_list_cfg(user.uid, "notifications", base)
-    return base
+    return with_delivery(user.uid, base)
 
 
 @app.get("/notifications/routing", response_model=NotificationRouting)
@@ -1489,7 +4268,7 @@ def update_notifications(payload: NotificationUpdate, user: AuthedUser = Depends
             updated.append(row)
     set_list_cfg(user.uid, "notifications", updated)
     audit(user.uid, {"type": "notification_update", "id": payload.id, "status": payload.status})
-    return updated
+    return with_delivery(user.uid, updated)
 
 
 # ============================================================
@@ -1498,9 +4277,6 @@ def update_notifications(payload: NotificationUpdate, user: AuthedUser = Depends
 @app.get("/contacts")
 def list_contacts(user: AuthedUser = Depends(get_user)):
     ensure_user(user.uid)
-    if _firestore is None:
-        u = get_ws_scope(user.uid)
-        return list_dev_docs(u, "contacts/")
     docs = fs_col_uid(user.uid, "contacts").stream()
     return [d.to_dict() for d in docs]
 
@@ -1520,12 +4296,6 @@ def create_contact(payload: Contact, user: AuthedUser = Depends(get_user)):
 @app.get("/threads")
 def list_threads(contact_id: Optional[str] = Query(default=None), user: AuthedUser = Depends(get_user)):
     ensure_user(user.uid)
-    if _firestore is None:
-        u = get_ws_scope(user.uid)
-        threads = list_dev_docs(u, "threads/")
-        if contact_id:
-            threads = [t for t in threads if t.get("contact_id") == contact_id]
-        return threads
     col = fs_col_uid(user.uid, "threads")
     if contact_id:
         docs = col.where("contact_id", "==", contact_id).stream()
@@ -1537,9 +4307,6 @@ def list_threads(contact_id: Optional[str] = Query(default=None), user: AuthedUs
 @app.get("/threads/{thread_id}/messages")
 def list_messages(thread_id: str, user: AuthedUser = Depends(get_user)):
     ensure_user(user.uid)
-    if _firestore is None:
-        u = get_ws_scope(user.uid)
-        return u.get(f"threads/{thread_id}/messages", [])
     docs = fs_col_uid(user.uid, f"threads/{thread_id}/messages").order_by("ts").stream()
     return [d.to_dict() for d in docs]
 
@@ -1547,33 +4314,102 @@ def list_messages(thread_id: str, user: AuthedUser = Depends(get_user)):
 # ============================================================
 # CHAT (owner chat)
 # ============================================================
-@app.post("/chat", response_model=ChatResponse)
-def chat(req: ChatRequest, user: AuthedUser = Depends(get_user)):
-    ensure_user(user.uid)
-    bp = get_business_profile(user.uid)
-    oc = get_owner_cover(user.uid)
-
+def load_chat_turn(uid: str, req: ChatRequest) -> tuple:
+    """(bp, oc, contact) a chat reply is generated from."""
     contact_id = req.contact_id or "owner"
-    contact = get_contact(user.uid, contact_id) or Contact(id=contact_id, name="Owner")
-    upsert_contact(user.uid, contact)
+    contact = get_contact(uid, contact_id) or Contact(id=contact_id, name="Owner")
+    return get_business_profile(uid), get_owner_cover(uid), contact
+
+
+def open_chat_turn(uid: str, req: ChatRequest, loaded: Optional[tuple] = None) -> tuple:
+    """Record the owner's message; returns (bp, oc, contact, thread_id) for the reply."""
+    bp, oc, contact = loaded or load_chat_turn(uid, req)
+    contact_id = contact.id
+    upsert_contact(uid, contact)
 
     thread_id = req.thread_id or f"thread-{contact_id}-webchat"
     thread = Thread(id=thread_id, contact_id=contact_id, channel="webchat")
-    upsert_thread(user.uid, thread)
+    upsert_thread(uid, thread)
 
     msg_in = Message(id=str(uuid.uuid4()), role="user", text=req.message)
-    save_message(user.uid, thread_id, msg_in)
+    save_message(uid, thread_id, msg_in)
+    return bp, oc, contact, thread_id
+
 
-    draft = hf_reply(bp, oc, contact, req.message, mode="chat") or fallback_reply(bp, oc, "default")
+def close_chat_turn(uid: str, thread_id: str, inbound: str, draft: str) -> Message:
     msg_out = Message(id=str(uuid.uuid4()), role="assistant", text=draft)
-    save_message(user.uid, thread_id, msg_out)
+    save_message(uid, thread_id, msg_out)
+
+    inc_stat(uid, "chat_messages", 1)
+    audit(uid, {"type": "chat", "thread_id": thread_id, "in": inbound, "out": draft})
+    return msg_out
 
-    inc_stat(user.uid, "chat_messages", 1)
-    audit(user.uid, {"type": "chat", "thread_id": thread_id, "in": req.message, "out": draft})
 
+@app.post("/chat", response_model=ChatResponse)
+async def chat(req: ChatRequest, user: AuthedUser = Depends(get_user)):
+    # Async so no request thread waits on the model; both messages are
+    # written together once the reply is in.
+    uid = user.uid
+    await run_in_threadpool(ensure_user, uid)
+    bp, oc, contact = loaded = await run_in_threadpool(load_chat_turn, uid, req)
+    draft = await hf_reply_async(bp, oc, contact, req.message, mode="chat") or fallback_reply(bp, oc, "default")
+    return await run_in_threadpool(save_chat_turn, uid, req, loaded, draft)
+
+
+def save_chat_turn(uid: str, req: ChatRequest, loaded: tuple, draft: str) -> ChatResponse:
+    with unit_of_work(uid):
+        _, _, _, thread_id = open_chat_turn(uid, req, loaded)
+        close_chat_turn(uid, thread_id, req.message, draft)
     return ChatResponse(reply=draft, thread_id=thread_id)
 
 
+# ------------------------------------------------------------
+# Streaming chat. Same turn as /chat, delivered as server-sent events:
+#   event: delta     {"text": "..."}            one per model token chunk
+#   event: fallback  {"text": "..."}            model failed; show this instead
+#   event: done      {"reply", "thread_id", "message_id", "fallback"}
+# The owner's message is committed before the first byte; the assistant
+# message is committed once the reply is complete (not if the client
+# disconnects mid-stream). `done.reply` is the persisted text.
+# ------------------------------------------------------------
+def sse_event(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def stream_chat_reply(ctx: RequestContext, req: ChatRequest, bp: BusinessProfile, oc: OwnerCoverSettings, contact: Contact, thread_id: str):
+    uid = ctx.uid
+    parts: List[str] = []
+    fallback = False
+    try:
+        for delta in hf_reply_stream(bp, oc, contact, req.message, mode="chat"):
+            parts.append(delta)
+            yield sse_event("delta", {"text": delta})
+        draft = "".join(parts).strip()
+    except Exception as exc:
+        if hf_client is not None:
+            print("HF stream error:", repr(exc))
+        fallback = True
+        draft = fallback_reply(bp, oc, "default")
+        yield sse_event("fallback", {"text": draft})
+
+    with use_context(ctx), unit_of_work(uid):
+        msg_out = close_chat_turn(uid, thread_id, req.message, draft)
+    yield sse_event("done", {"reply": draft, "thread_id": thread_id, "message_id": msg_out.id, "fallback": fallback})
+
+
+@app.post("/chat/stream")
+def chat_stream(req: ChatRequest, user: AuthedUser = Depends(get_user)):
+    ensure_user(user.uid)
+    with unit_of_work(user.uid):
+        bp, oc, contact, thread_id = open_chat_turn(user.uid, req)
+    ctx = current_context(user.uid)
+    return StreamingResponse(
+        stream_chat_reply(ctx, req, bp, oc, contact, thread_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @app.get("/chat/history")
 def chat_history(conversationId: str = Query(default=""), user: AuthedUser = Depends(get_user)):
     thread_id = conversationId or "thread-owner-webchat"
@@ -1596,36 +4432,248 @@ def chat_manual(payload: Dict[str, Any], user: AuthedUser = Depends(get_user)):
 # ============================================================
 # OWNER COVER INBOUND (customers/leads)
 # ============================================================
+def prefetch_inbound(uid: str, contact_id: str, idempotency_key: Optional[str] = None):
+    """Everything the inbound path reads, including add_notification's routing + list."""
+    paths = [
+        scoped_path(uid, "config/businessProfile"),
+        scoped_path(uid, "config/ownerCover"),
+        scoped_path(uid, "config/notificationRouting"),
+        scoped_path(uid, "config/notifications"),
+        scoped_path(uid, "config/intentKeywords"),
+        scoped_path(uid, f"contacts/{contact_id}"),
+    ]
+    if idempotency_key:
+        paths.append(idempotency_path(uid, idempotency_key))
+    prefetch_docs(uid, paths)
+
+
+# ------------------------------------------------------------
+# Idempotency keys. The first result for a key is stored at
+# inboundKeys/{sha256(key)} in the same unit of work as the decision it
+# describes; redeliveries inside IDEMPOTENCY_TTL_SECONDS get that result back
+# without running decision_core. The lookup rides along in the inbound
+# prefetch, and recent keys are also held in a bounded per-process LRU.
+# /cron/run purges expired keys.
+# ------------------------------------------------------------
+_IDEMPOTENCY_CACHE: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+_IDEMPOTENCY_LOCK = threading.Lock()
+IDEMPOTENCY_STATS: Dict[str, int] = {"hits": 0, "misses": 0, "stored": 0, "purged": 0}
+
+
+def _idempotency_id(key: str) -> str:
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def idempotency_path(uid: str, key: str) -> str:
+    return scoped_path(uid, f"inboundKeys/{_idempotency_id(key)}")
+
+
+def _idempotency_live(record: Optional[Dict[str, Any]], now: float) -> bool:
+    return bool(record) and record.get("created_ts", 0) + IDEMPOTENCY_TTL_SECONDS > now
+
+
+def _cache_idempotency(path: str, record: Dict[str, Any]):
+    if IDEMPOTENCY_CACHE_SIZE <= 0:
+        return
+    with _IDEMPOTENCY_LOCK:
+        _IDEMPOTENCY_CACHE[path] = record
+        _IDEMPOTENCY_CACHE.move_to_end(path)
+        while len(_IDEMPOTENCY_CACHE) > IDEMPOTENCY_CACHE_SIZE:
+            _IDEMPOTENCY_CACHE.popitem(last=False)
+
+
+def lookup_idempotency_keys(uid: str, keys: List[str]) -> Dict[str, Dict[str, Any]]:
+    """Stored records for the keys seen within the TTL: {key: {status_code, result, ...}}."""
+    now = time.time()
+    out: Dict[str, Dict[str, Any]] = {}
+    pending: Dict[str, str] = {}
+    for key in dict.fromkeys(keys):
+        path = idempotency_path(uid, key)
+        with _IDEMPOTENCY_LOCK:
+            record = _IDEMPOTENCY_CACHE.get(path)
+        if record is None:
+            found, record = take_prefetched(path)
+            if not found:
+                pending[key] = path
+                continue
+        if _idempotency_live(record, now):
+            out[key] = record
+    if pending:
+        docs = get_docs(list(pending.values()))
+        for key, path in pending.items():
+            if _idempotency_live(docs.get(path), now):
+                out[key] = docs[path]
+    for key in out:
+        _cache_idempotency(idempotency_path(uid, key), out[key])
+    IDEMPOTENCY_STATS["hits"] += len(out)
+    IDEMPOTENCY_STATS["misses"] += len(set(keys)) - len(out)
+    return out
+
+
+def remember_idempotency_key(uid: str, key: str, result: Dict[str, Any], status_code: int = 200):
+    doc_id = _idempotency_id(key)
+    path = scoped_path(uid, f"inboundKeys/{doc_id}")
+    record = {"id": doc_id, "key": key, "status_code": status_code, "result": result, "created_ts": time.time()}
+    write_doc(uid, f"inboundKeys/{doc_id}", record)
+    IDEMPOTENCY_STATS["stored"] += 1
+
+    def cache():
+        _cache_idempotency(path, record)
+
+    after_commit(uid, cache)
+
+
+def purge_idempotency_keys(uid: str, limit: int = FIRESTORE_BATCH_LIMIT) -> int:
+    cutoff = time.time() - IDEMPOTENCY_TTL_SECONDS
+    docs = list(fs_col_uid(uid, "inboundKeys").where(filter=fs_filter("created_ts", "<", cutoff)).limit(limit).stream())
+    if docs:
+        batch = _store.batch()
+        for d in docs:
+            batch.delete(d.reference)
+        batch.commit()
+    purged = len(docs)
+    IDEMPOTENCY_STATS["purged"] += purged
+    return purged
+
+
+def inbound_idempotency_key(inbound: InboundMessage, header_key: Optional[str]) -> InboundMessage:
+    key = (header_key or inbound.idempotency_key or "").strip()
+    return inbound.model_copy(update={"idempotency_key": key or None})
+
+
 @app.post("/ownercover/handleInbound")
-def ownercover_handle_inbound(inbound: InboundMessage, user: AuthedUser = Depends(get_user)):
+async def ownercover_handle_inbound(
+    inbound: InboundMessage,
+    async_mode: bool = Query(default=INBOUND_ASYNC, alias="async"),
+    idempotency_key: Optional[str] = Header(default=None),
+    user: AuthedUser = Depends(get_user),
+):
+    # Async so the model call is awaited between two short threadpool steps
+    # instead of parking a request thread for up to HF_DEADLINE_SECONDS.
+    uid = user.uid
+    await run_in_threadpool(ensure_user, uid)
+    inbound = inbound_idempotency_key(inbound, idempotency_key)
+    cls, reply = None, None
+    if not async_mode:
+        plan = await run_in_threadpool(plan_inbound_reply, uid, inbound)
+        if plan is not None:
+            bp, oc, contact, cls = plan
+            reply = await hf_reply_async(bp, oc, contact, inbound.text, mode="ownercover") or ""
+    return await run_in_threadpool(run_for_contact, uid, inbound.contact_id, accept_inbound, uid, inbound, async_mode, cls, reply)
+
+
+def plan_inbound_reply(uid: str, inbound: InboundMessage) -> Optional[tuple]:
+    """(bp, oc, contact, cls) when the sync path will want a model reply for `inbound`, else None.
+
+    Runs before the contact's lane, so the reply can be awaited off-thread. The
+    lane re-reads the contact and re-routes; the reply is only used if it still
+    needs one.
+    """
+    if hf_client is None and HF_BATCHER is None:
+        return None
+    key = inbound.idempotency_key
+    if key:
+        prefetch_docs(uid, [scoped_path(uid, f"contacts/{inbound.contact_id}"), idempotency_path(uid, key)])
+        if lookup_idempotency_keys(uid, [key]).get(key):
+            return None
+    oc = get_owner_cover(uid)
+    cls = classify_intents([inbound.text], intent_matcher(uid))[0]
+    _, decision, _ = route_decision(cls, oc)
+    if LAZY_DRAFTS and decision == "queue":
+        return None
+    contact = get_contact(uid, inbound.contact_id) or Contact(id=inbound.contact_id)
+    return get_business_profile(uid), oc, contact, cls
+
+
+def accept_inbound(
+    uid: str,
+    inbound: InboundMessage,
+    async_mode: bool,
+    cls: Optional[Dict[str, Any]] = None,
+    reply: Optional[str] = None,
+):
+    with unit_of_work(uid):
+        if not async_mode:
+            return handle_inbound(uid, inbound, cls=cls, reply=reply)
+        status_code, content = enqueue_inbound(uid, inbound)
+    return JSONResponse(status_code=status_code, content=content)
+
+
+@app.get("/ownercover/inbound/{job_id}")
+def ownercover_inbound_status(job_id: str, user: AuthedUser = Depends(get_user)):
     ensure_user(user.uid)
-    bp = get_business_profile(user.uid)
-    oc = get_owner_cover(user.uid)
+    job = get_inbound_job(user.uid, job_id)
+    if not job:
+        raise HTTPException(404, "Job not found")
+    return job.model_dump()
 
-    contact = get_contact(user.uid, inbound.contact_id)
+
+def handle_inbound(
+    uid: str,
+    inbound: InboundMessage,
+    cls: Optional[Dict[str, Any]] = None,
+    reply: Optional[str] = None,
+) -> Dict[str, Any]:
+    key = inbound.idempotency_key
+    prefetch_inbound(uid, inbound.contact_id, key)
+    if key:
+        prior = lookup_idempotency_keys(uid, [key]).get(key)
+        if prior:
+            return {**prior["result"], "duplicate": True}
+    contact, thread_id = record_inbound(uid, inbound)
+    result = decide_inbound(uid, inbound, contact, thread_id, cls=cls, reply=reply)
+    if key:
+        remember_idempotency_key(uid, key, result)
+    return result
+
+
+def record_inbound(uid: str, inbound: InboundMessage, contact: Optional[Contact] = None) -> tuple:
+    """Persist the contact touch, thread and inbound message; returns (contact, thread_id)."""
+    if contact is None:
+        contact = get_contact(uid, inbound.contact_id)
     if not contact:
         contact = Contact(id=inbound.contact_id, last_touch_ts=inbound.ts, last_inbound_ts=inbound.ts)
     contact.last_touch_ts = inbound.ts
     contact.last_inbound_ts = inbound.ts
-    upsert_contact(user.uid, contact)
+    upsert_contact(uid, contact)
 
     thread_id = f"thread-{inbound.contact_id}-{inbound.channel}"
     thread = Thread(id=thread_id, contact_id=inbound.contact_id, channel=inbound.channel, last_message_ts=inbound.ts)
-    upsert_thread(user.uid, thread)
+    upsert_thread(uid, thread)
 
     msg_in = Message(id=str(uuid.uuid4()), role="user", text=inbound.text, ts=inbound.ts)
-    save_message(user.uid, thread_id, msg_in)
+    save_message(uid, thread_id, msg_in)
+    return contact, thread_id
+
+
+def decide_inbound(
+    uid: str,
+    inbound: InboundMessage,
+    contact: Contact,
+    thread_id: str,
+    bp: Optional[BusinessProfile] = None,
+    oc: Optional[OwnerCoverSettings] = None,
+    cls: Optional[Dict[str, Any]] = None,
+    reply: Optional[str] = None,
+) -> Dict[str, Any]:
+    """Run decision_core on a recorded inbound message and write its follow-ups.
+
+    Batch callers pass the configs and classification they already loaded;
+    the async endpoint passes the model reply it already awaited.
+    """
+    bp = bp or get_business_profile(uid)
+    oc = oc or get_owner_cover(uid)
 
-    d = decision_core(user.uid, inbound, bp, oc, contact, thread_id)
+    d = decision_core(uid, inbound, bp, oc, contact, thread_id, cls=cls, reply=reply)
 
-    write_doc(user.uid, f"decisions/{d.id}", d.model_dump())
-    inc_stat(user.uid, "decisions_made", 1)
+    write_doc(uid, f"decisions/{d.id}", d.model_dump())
+    inc_stat(uid, "decisions_made", 1)
 
     if d.decision == "send":
         msg_out = Message(id=str(uuid.uuid4()), role="assistant", text=d.draft)
-        save_message(user.uid, thread_id, msg_out)
+        save_message(uid, thread_id, msg_out)
         contact.last_outbound_ts = time.time()
-        upsert_contact(user.uid, contact)
+        upsert_contact(uid, contact)
 
         action = ActionQueueItem(
             id=str(uuid.uuid4()),
@@ -1639,11 +4687,11 @@ def ownercover_handle_inbound(inbound: InboundMessage, user: AuthedUser = Depend
             confidence=d.confidence,
             sent_ts=time.time(),
         )
-        write_doc(user.uid, f"actionQueue/{action.id}", action.model_dump())
-        inc_stat(user.uid, "autosent", 1)
-        inc_stat(user.uid, "minutes_saved", oc.minutesPerAction or SAVED_MINUTES_PER_ACTION)
+        write_doc(uid, f"actionQueue/{action.id}", action.model_dump())
+        inc_stat(uid, "autosent", 1)
+        inc_stat(uid, "minutes_saved", oc.minutesPerAction or SAVED_MINUTES_PER_ACTION)
 
-        audit(user.uid, {"type": "ownercover_sent", "decision": d.model_dump(), "action": action.model_dump()})
+        audit(uid, {"type": "ownercover_sent", "decision": d.model_dump(), "action": action.model_dump()})
         return {"status": "sent", "thread_id": thread_id, "decision_id": d.id, "action_id": action.id}
 
     action = ActionQueueItem(
@@ -1656,14 +4704,17 @@ def ownercover_handle_inbound(inbound: InboundMessage, user: AuthedUser = Depend
         draft=d.draft,
         reason=d.reason,
         confidence=d.confidence,
+        draft_pending=d.draft_pending,
+        intent=d.intent,
+        inbound_text=d.inbound_text,
     )
-    write_doc(user.uid, f"actionQueue/{action.id}", action.model_dump())
-    inc_stat(user.uid, "queued", 1)
-    audit(user.uid, {"type": "ownercover_queued", "decision": d.model_dump(), "action": action.model_dump()})
+    write_doc(uid, f"actionQueue/{action.id}", action.model_dump())
+    inc_stat(uid, "queued", 1)
+    audit(uid, {"type": "ownercover_queued", "decision": d.model_dump(), "action": action.model_dump()})
 
     if d.intent in oc.escalation_topics or d.intent in ["legal", "complaint"]:
         add_notification(
-            user.uid,
+            uid,
             {
                 "id": f"alert-escalation-{d.id}",
                 "title": "Escalation queued",
@@ -1679,7 +4730,7 @@ def ownercover_handle_inbound(inbound: InboundMessage, user: AuthedUser = Depend
         )
     elif "Low confidence" in d.reason:
         add_notification(
-            user.uid,
+            uid,
             {
                 "id": f"alert-confidence-{d.id}",
                 "title": "Low confidence queued",
@@ -1697,42 +4748,469 @@ def ownercover_handle_inbound(inbound: InboundMessage, user: AuthedUser = Depend
     return {"status": "queued", "thread_id": thread_id, "decision_id": d.id, "action_id": action.id, "reason": d.reason}
 
 
+# ------------------------------------------------------------
+# Per-contact scheduling. Everything that read-modify-writes a contact on the
+# inbound path (sync requests, async enqueue, async jobs and batches) runs in
+# one KeyedExecutor lane keyed by the contact's doc path: one contact's work
+# runs strictly in submission order, different contacts run in parallel.
+# Request threads claim an idle lane and run inline rather than park while a
+# pool thread does the work; they only wait when the contact is already busy.
+# INBOUND_WORKERS bounds the background work (async jobs, batch groups and
+# requests queued behind a busy contact); inline requests are bounded by the
+# server's own thread pool.
+# ------------------------------------------------------------
+class KeyedExecutor:
+    """Thread pool that runs tasks sharing a key one at a time, in submission order."""
+
+    # A busy key gives its thread back after this many tasks so others get a turn.
+    DRAIN_BURST = 32
+
+    def __init__(self, max_workers: int, thread_name_prefix: str = "keyed"):
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=thread_name_prefix)
+        self._queues: Dict[str, deque] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, key: str, fn: Callable[..., Any], *args: Any) -> Future:
+        fut: Future = Future()
+        with self._lock:
+            queue = self._queues.get(key)
+            if queue is not None:
+                queue.append((fut, fn, args))
+                return fut
+            self._queues[key] = deque([(fut, fn, args)])
+        try:
+            self._pool.submit(self._drain, key)
+        except RuntimeError:
+            with self._lock:
+                self._queues.pop(key, None)
+            raise
+        return fut
+
+    def run(self, key: str, fn: Callable[..., Any], *args: Any) -> Any:
+        """fn(*args) in the key's lane, returning its result; on this thread when the lane is idle."""
+        with self._lock:
+            queue = self._queues.get(key)
+            if queue is None:
+                self._queues[key] = deque()
+        if queue is not None:
+            return self.submit(key, fn, *args).result()
+        try:
+            return fn(*args)
+        finally:
+            self._release(key)
+
+    def _release(self, key: str):
+        """Hand an inline-held lane back: drop it, or drain what queued behind it."""
+        with self._lock:
+            if not self._queues[key]:
+                del self._queues[key]
+                return
+        try:
+            self._pool.submit(self._drain, key)
+        except RuntimeError:
+            self._drain(key)
+
+    def _drain(self, key: str):
+        for _ in range(self.DRAIN_BURST):
+            with self._lock:
+                queue = self._queues[key]
+                if not queue:
+                    del self._queues[key]
+                    return
+                fut, fn, args = queue.popleft()
+            if not fut.set_running_or_notify_cancel():
+                continue
+            try:
+                fut.set_result(fn(*args))
+            except BaseException as exc:
+                fut.set_exception(exc)
+        try:
+            self._pool.submit(self._drain, key)
+        except RuntimeError:
+            # Shutting down: finish this key here rather than strand its queue.
+            self._drain(key)
+
+    def pending(self) -> Dict[str, int]:
+        with self._lock:
+            return {"keys": len(self._queues), "queued": sum(len(q) for q in self._queues.values())}
+
+    def shutdown(self, wait: bool = True):
+        self._pool.shutdown(wait=wait)
+
+
+_INBOUND_SCHEDULER: Optional[KeyedExecutor] = None
+_INBOUND_LOCK = threading.Lock()
+
+
+def inbound_scheduler() -> KeyedExecutor:
+    global _INBOUND_SCHEDULER
+    if _INBOUND_SCHEDULER is None:
+        with _INBOUND_LOCK:
+            if _INBOUND_SCHEDULER is None:
+                _INBOUND_SCHEDULER = KeyedExecutor(max_workers=INBOUND_WORKERS, thread_name_prefix="inbound")
+    return _INBOUND_SCHEDULER
+
+
+def contact_key(uid: str, ws_id: str, contact_id: str) -> str:
+    return scoped_path_for(uid, ws_id, f"contacts/{contact_id}")
+
+
+def run_for_contact(uid: str, contact_id: str, fn: Callable[..., Any], *args: Any) -> Any:
+    """Run fn(*args) in the contact's lane and wait for it, keeping the caller's context."""
+    key = contact_key(uid, get_workspace_id(uid), contact_id)
+    return inbound_scheduler().run(key, contextvars.copy_context().run, fn, *args)
+
+
+def drain_inbound_jobs():
+    global _INBOUND_SCHEDULER
+    with _INBOUND_LOCK:
+        scheduler, _INBOUND_SCHEDULER = _INBOUND_SCHEDULER, None
+    if scheduler is not None:
+        scheduler.shutdown(wait=True)
+
+
+# ------------------------------------------------------------
+# Async inbound (?async=true or INBOUND_ASYNC=true). The request records the
+# message plus an inboundJobs/{id} doc and returns 202; decision_core and its
+# follow-up writes (including notification delivery) run in the contact's
+# lane on the inbound scheduler once that commit lands. Clients poll
+# GET /ownercover/inbound/{id}. Jobs left queued/processing by a dead worker
+# are resubmitted by /cron/run.
+# ------------------------------------------------------------
+_INBOUND_INFLIGHT: set = set()
+INBOUND_JOB_STATS: Dict[str, int] = {"submitted": 0, "done": 0, "errors": 0, "requeued": 0}
+
+
+# Drain before flush_stats so the jobs' counters make it into the final flush.
+SHUTDOWN_HOOKS.insert(0, drain_inbound_jobs)
+
+
+def enqueue_inbound(uid: str, inbound: InboundMessage) -> tuple:
+    """Record the message and queue its job; returns (status_code, response body)."""
+    key = inbound.idempotency_key
+    if key:
+        prefetch_docs(uid, [scoped_path(uid, f"contacts/{inbound.contact_id}"), idempotency_path(uid, key)])
+        prior = lookup_idempotency_keys(uid, [key]).get(key)
+        if prior:
+            return prior.get("status_code", 200), {**prior["result"], "duplicate": True}
+    _, thread_id = record_inbound(uid, inbound)
+    job = InboundJob(
+        id=str(uuid.uuid4()),
+        workspace_id=get_workspace_id(uid),
+        contact_id=inbound.contact_id,
+        thread_id=thread_id,
+        inbound=inbound,
+    )
+    write_doc(uid, f"inboundJobs/{job.id}", job.model_dump())
+    after_commit(uid, lambda: submit_inbound_job(uid, job))
+    content = {"status": "accepted", "job_id": job.id, "thread_id": job.thread_id}
+    if key:
+        remember_idempotency_key(uid, key, content, status_code=202)
+    return 202, content
+
+
+def submit_inbound_job(uid: str, job: InboundJob) -> bool:
+    with _INBOUND_LOCK:
+        if job.id in _INBOUND_INFLIGHT:
+            return False
+        _INBOUND_INFLIGHT.add(job.id)
+    try:
+        inbound_scheduler().submit(contact_key(uid, job.workspace_id, job.contact_id), run_inbound_job, uid, job)
+    except RuntimeError as exc:
+        # Pool already shut down; the job doc stays queued for cron to pick up.
+        print("Inbound submit error:", repr(exc))
+        with _INBOUND_LOCK:
+            _INBOUND_INFLIGHT.discard(job.id)
+        return False
+    INBOUND_JOB_STATS["submitted"] += 1
+    return True
+
+
+def _save_inbound_job(uid: str, job: InboundJob, status: str):
+    job.status = status
+    job.updated_ts = time.time()
+    write_doc(uid, f"inboundJobs/{job.id}", job.model_dump())
+
+
+def run_inbound_job(uid: str, job: InboundJob):
+    try:
+        with use_context(workspace_context(uid, job.workspace_id)):
+            _run_inbound_job(uid, job)
+    finally:
+        with _INBOUND_LOCK:
+            _INBOUND_INFLIGHT.discard(job.id)
+
+
+def _run_inbound_job(uid: str, job: InboundJob):
+    job.attempts += 1
+    _save_inbound_job(uid, job, "processing")
+    try:
+        with unit_of_work(uid):
+            prefetch_inbound(uid, job.contact_id)
+            contact = get_contact(uid, job.contact_id) or Contact(
+                id=job.contact_id, last_touch_ts=job.inbound.ts, last_inbound_ts=job.inbound.ts
+            )
+            job.result = decide_inbound(uid, job.inbound, contact, job.thread_id)
+            job.error = None
+            _save_inbound_job(uid, job, "done")
+        INBOUND_JOB_STATS["done"] += 1
+    except Exception as exc:
+        print("Inbound job error:", repr(exc))
+        INBOUND_JOB_STATS["errors"] += 1
+        job.error = repr(exc)
+        _save_inbound_job(uid, job, "error")
+
+
+def get_inbound_job(uid: str, job_id: str) -> Optional[InboundJob]:
+    snap = fs_doc_uid(uid, f"inboundJobs/{job_id}").get()
+    return InboundJob(**snap.to_dict()) if snap.exists else None
+
+
+def requeue_stale_inbound_jobs(uid: str, limit: int = 50) -> int:
+    cutoff = time.time() - INBOUND_JOB_STALE_SECONDS
+    stale: List[InboundJob] = []
+    for status in ("queued", "processing"):
+        rows = [d.to_dict() for d in fs_col_uid(uid, "inboundJobs").where(filter=fs_filter("status", "==", status)).stream()]
+        stale += [InboundJob(**r) for r in rows if r.get("updated_ts", 0) < cutoff]
+    requeued = sum(1 for job in stale[:limit] if submit_inbound_job(uid, job))
+    INBOUND_JOB_STATS["requeued"] += requeued
+    return requeued
+
+
+# ------------------------------------------------------------
+# Batch inbound (backfills, channel export replays). One auth, one config
+# load and one idempotency lookup per request. Messages are grouped by
+# contact (submission order kept within a contact), classified once per
+# distinct text and processed INBOUND_BATCH_CHUNK at a time. Each contact's
+# share of a chunk runs in that contact's lane on the inbound scheduler, so
+# it never interleaves with /ownercover/handleInbound calls or async jobs for
+# the same contact. It re-reads the contact there and commits in one unit of
+# work, with each item in its own savepoint. An item stages at most
+# INBOUND_WRITES_PER_ITEM writes, and chunks are capped so a contact's share
+# always fits in one atomic batch. A chunk's results stream back as NDJSON
+# once all of its contacts have committed. A key repeated under a different
+# contact replays the first item's result.
+# ------------------------------------------------------------
+@app.post("/ownercover/handleInboundBatch")
+def ownercover_handle_inbound_batch(req: InboundBatchRequest, user: AuthedUser = Depends(get_user)):
+    ensure_user(user.uid)
+    if len(req.items) > INBOUND_BATCH_MAX:
+        raise HTTPException(413, f"At most {INBOUND_BATCH_MAX} items per batch")
+    ctx = current_context(user.uid)
+    return StreamingResponse(stream_inbound_batch(ctx, req.items), media_type="application/x-ndjson")
+
+
+INBOUND_WRITES_PER_ITEM = 10
+
+
+def stream_inbound_batch(ctx: RequestContext, items: List[InboundMessage]):
+    # The body is iterated after the endpoint returns, so install the request
+    # context around each read explicitly; lanes get their own fork of it.
+    uid = ctx.uid
+    by_contact: Dict[str, List[int]] = {}
+    for i, item in enumerate(items):
+        by_contact.setdefault(item.contact_id, []).append(i)
+    order = [i for idxs in by_contact.values() for i in idxs]
+
+    with use_context(ctx):
+        ws_id = ctx.workspace_id
+        bp = get_business_profile(uid)
+        oc = get_owner_cover(uid)
+        keys = [item.idempotency_key for item in items if item.idempotency_key]
+        seen = {key: record["result"] for key, record in lookup_idempotency_keys(uid, keys).items()}
+        matcher = intent_matcher(uid)
+    texts = list({item.text: None for item in items})
+    classes = dict(zip(texts, classify_intents(texts, matcher)))
+
+    # A key first seen under one contact and repeated under another is answered
+    # from the first item once its chunk lands, not run in the second lane.
+    owners: Dict[str, int] = {}
+    replays: Dict[int, int] = {}
+    for i in order:
+        key = items[i].idempotency_key
+        if not key or key in seen:
+            continue
+        first = owners.setdefault(key, i)
+        if items[first].contact_id != items[i].contact_id:
+            replays[i] = first
+
+    results: Dict[int, Dict[str, Any]] = {}
+    size = max(1, min(INBOUND_BATCH_CHUNK, FIRESTORE_BATCH_LIMIT // INBOUND_WRITES_PER_ITEM))
+    for start in range(0, len(order), size):
+        chunk = order[start:start + size]
+        groups: Dict[str, List[int]] = {}
+        for i in chunk:
+            if i not in replays:
+                groups.setdefault(items[i].contact_id, []).append(i)
+        futures = {}
+        for contact_id, group in groups.items():
+            try:
+                futures[contact_id] = inbound_scheduler().submit(
+                    contact_key(uid, ws_id, contact_id),
+                    _run_inbound_group, ctx.fork(), items, group, bp, oc, classes, seen,
+                )
+            except RuntimeError as exc:
+                print("Inbound batch submit error:", repr(exc))
+                results.update({i: {"status": "error", "error": repr(exc)} for i in group})
+        for contact_id, fut in futures.items():
+            try:
+                results.update(fut.result())
+            except Exception as exc:
+                print("Inbound batch lane error:", repr(exc))
+                results.update({i: {"status": "error", "error": repr(exc)} for i in groups[contact_id]})
+        for i in chunk:
+            if i in replays:
+                first = results[replays[i]]
+                results[i] = first if first.get("status") == "error" else {**first, "duplicate": True}
+        yield "".join(json.dumps({"index": i, "contact_id": items[i].contact_id, **results[i]}) + "\n" for i in chunk)
+
+
+def _run_inbound_group(
+    ctx: RequestContext,
+    items: List[InboundMessage],
+    group: List[int],
+    bp: BusinessProfile,
+    oc: OwnerCoverSettings,
+    classes: Dict[str, Dict[str, Any]],
+    seen: Dict[str, Dict[str, Any]],
+) -> Dict[int, Dict[str, Any]]:
+    """One contact's items of a chunk, in its lane: fresh contact read, one commit."""
+    uid = ctx.uid
+    results: Dict[int, Dict[str, Any]] = {}
+    fresh: Dict[str, Dict[str, Any]] = {}
+    try:
+        with use_context(ctx), unit_of_work(uid):
+            contact = get_contact(uid, items[group[0]].contact_id)
+            for i in group:
+                inbound = items[i]
+                key = inbound.idempotency_key
+                prior = (seen.get(key) or fresh.get(key)) if key else None
+                if prior:
+                    results[i] = {**prior, "duplicate": True}
+                    continue
+                try:
+                    # A failing item leaves no trace: its staged writes are
+                    # dropped and its key stays unclaimed so a retry runs it.
+                    with savepoint(uid):
+                        base = contact or Contact(
+                            id=inbound.contact_id, last_touch_ts=inbound.ts, last_inbound_ts=inbound.ts
+                        )
+                        staged, thread_id = record_inbound(uid, inbound, base.model_copy())
+                        result = decide_inbound(
+                            uid, inbound, staged, thread_id, bp=bp, oc=oc, cls=classes[inbound.text]
+                        )
+                        if key:
+                            remember_idempotency_key(uid, key, result)
+                    contact = staged
+                    results[i] = result
+                    if key:
+                        fresh[key] = result
+                except Exception as exc:
+                    print("Inbound batch item error:", repr(exc))
+                    results[i] = {"status": "error", "error": repr(exc)}
+        seen.update(fresh)
+    except Exception as exc:
+        print("Inbound batch commit error:", repr(exc))
+        results = {i: {"status": "error", "error": repr(exc)} for i in group}
+    return results
+
+
 # ============================================================
 # DECISIONS / ACTION QUEUE / AUDIT
 # ============================================================
 @app.get("/decisions")
 def list_decisions(contact_id: Optional[str] = Query(default=None), user: AuthedUser = Depends(get_user)):
     ensure_user(user.uid)
-    if _firestore is None:
-        u = get_ws_scope(user.uid)
-        rows = list_dev_docs(u, "decisions/")
-        if contact_id:
-            rows = [r for r in rows if r.get("contact_id") == contact_id]
-        return rows
-    docs = fs_col_uid(user.uid, "decisions").stream()
-    rows = [d.to_dict() for d in docs]
+    query = fs_col_uid(user.uid, "decisions")
     if contact_id:
-        rows = [r for r in rows if r.get("contact_id") == contact_id]
-    return rows
+        query = query.where("contact_id", "==", contact_id)
+    return [d.to_dict() for d in query.stream()]
+
+
+# ------------------------------------------------------------
+# Lazy drafts (LAZY_DRAFTS=true). Queued decisions are stored without a
+# draft so the inbound request never waits on the model, and nothing is
+# generated for actions nobody looks at. GET /actionQueue returns what is
+# already filled in and hands up to LAZY_DRAFTS_PER_VIEW pending drafts to a
+# background worker (LAZY_DRAFT_WORKERS), which merges the draft onto the
+# action so a concurrent status change survives. Approving an action whose
+# draft is still pending generates it and returns it for review instead of
+# sending text the owner never saw; if that generation outlasts its
+# deadline the approve answers draft_pending and the owner retries.
+# ------------------------------------------------------------
+_DRAFT_POOL: Optional[ThreadPoolExecutor] = None
+_DRAFT_LOCK = threading.Lock()
+_DRAFTS_SCHEDULED: set = set()
+# Keyed by action: the background worker and an approve share one generation.
+DRAFT_FLIGHTS = SingleFlight()
+
+
+def draft_pool() -> ThreadPoolExecutor:
+    global _DRAFT_POOL
+    if _DRAFT_POOL is None:
+        with _DRAFT_LOCK:
+            if _DRAFT_POOL is None:
+                _DRAFT_POOL = ThreadPoolExecutor(max_workers=max(1, LAZY_DRAFT_WORKERS), thread_name_prefix="drafts")
+    return _DRAFT_POOL
+
+
+def fill_draft(uid: str, action: ActionQueueItem) -> str:
+    """Generate the pending draft for `action`, merge it onto the stored action and return it."""
+
+    def generate() -> str:
+        bp = get_business_profile(uid)
+        oc = get_owner_cover(uid)
+        contact = get_contact(uid, action.contact_id) or Contact(id=action.contact_id)
+        draft = hf_reply(bp, oc, contact, action.inbound_text, mode="ownercover") or fallback_reply(bp, oc, action.intent)
+        write_doc(uid, f"actionQueue/{action.id}", {"draft": draft, "draft_pending": False}, merge=True)
+        return draft
+
+    action.draft = DRAFT_FLIGHTS.do(f"{uid}/{action.id}", generate, timeout=HF_DEADLINE_SECONDS * 2)
+    action.draft_pending = False
+    return action.draft
+
+
+def _run_draft_job(uid: str, ws_id: str, action_id: str):
+    try:
+        with use_context(workspace_context(uid, ws_id)), unit_of_work(uid):
+            snap = fs_doc_uid(uid, f"actionQueue/{action_id}").get()
+            if snap.exists:
+                action = ActionQueueItem(**snap.to_dict())
+                if action.draft_pending and action.status == "needs_approval":
+                    fill_draft(uid, action)
+    except Exception as exc:
+        print("Draft job error:", repr(exc))
+    finally:
+        with _DRAFT_LOCK:
+            _DRAFTS_SCHEDULED.discard((uid, action_id))
+
+
+def schedule_drafts(uid: str, action_ids: List[str]):
+    """Queue background draft generation; actions already queued are skipped."""
+    ws_id = get_workspace_id(uid)
+    for action_id in action_ids:
+        with _DRAFT_LOCK:
+            if (uid, action_id) in _DRAFTS_SCHEDULED:
+                continue
+            _DRAFTS_SCHEDULED.add((uid, action_id))
+        draft_pool().submit(_run_draft_job, uid, ws_id, action_id)
 
 
 @app.get("/actionQueue")
 def list_action_queue(user: AuthedUser = Depends(get_user)):
     ensure_user(user.uid)
     require_role(user, ["Owner", "Manager"])
-    if _firestore is None:
-        u = get_ws_scope(user.uid)
-        return list_dev_docs(u, "actionQueue/")
-    docs = fs_col_uid(user.uid, "actionQueue").stream()
-    return [d.to_dict() for d in docs]
+    rows = [d.to_dict() for d in fs_col_uid(user.uid, "actionQueue").stream()]
+    pending = [r for r in rows if r.get("draft_pending") and r.get("status") == "needs_approval"]
+    if pending:
+        pending.sort(key=lambda r: r.get("created_ts", 0), reverse=True)
+        schedule_drafts(user.uid, [r["id"] for r in pending[:max(0, LAZY_DRAFTS_PER_VIEW)]])
+    return rows
 
 
 @app.get("/auditLog")
 def list_audit_log(user: AuthedUser = Depends(get_user)):
     ensure_user(user.uid)
-    if _firestore is None:
-        u = get_ws_scope(user.uid)
-        return u.setdefault("_cols", {}).get("auditLog", [])
     docs = fs_col_uid(user.uid, "auditLog").stream()
     return [d.to_dict() for d in docs]
 
@@ -1743,48 +5221,58 @@ def list_audit_log(user: AuthedUser = Depends(get_user)):
 class ApproveRequest(BaseModel):
     action_id: str
     approve: bool
+    # Optional correction of the message's intent (one of INTENT_LABELS).
+    intent: Optional[str] = None
 
 
 @app.post("/actionQueue/approve")
 def approve_action(req: ApproveRequest, user: AuthedUser = Depends(get_user)):
     ensure_user(user.uid)
     require_role(user, ["Owner", "Manager"])
-
-    if _firestore is None:
-        raw = get_ws_scope(user.uid).get(f"actionQueue/{req.action_id}")
-        if not raw:
-            raise HTTPException(404, "Action not found")
-        action = ActionQueueItem(**raw)
-    else:
+    with unit_of_work(user.uid):
         snap = fs_doc_uid(user.uid, f"actionQueue/{req.action_id}").get()
         if not snap.exists:
             raise HTTPException(404, "Action not found")
         action = ActionQueueItem(**snap.to_dict())
 
-    if action.status != "needs_approval":
-        return {"status": "noop", "message": f"Action already {action.status}"}
+        if action.status != "needs_approval":
+            return {"status": "noop", "message": f"Action already {action.status}"}
+        if req.intent is not None and req.intent not in INTENT_LABELS:
+            raise HTTPException(400, f"Unknown intent: {req.intent}")
 
-    if not req.approve:
-        action.status = "blocked"
+        if not req.approve:
+            action.reviewed_ts = time.time()
+            action.corrected_intent = req.intent or ""
+            action.status = "blocked"
+            write_doc(user.uid, f"actionQueue/{action.id}", action.model_dump())
+            inc_stat(user.uid, "blocked", 1)
+            audit(user.uid, {"type": "action_blocked", "action": action.model_dump()})
+            return {"status": "blocked", "action_id": action.id}
+
+        if action.draft_pending:
+            try:
+                fill_draft(user.uid, action)
+            except FutureTimeout:
+                return {"status": "draft_pending", "action_id": action.id}
+            return {"status": "draft_ready", "action_id": action.id, "draft": action.draft}
+
+        action.reviewed_ts = time.time()
+        action.corrected_intent = req.intent or ""
+        action.status = "approved"
         write_doc(user.uid, f"actionQueue/{action.id}", action.model_dump())
-        inc_stat(user.uid, "blocked", 1)
-        audit(user.uid, {"type": "action_blocked", "action": action.model_dump()})
-        return {"status": "blocked", "action_id": action.id}
 
-    action.status = "approved"
-    write_doc(user.uid, f"actionQueue/{action.id}", action.model_dump())
+        msg_out = Message(id=str(uuid.uuid4()), role="assistant", text=action.draft, ts=time.time())
+        save_message(user.uid, action.thread_id, msg_out)
 
-    msg_out = Message(id=str(uuid.uuid4()), role="assistant", text=action.draft, ts=time.time())
-    save_message(user.uid, action.thread_id, msg_out)
-
-    action.status = "sent"
-    action.sent_ts = time.time()
-    write_doc(user.uid, f"actionQueue/{action.id}", action.model_dump())
+        action.status = "sent"
+        action.sent_ts = time.time()
+        write_doc(user.uid, f"actionQueue/{action.id}", action.model_dump())
 
-    inc_stat(user.uid, "approved_sent", 1)
-    inc_stat(user.uid, "minutes_saved", oc.minutesPerAction or SAVED_MINUTES_PER_ACTION)
-    audit(user.uid, {"type": "action_approved_sent", "action": action.model_dump()})
-    return {"status": "sent", "action_id": action.id, "thread_id": action.thread_id}
+        oc = get_owner_cover(user.uid)
+        inc_stat(user.uid, "approved_sent", 1)
+        inc_stat(user.uid, "minutes_saved", oc.minutesPerAction or SAVED_MINUTES_PER_ACTION)
+        audit(user.uid, {"type": "action_approved_sent", "action": action.model_dump()})
+        return {"status": "sent", "action_id": action.id, "thread_id": action.thread_id}
 
 
 # ============================================================
@@ -1804,17 +5292,10 @@ def record_outcome(outcome: Outcome, user: AuthedUser = Depends(get_user)):
 @app.get("/outcomes")
 def list_outcomes(contact_id: Optional[str] = Query(default=None), user: AuthedUser = Depends(get_user)):
     ensure_user(user.uid)
-    if _firestore is None:
-        u = get_ws_scope(user.uid)
-        rows = list_dev_docs(u, "outcomes/")
-        if contact_id:
-            rows = [r for r in rows if r.get("contact_id") == contact_id]
-        return rows
-    docs = fs_col_uid(user.uid, "outcomes").stream()
-    rows = [d.to_dict() for d in docs]
+    query = fs_col_uid(user.uid, "outcomes")
     if contact_id:
-        rows = [r for r in rows if r.get("contact_id") == contact_id]
-    return rows
+        query = query.where("contact_id", "==", contact_id)
+    return [d.to_dict() for d in query.stream()]
 
 
 # ============================================================
@@ -1823,36 +5304,35 @@ def list_outcomes(contact_id: Optional[str] = Query(default=None), user: AuthedU
 @app.get("/dashboard/summary")
 def dashboard_summary(period: Optional[str] = Query(default=None, alias="range"), user: AuthedUser = Depends(get_user)):
     ensure_user(user.uid)
-    if period == "week":
-        total = 0
-        now = time.time()
-        for i in range(7):
-            day = time.strftime("%Y%m%d", time.localtime(now - i * 86400))
-            if _firestore is None:
-                u = get_ws_scope(user.uid)
-                stats = u.get(f"stats/daily_{day}", {})
-            else:
-                snap = fs_doc_uid(user.uid, f"stats/daily_{day}").get()
-                stats = snap.to_dict() if snap.exists else {}
-            total += int(stats.get("minutes_saved", 0))
-        return {"range": "week", "minutes_saved": total}
+    ws_id = get_workspace_id(user.uid)
+    if period in ("week", "month", "ytd"):
+        stats = _sum_stat_docs(list(read_stat_docs(user.uid, ws_id, range_stat_names(period)).values()))
+        return {"range": period, "minutes_saved": int(stats.get("minutes_saved", 0)), "stats": stats}
 
     day = time.strftime("%Y%m%d")
-    if _firestore is None:
-        u = get_ws_scope(user.uid)
-        stats = u.get(f"stats/daily_{day}", {})
-    else:
-        snap = fs_doc_uid(user.uid, f"stats/daily_{day}").get()
-        stats = snap.to_dict() if snap.exists else {}
-    return {"day": day, "stats": stats}
+    return {"day": day, "stats": read_stats(user.uid, ws_id, day)}
 
 
 def get_workspace_stats(uid: str, ws_id: str, day: str) -> Dict[str, Any]:
-    if _firestore is None:
-        u = get_ws_scope_for(uid, ws_id)
-        return u.get(f"stats/daily_{day}", {})
-    snap = fs_doc_ws(uid, ws_id, f"stats/daily_{day}").get()
-    return snap.to_dict() if snap.exists else {}
+    return read_stats(uid, ws_id, day)
+
+
+@app.get("/stats/settings", response_model=StatsSettings)
+def get_stats_settings_endpoint(user: AuthedUser = Depends(get_user)):
+    ensure_user(user.uid)
+    require_role(user, ["Owner"])
+    return get_stats_settings(user.uid, get_workspace_id(user.uid))
+
+
+@app.post("/stats/settings", response_model=StatsSettings)
+def set_stats_settings_endpoint(payload: StatsSettings, user: AuthedUser = Depends(get_user)):
+    ensure_user(user.uid)
+    require_role(user, ["Owner"])
+    current = get_stats_settings(user.uid, get_workspace_id(user.uid))
+    payload.shard_high_water = max(current.shard_high_water, current.shard_count, payload.shard_count)
+    set_cfg(user.uid, "stats", payload)
+    audit(user.uid, {"type": "stats_settings_update", "shard_count": payload.shard_count})
+    return payload
 
 
 @app.get("/org/summary")
@@ -1868,26 +5348,25 @@ def org_summary(period: Optional[str] = Query(default=None, alias="range"), user
             if isinstance(value, (int, float)):
                 totals[key] = int(totals.get(key, 0)) + int(value)
 
-    if period == "week":
-        week_totals: Dict[str, int] = {}
-        now = time.time()
-        for i in range(7):
-            target_day = time.strftime("%Y%m%d", time.localtime(now - i * 86400))
-            for ws in workspaces:
-                stats = get_workspace_stats(user.uid, ws.get("id", "primary"), target_day)
-                for key, value in stats.items():
-                    if isinstance(value, (int, float)):
-                        week_totals[key] = int(week_totals.get(key, 0)) + int(value)
-        return {"range": "week", "totals": week_totals, "workspaces": workspaces}
-
+    # Bounded so very large orgs degrade to a partial, flagged answer instead of a slow one.
+    truncated = len(workspaces) > ORG_SUMMARY_MAX_WORKSPACES
+    shown = workspaces[:ORG_SUMMARY_MAX_WORKSPACES]
+    ranged = period in ("week", "month", "ytd")
+    name = range_stat_names(period)[0] if ranged else f"daily_{day}"
+    grid = read_workspaces_stat_docs(user.uid, [ws.get("id", "primary") for ws in shown], [name])
     workspace_stats = []
-    for ws in workspaces:
+    for ws in shown:
         ws_id = ws.get("id", "primary")
-        stats = get_workspace_stats(user.uid, ws_id, day)
+        stats = grid[ws_id][name]
         workspace_stats.append({"id": ws_id, "name": ws.get("name", ws_id), "stats": stats})
-        add_stats(stats)
+        if not ranged:
+            add_stats(stats)
 
-    return {"day": day, "totals": totals, "workspaces": workspace_stats}
+    if ranged:
+        # Org-level rollups sum every workspace, including any past the cap.
+        add_stats(read_stat_docs(user.uid, None, [name])[name])
+        return {"range": period, "totals": totals, "workspaces": workspace_stats, "truncated": truncated}
+    return {"day": day, "totals": totals, "workspaces": workspace_stats, "truncated": truncated}
 
 
 # ============================================================
@@ -1901,38 +5380,31 @@ def cron_run(secret: str = Header(default=""), user: AuthedUser = Depends(get_us
     ensure_user(user.uid)
     bp = get_business_profile(user.uid)
     oc = get_owner_cover(user.uid)
+    requeued = requeue_stale_inbound_jobs(user.uid)
+    purged = purge_idempotency_keys(user.uid)
 
     if not oc.follow_up_enabled:
-        return {"ok": True, "message": "follow_up disabled"}
+        return {"ok": True, "message": "follow_up disabled", "inbound_requeued": requeued, "keys_purged": purged}
 
     now = time.time()
     follow_after = oc.follow_up_after_hours * 3600
 
     targets: List[Contact] = []
-    if _firestore is None:
-        u = get_ws_scope(user.uid)
-        for k, v in u.items():
-            if k.startswith("contacts/"):
-                c = Contact(**v)
-                if c.last_inbound_ts > 0 and (now - c.last_inbound_ts) > follow_after and c.last_outbound_ts < c.last_inbound_ts:
-                    targets.append(c)
-    else:
-        from google.cloud.firestore import FieldFilter
-        contacts_ref = fs_col_uid(user.uid, "contacts")
-        cutoff = now - follow_after
-        try:
-            docs = (
-                contacts_ref
-                .where(filter=FieldFilter("last_inbound_ts", ">", 0))
-                .where(filter=FieldFilter("last_inbound_ts", "<", cutoff))
-                .stream()
-            )
-            for d in docs:
-                c = Contact(**d.to_dict())
-                if c.last_outbound_ts < c.last_inbound_ts:
-                    targets.append(c)
-        except Exception as e:
-            return {"ok": True, "message": f"Firestore follow-up query failed: {repr(e)}"}
+    contacts_ref = fs_col_uid(user.uid, "contacts")
+    cutoff = now - follow_after
+    try:
+        docs = (
+            contacts_ref
+            .where(filter=fs_filter("last_inbound_ts", ">", 0))
+            .where(filter=fs_filter("last_inbound_ts", "<", cutoff))
+            .stream()
+        )
+        for d in docs:
+            c = Contact(**d.to_dict())
+            if c.last_outbound_ts < c.last_inbound_ts:
+                targets.append(c)
+    except Exception as e:
+        return {"ok": True, "message": f"Firestore follow-up query failed: {repr(e)}"}
 
     sent = 0
     queued = 0
@@ -1982,4 +5454,4 @@ def cron_run(secret: str = Header(default=""), user: AuthedUser = Depends(get_us
             inc_stat(user.uid, "followups_queued", 1)
 
     audit(user.uid, {"type": "cron_run", "sent": sent, "queued": queued})
-    return {"ok": True, "sent": sent, "queued": queued}
+    return {"ok": True, "sent": sent, "queued": queued, "inbound_requeued": requeued, "keys_purged": purged}
@@ -0,0 +1,39 @@
+"""Rebuild the weekly/monthly/yearly stat rollups from existing daily docs.
+
+    python scripts/backfill_stat_rollups.py --uid <uid> [--uid <uid> ...] [--since YYYYMMDD]
+
+Rollups are maintained when buffered stats flush, so days flushed before they
+existed read low in the week/month/ytd dashboards until this has run once.
+Covers every workspace of each user plus the org-level rollups. --since
+defaults to 1 January of the current year, which rebuilds every rollup the
+dashboards read. Run it while traffic is quiet: each rollup is overwritten
+with the sum of its days.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--uid", action="append", required=True, help="user (org) whose workspaces to rebuild")
+    parser.add_argument("--since", default=time.strftime("%Y0101"), help="first daily doc to read (YYYYMMDD)")
+    parser.add_argument("--until", default=None, help="last daily doc to read (YYYYMMDD, default today)")
+    return parser.parse_args()
+
+
+def main_cli():
+    args = parse_args()
+    main.flush_stats()
+    for uid in args.uid:
+        written = main.rebuild_stat_rollups(uid, args.since, args.until)
+        print(f"{uid}: rebuilt {written} rollup docs from {args.since}")
+
+
+if __name__ == "__main__":
+    main_cli()
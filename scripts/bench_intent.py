@@ -0,0 +1,105 @@
+"""Micro-benchmark: compiled IntentMatcher vs the original classify_intent.
+
+    python scripts/bench_intent.py [messages] [repeats]
+
+Builds a synthetic corpus of customer messages, checks both classifiers agree
+on every message, then reports the best-of-N time for each.
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("STORAGE_BACKEND", "memory")
+
+import main  # noqa: E402
+
+
+def legacy_classify_intent(text):
+    t = text.lower()
+    mentions_money = any(k in t for k in ["price", "cost", "how much", "$", "payment", "invoice", "refund", "chargeback"])
+    booking = any(k in t for k in ["book", "schedule", "appointment", "availability"])
+    hours = any(k in t for k in ["hours", "open", "close", "when are you open"])
+    services = any(k in t for k in ["services", "do you", "offer", "can you"])
+    legal = any(k in t for k in ["lawsuit", "attorney", "legal", "sue"])
+    complaint = any(k in t for k in ["complaint", "angry", "bad service", "refund", "chargeback"])
+    status = any(k in t for k in ["status", "update", "where is", "eta", "when will"])
+
+    if legal:
+        intent = "legal"
+    elif complaint:
+        intent = "complaint"
+    elif booking:
+        intent = "booking"
+    elif mentions_money:
+        intent = "pricing_basic"
+    elif hours:
+        intent = "hours"
+    elif services:
+        intent = "services"
+    elif status:
+        intent = "status"
+    else:
+        intent = "default"
+
+    risk = 0.15
+    if intent in ["legal"]:
+        risk = 0.95
+    elif intent in ["complaint"]:
+        risk = 0.80
+    elif mentions_money:
+        risk = 0.55
+    elif intent in ["booking"]:
+        risk = 0.25
+    return {"intent": intent, "risk": risk, "mentions_money": mentions_money}
+
+
+PHRASES = [
+    "Hi there", "what are your hours on Saturday", "can I book an appointment next week",
+    "How much does a full inspection cost", "I am really angry about the bad service",
+    "my attorney will be in touch", "where is my technician, any ETA?", "do you offer gutter cleaning",
+    "I want a refund", "please send the invoice", "is the shop open late", "thanks so much",
+    "the issue is still there", "Just checking the status of my order", "We loved the results!",
+]
+FILLER = "the a my your our please thanks today tomorrow again team house kitchen roof yard car".split()
+
+
+def corpus(n, seed=7):
+    rng = random.Random(seed)
+    out = []
+    for _ in range(n):
+        words = [rng.choice(FILLER) for _ in range(rng.randint(3, 40))]
+        for _ in range(rng.randint(1, 3)):
+            words.insert(rng.randint(0, len(words)), rng.choice(PHRASES))
+        out.append(" ".join(words))
+    return out
+
+
+def best_of(fn, texts, repeats):
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for text in texts:
+            fn(text)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def run(n=50000, repeats=5):
+    texts = corpus(n)
+    mismatches = [t for t in texts if legacy_classify_intent(t) != main.classify_intent(t)]
+    if mismatches:
+        raise SystemExit(f"{len(mismatches)} mismatches, e.g. {mismatches[0]!r}")
+
+    legacy = best_of(legacy_classify_intent, texts, repeats)
+    compiled = best_of(main.classify_intent, texts, repeats)
+    avg_len = sum(map(len, texts)) / len(texts)
+    print(f"{n} messages, avg {avg_len:.0f} chars, best of {repeats}")
+    print(f"legacy   {legacy * 1e6 / n:7.2f} us/msg  {legacy:.3f}s")
+    print(f"compiled {compiled * 1e6 / n:7.2f} us/msg  {compiled:.3f}s  ({legacy / compiled:.2f}x)")
+
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:3]]
+    run(*args)
@@ -0,0 +1,55 @@
+"""Train the local intent model from owner-reviewed decisions and outcomes.
+
+    STORAGE_BACKEND=sqlite SQLITE_PATH=mainst.db \\
+        python scripts/train_intent_model.py --uid <uid> [--uid <uid> ...] [--out intent_model.npz]
+
+Reads each user's current workspace through the configured storage backend
+(Firestore or SQLite; the in-memory DEV store has nothing to train on),
+fits the model on CPU and writes it where INTENT_MODEL_PATH expects it.
+Labels are intents owners corrected or confirmed when approving/blocking
+actions (see main.intent_training_samples). Requires NumPy.
+"""
+import argparse
+import os
+import sys
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--uid", action="append", required=True, help="user whose current workspace to read")
+    parser.add_argument("--out", default=main.INTENT_MODEL_PATH or "intent_model.npz")
+    parser.add_argument("--dim", type=int, default=1 << 14, help="hashed feature dimensions")
+    parser.add_argument("--epochs", type=int, default=30)
+    parser.add_argument("--lr", type=float, default=0.5)
+    parser.add_argument("--l2", type=float, default=1e-4)
+    return parser.parse_args()
+
+
+def main_cli():
+    args = parse_args()
+    texts, labels, weights = [], [], []
+    for uid in args.uid:
+        t, l, w = main.intent_training_samples(uid)
+        print(f"{uid}: {len(t)} samples")
+        texts += t
+        labels += l
+        weights += w
+    if not texts:
+        raise SystemExit("No owner-reviewed decisions to train on yet.")
+    print("labels:", dict(Counter(labels)))
+
+    model = main.train_intent_model(texts, labels, weights, dim=args.dim, epochs=args.epochs, lr=args.lr, l2=args.l2)
+    probs = model.predict_proba(texts)
+    predicted = [model.labels[i] for i in probs.argmax(axis=1)]
+    accuracy = sum(p == y for p, y in zip(predicted, labels)) / len(labels)
+    model.save(args.out)
+    print(f"saved {args.out} version={model.version} temperature={model.temperature:.2f} train_accuracy={accuracy:.3f}")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,52 @@
+import os
+import sys
+import time
+import uuid
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ["STORAGE_BACKEND"] = "memory"
+os.environ.setdefault("HF_TOKEN", "")
+
+import main  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def client():
+    return TestClient(main.app)
+
+
+@pytest.fixture
+def uid():
+    # The in-memory store lives for the whole session; a fresh user per test keeps them apart.
+    return f"t{uuid.uuid4().hex[:12]}"
+
+
+@pytest.fixture
+def headers(uid):
+    return {"Authorization": f"Bearer dev-{uid}"}
+
+
+@pytest.fixture
+def ws(uid):
+    """Run main helpers directly as `uid` in its primary workspace."""
+    with main.use_context(main.workspace_context(uid, "primary")):
+        yield
+
+
+@pytest.fixture
+def wait_until():
+    """Poll `cond` until it returns something truthy (background workers, lanes); fail after `timeout` seconds."""
+
+    def wait(cond, timeout=5.0):
+        end = time.time() + timeout
+        while True:
+            result = cond()
+            if result or time.time() > end:
+                assert result, "condition not met in time"
+                return result
+            time.sleep(0.01)
+
+    return wait
@@ -0,0 +1,78 @@
+import threading
+import time
+
+import main
+
+
+def test_same_key_runs_in_submission_order_without_overlap():
+    ex = main.KeyedExecutor(4)
+    seen = {k: [] for k in "abc"}
+    active, overlaps = set(), []
+    lock = threading.Lock()
+
+    def task(key, i):
+        with lock:
+            if key in active:
+                overlaps.append(key)
+            active.add(key)
+        time.sleep(0.001)
+        seen[key].append(i)
+        with lock:
+            active.discard(key)
+
+    futures = [ex.submit(k, task, k, i) for i in range(50) for k in "abc"]
+    for f in futures:
+        f.result(timeout=10)
+    ex.shutdown()
+    assert all(seen[k] == list(range(50)) for k in "abc")
+    assert not overlaps
+
+
+def test_different_keys_run_in_parallel():
+    ex = main.KeyedExecutor(2)
+    # Both tasks must be running at once for the barrier to open.
+    barrier = threading.Barrier(2, timeout=5)
+    futures = [ex.submit(k, barrier.wait) for k in ("a", "b")]
+    for f in futures:
+        f.result(timeout=10)
+    ex.shutdown()
+
+
+def test_run_is_inline_when_idle_and_queues_behind_busy_lane():
+    ex = main.KeyedExecutor(2)
+    assert ex.run("a", threading.get_ident) == threading.get_ident()
+    assert ex.pending() == {"keys": 0, "queued": 0}
+
+    order = []
+    release = threading.Event()
+    busy = ex.submit("a", lambda: (release.wait(5), order.append("queued")))
+    waiter = threading.Thread(target=lambda: order.append(ex.run("a", lambda: "inline")))
+    waiter.start()
+    time.sleep(0.05)
+    assert order == []
+    release.set()
+    waiter.join(5)
+    busy.result(timeout=5)
+    ex.shutdown()
+    assert order == ["queued", "inline"]
+
+
+def test_same_contact_async_and_sync_calls_apply_in_order(client, headers, monkeypatch, wait_until):
+    handled = []
+    decide = main.decide_inbound
+
+    def recording(uid, inbound, *args, **kwargs):
+        time.sleep(0.005)
+        handled.append(inbound.text)
+        return decide(uid, inbound, *args, **kwargs)
+
+    monkeypatch.setattr(main, "decide_inbound", recording)
+    texts = [f"question {i}" for i in range(10)]
+    for text in texts:
+        r = client.post("/ownercover/handleInbound?async=true", headers=headers, json={"contact_id": "o1", "text": text})
+        assert r.status_code == 202
+    r = client.post("/ownercover/handleInbound", headers=headers, json={"contact_id": "o1", "text": "sync"})
+    assert r.status_code == 200
+
+    wait_until(lambda: len(handled) == 11)
+    assert handled == texts + ["sync"]
@@ -0,0 +1,71 @@
+import pytest
+
+import main
+
+ROUTING = {"email_enabled": True, "email": "owner@example.com", "sms_enabled": False, "min_severity": "high"}
+
+
+@pytest.fixture
+def provider(client, headers, monkeypatch):
+    """Route this user's alerts to email and answer sends from a script of status codes (default 202)."""
+    monkeypatch.setattr(main, "SENDGRID_API_KEY", "SG.test")
+    monkeypatch.setattr(main, "DELIVERY_BACKOFF_SECONDS", 0.01)
+    monkeypatch.setattr(main, "DELIVERY_MAX_ATTEMPTS", 3)
+    script = []
+
+    def send_email(to, subject, body):
+        status = script.pop(0) if script else 202
+        if isinstance(status, Exception):
+            raise status
+        return status, {}, b"{}"
+
+    monkeypatch.setattr(main, "send_email", send_email)
+    assert client.post("/notifications/routing", headers=headers, json=ROUTING).status_code == 200
+    return script
+
+
+def escalate(client, headers, contact_id):
+    r = client.post("/ownercover/handleInbound", headers=headers, json={"contact_id": contact_id, "text": "I will sue, lawsuit"})
+    return f"alert-escalation-{r.json()['decision_id']}"
+
+
+def email_delivery(client, headers, nid):
+    row = next(n for n in client.get("/notifications", headers=headers).json() if n["id"] == nid)
+    return row["delivery"].get("email", {})
+
+
+def dead_letters(uid):
+    with main.use_context(main.workspace_context(uid, "primary")):
+        return [d.to_dict() for d in main.fs_col_uid(uid, "deliveryDeadLetters").stream()]
+
+
+def test_transient_failures_are_retried_until_sent(client, headers, uid, provider, wait_until):
+    provider.extend([503, ConnectionResetError("reset")])
+    nid = escalate(client, headers, "d1")
+    sent = wait_until(lambda: (d := email_delivery(client, headers, nid)).get("status") == "sent" and d)
+    assert sent["attempts"] == 3 and not dead_letters(uid)
+
+
+def test_retries_run_out_into_the_dead_letters(client, headers, uid, provider, wait_until):
+    provider.extend([503] * 3)
+    nid = escalate(client, headers, "d2")
+    failed = wait_until(lambda: (d := email_delivery(client, headers, nid)).get("status") == "failed" and d)
+    assert failed["attempts"] == 3 and failed["error"] == "HTTP 503"
+    [letter] = dead_letters(uid)
+    assert letter["notification_id"] == nid and letter["channel"] == "email"
+
+
+def test_permanent_rejection_is_not_retried(client, headers, uid, provider, wait_until):
+    provider.append(400)
+    nid = escalate(client, headers, "d3")
+    failed = wait_until(lambda: (d := email_delivery(client, headers, nid)).get("status") == "failed" and d)
+    assert failed["attempts"] == 1 and len(dead_letters(uid)) == 1
+
+
+def test_delivery_status_is_joined_not_stored(client, headers, uid, provider, wait_until):
+    nid = escalate(client, headers, "d4")
+    wait_until(lambda: email_delivery(client, headers, nid).get("status") == "sent")
+    with main.use_context(main.workspace_context(uid, "primary")):
+        stored = main.get_list_cfg(uid, "notifications", [])
+    assert any(row["id"] == nid for row in stored)
+    assert not any("delivery" in row for row in stored)
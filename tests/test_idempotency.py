@@ -0,0 +1,52 @@
+import json
+
+import main
+
+BODY = {"contact_id": "k1", "text": "what are your hours"}
+
+
+def decision_count(client, headers):
+    return len(client.get("/decisions", headers=headers).json())
+
+
+def batch_lines(client, headers, items):
+    r = client.post("/ownercover/handleInboundBatch", headers=headers, json={"items": items})
+    return sorted((json.loads(line) for line in r.text.splitlines()), key=lambda line: line["index"])
+
+
+def test_repeated_key_replays_the_first_result(client, headers):
+    first = client.post("/ownercover/handleInbound", headers={**headers, "Idempotency-Key": "k-1"}, json=BODY).json()
+    n = decision_count(client, headers)
+
+    again = client.post("/ownercover/handleInbound", headers={**headers, "Idempotency-Key": "k-1"}, json=BODY).json()
+    assert again["duplicate"] and again["decision_id"] == first["decision_id"]
+
+    # The body field is the same key, and the stored copy answers once the in-process cache is gone.
+    main._IDEMPOTENCY_CACHE.clear()
+    in_body = client.post("/ownercover/handleInbound", headers=headers, json={**BODY, "idempotency_key": "k-1"}).json()
+    assert in_body["duplicate"] and in_body["decision_id"] == first["decision_id"]
+    assert decision_count(client, headers) == n
+
+
+def test_async_replay_returns_the_same_job(client, headers):
+    h = {**headers, "Idempotency-Key": "k-async"}
+    first = client.post("/ownercover/handleInbound?async=true", headers=h, json=BODY)
+    again = client.post("/ownercover/handleInbound?async=true", headers=h, json=BODY)
+    assert first.status_code == again.status_code == 202
+    assert again.json()["job_id"] == first.json()["job_id"] and again.json()["duplicate"]
+
+
+def test_batch_replays_earlier_calls_and_repeats_within_the_batch(client, headers):
+    single = client.post("/ownercover/handleInbound", headers=headers, json={**BODY, "idempotency_key": "b-0"}).json()
+    n = decision_count(client, headers)
+
+    items = [{**BODY, "idempotency_key": key} for key in ("b-0", "b-1", "b-1", "b-2")]
+    # A repeated key under another contact is still the same message.
+    items.append({**BODY, "contact_id": "k2", "idempotency_key": "b-2"})
+    lines = batch_lines(client, headers, items)
+
+    assert [bool(line.get("duplicate")) for line in lines] == [True, False, True, False, True]
+    assert lines[0]["decision_id"] == single["decision_id"]
+    assert lines[1]["decision_id"] == lines[2]["decision_id"]
+    assert lines[3]["decision_id"] == lines[4]["decision_id"]
+    assert decision_count(client, headers) == n + 2
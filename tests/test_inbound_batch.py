@@ -0,0 +1,69 @@
+import threading
+import time
+
+import main
+
+
+def inbound(contact_id, text, ts, **extra):
+    return {"contact_id": contact_id, "text": text, "ts": ts, **extra}
+
+
+def contact(uid, contact_id):
+    with main.use_context(main.workspace_context(uid, "primary")):
+        return main.get_contact(uid, contact_id)
+
+
+def thread_messages(uid, contact_id):
+    with main.use_context(main.workspace_context(uid, "primary")):
+        return [d.to_dict() for d in main.fs_col_uid(uid, f"threads/thread-{contact_id}-webchat/messages").stream()]
+
+
+def test_batch_rereads_contact_written_between_chunks(client, headers, uid, monkeypatch):
+    monkeypatch.setattr(main, "INBOUND_BATCH_CHUNK", 1)
+    now = time.time()
+    assert client.post("/ownercover/handleInbound", headers=headers, json=inbound("c1", "what are your hours", now)).status_code == 200
+
+    items = [
+        main.InboundMessage(**inbound("c1", "what are your hours", now + 1)),
+        main.InboundMessage(**inbound("c1", "I will sue, lawsuit", now + 3)),
+    ]
+    batch = main.stream_inbound_batch(main.workspace_context(uid, "primary"), items)
+    assert '"sent"' in next(batch)
+
+    # A single call lands while the batch is between chunks.
+    r = client.post("/ownercover/handleInbound", headers=headers, json=inbound("c1", "what are your hours", now + 2))
+    assert r.json()["status"] == "sent"
+    sent_by_single = contact(uid, "c1").last_outbound_ts
+
+    assert '"queued"' in "".join(batch)
+    final = contact(uid, "c1")
+    assert final.last_inbound_ts == now + 3
+    assert final.last_outbound_ts == sent_by_single
+
+
+def test_batch_alongside_single_calls_keeps_every_update(client, headers, uid):
+    now = time.time()
+    items = [inbound("c2", "what are your hours", now + i) for i in range(120)]
+    singles = []
+
+    def single(i):
+        body = inbound("c2", "what are your hours", now + 1000 + i)
+        singles.append(client.post("/ownercover/handleInbound", headers=headers, json=body).json())
+
+    client.post("/ownercover/handleInbound", headers=headers, json=inbound("c2", "hi", now - 1))
+    threads = [threading.Thread(target=single, args=(i,)) for i in range(10)]
+    for t in threads:
+        t.start()
+    lines = client.post("/ownercover/handleInboundBatch", headers=headers, json={"items": items}).text.splitlines()
+    for t in threads:
+        t.join()
+
+    assert len(lines) == 120 and all('"error"' not in line for line in lines)
+    assert all(s["status"] == "sent" for s in singles)
+    messages = thread_messages(uid, "c2")
+    assert sum(1 for m in messages if m["role"] == "user") == 1 + 120 + 10
+    # The contact reflects whichever message the lane handled last, never a stale copy.
+    final = contact(uid, "c2")
+    latest_out = max(m["ts"] for m in messages if m["role"] == "assistant")
+    assert final.last_outbound_ts >= latest_out
+    assert final.last_inbound_ts in {m["ts"] for m in messages if m["role"] == "user"}
@@ -0,0 +1,34 @@
+import time
+
+import main
+
+
+def job_status(client, headers, job_id):
+    return client.get(f"/ownercover/inbound/{job_id}", headers=headers).json()
+
+
+def test_async_inbound_is_accepted_then_processed(client, headers, wait_until):
+    r = client.post("/ownercover/handleInbound?async=true", headers=headers, json={"contact_id": "a1", "text": "what are your hours"})
+    assert r.status_code == 202 and r.json()["status"] == "accepted"
+
+    job = wait_until(lambda: (j := job_status(client, headers, r.json()["job_id"]))["status"] == "done" and j)
+    assert job["attempts"] == 1 and job["result"]["status"] == "sent"
+
+
+def test_cron_requeues_stale_jobs_only(client, headers, uid, ws, wait_until, monkeypatch):
+    monkeypatch.setattr(main, "INBOUND_JOB_STALE_SECONDS", 60)
+    inbound = main.InboundMessage(contact_id="a2", text="what are your hours")
+    # A job a crashed worker left mid-flight, and one that is still fresh.
+    stale = main.InboundJob(id="stale-job", status="processing", workspace_id="primary", contact_id="a2",
+                            thread_id="thread-a2-webchat", inbound=inbound, attempts=1, updated_ts=time.time() - 120)
+    fresh = main.InboundJob(id="fresh-job", workspace_id="primary", contact_id="a3",
+                            thread_id="thread-a3-webchat", inbound=inbound.model_copy(update={"contact_id": "a3"}))
+    for job in (stale, fresh):
+        main.fs_doc_uid(uid, f"inboundJobs/{job.id}").set(job.model_dump())
+
+    r = client.post("/cron/run", headers={**headers, "secret": main.CRON_SECRET})
+    assert r.json()["inbound_requeued"] == 1
+
+    job = wait_until(lambda: (j := job_status(client, headers, "stale-job"))["status"] == "done" and j)
+    assert job["attempts"] == 2 and job["result"]["status"] == "sent"
+    assert job_status(client, headers, "fresh-job")["status"] == "queued"
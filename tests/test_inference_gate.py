@@ -0,0 +1,116 @@
+import asyncio
+import threading
+import time
+import types
+
+import pytest
+
+import main
+
+
+def make_gate(**overrides):
+    options = dict(max_concurrency=2, tenant_concurrency=2, max_queue=4, tenant_max_queue=4, failures=2, cooldown=0.2)
+    options.update(overrides)
+    return main.InferenceGate(**options)
+
+
+def ok(value="ok", delay=0.0):
+    async def factory():
+        await asyncio.sleep(delay)
+        return value
+    return factory
+
+
+def failing():
+    async def factory():
+        raise RuntimeError("model down")
+    return factory
+
+
+def test_breaker_opens_after_consecutive_failures():
+    gate = make_gate()
+    assert gate.call("t", failing(), 1) is None
+    assert gate.state() == "closed"
+    assert gate.call("t", failing(), 1) is None
+    assert gate.state() == "open"
+
+    calls = []
+    assert gate.call("t", lambda: calls.append(1) or ok()(), 1) is None
+    assert calls == [] and gate.metrics()["short_circuited"] == 1
+
+
+def test_half_open_admits_one_trial_that_closes_the_breaker():
+    gate = make_gate()
+    for _ in range(2):
+        gate.call("t", failing(), 1)
+    time.sleep(0.25)
+    assert gate.state() == "half_open"
+
+    results = {}
+    trial = threading.Thread(target=lambda: results.update(trial=gate.call("t", ok("trial", 0.2), 1)))
+    trial.start()
+    time.sleep(0.05)
+    # Only the trial gets through while it is in flight.
+    assert gate.call("t", ok("other"), 1) is None
+    trial.join()
+    assert results["trial"] == "trial"
+    assert gate.state() == "closed"
+    assert gate.call("t", ok("after"), 1) == "after"
+
+
+def test_failed_trial_reopens_the_breaker():
+    gate = make_gate()
+    for _ in range(2):
+        gate.call("t", failing(), 1)
+    time.sleep(0.25)
+    assert gate.call("t", failing(), 1) is None
+    assert gate.state() == "open"
+    assert gate.metrics()["breaker_opened"] == 2
+
+
+def test_acall_times_out_without_holding_a_thread():
+    gate = make_gate(failures=5)
+
+    async def run():
+        return await asyncio.gather(gate.acall("t", ok("fast"), 1), gate.acall("t", ok("slow", 1), 0.1))
+
+    assert asyncio.run(run()) == ["fast", None]
+    m = gate.metrics()
+    assert m["ok"] == 1 and m["timeouts"] == 1 and m["consecutive_failures"] == 1
+
+
+def test_busy_tenant_is_shed_before_the_shared_queue():
+    gate = make_gate(max_concurrency=1, tenant_concurrency=1, max_queue=4, tenant_max_queue=1, failures=5)
+    threads = [threading.Thread(target=gate.call, args=("busy", ok(delay=0.2), 2)) for _ in range(2)]
+    for t in threads:
+        t.start()
+        time.sleep(0.05)
+    # One busy call runs and one waits, so the busy tenant's queue is full; others still get in line.
+    assert gate.call("busy", ok(), 2) is None
+    assert gate.call("quiet", ok("quiet"), 2) == "quiet"
+    for t in threads:
+        t.join()
+    m = gate.metrics()
+    assert m["tenant_shed"] == 1 and m["shed"] == 0 and m["ok"] == 3
+
+
+class FakeAsyncHF:
+    def __init__(self, fail=False):
+        self.fail = fail
+
+    async def chat_completion(self, messages, **kwargs):
+        await asyncio.sleep(0.01)
+        if self.fail:
+            raise RuntimeError("model down")
+        reply = types.SimpleNamespace(content=f"model: {messages[-1]['content']}")
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=reply)])
+
+
+@pytest.mark.parametrize("fail", [False, True])
+def test_chat_awaits_the_model_or_falls_back(client, headers, monkeypatch, fail):
+    monkeypatch.setattr(main, "hf_client", FakeAsyncHF(fail))
+    monkeypatch.setattr(main, "INFERENCE_GATE", make_gate())
+    message = f"chat {time.time()}"
+    r = client.post("/chat", headers=headers, json={"message": message})
+    assert r.status_code == 200
+    assert (r.json()["reply"] == f"model: {message}") is not fail
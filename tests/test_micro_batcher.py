@@ -0,0 +1,57 @@
+import asyncio
+
+import pytest
+
+import main
+
+
+def completion(text):
+    return {"choices": [{"message": {"content": text}}]}
+
+
+def make_batcher(rows_for, max_items=4, wait_ms=20):
+    batcher = main.MicroBatcher("http://batch.invalid/generate", max_items, wait_ms)
+    posted = []
+
+    def post(items):
+        posted.append(items)
+        return rows_for(items)
+
+    batcher._post = post
+    return batcher, posted
+
+
+def ask(batcher, *prompts):
+    async def run():
+        calls = [batcher.complete([{"role": "user", "content": p}], max_tokens=8, temperature=0) for p in prompts]
+        return await asyncio.gather(*calls, return_exceptions=True)
+    return asyncio.run(run())
+
+
+def echo(items):
+    return [completion("re: " + item["messages"][-1]["content"]) for item in items]
+
+
+def test_concurrent_prompts_share_batches():
+    batcher, posted = make_batcher(echo)
+    assert ask(batcher, *"abcdef") == [f"re: {p}" for p in "abcdef"]
+    # A full batch goes at once; the remainder after the wait.
+    assert [len(items) for items in posted] == [4, 2]
+    assert batcher.stats["full"] == 1 and batcher.stats["timed"] == 1
+    assert posted[0][0] == {"messages": [{"role": "user", "content": "a"}], "max_tokens": 8, "temperature": 0}
+
+
+def test_bad_row_fails_only_its_caller():
+    batcher, _ = make_batcher(lambda items: [completion("fine"), {"error": "overloaded"}, completion("fine")])
+    ok1, bad, ok2 = ask(batcher, "a", "b", "c")
+    assert ok1 == ok2 == "fine"
+    assert isinstance(bad, RuntimeError) and "overloaded" in str(bad)
+    assert batcher.stats["bad_rows"] == 1
+
+
+@pytest.mark.parametrize("rows_for", [lambda items: [completion("only one")], lambda items: {"error": "boom"}])
+def test_malformed_response_fails_the_whole_batch(rows_for):
+    batcher, _ = make_batcher(rows_for)
+    results = ask(batcher, "a", "b")
+    assert all(isinstance(r, ValueError) for r in results)
+    assert batcher.stats["errors"] == 1
@@ -0,0 +1,81 @@
+import asyncio
+import threading
+import time
+import types
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import main
+
+
+def test_concurrent_callers_share_one_call():
+    flight = main.SingleFlight()
+    calls = []
+
+    def slow():
+        calls.append(1)
+        time.sleep(0.1)
+        return "reply"
+
+    with ThreadPoolExecutor(8) as pool:
+        results = list(pool.map(lambda _: flight.do("k", slow), range(8)))
+    assert results == ["reply"] * 8 and len(calls) == 1
+    assert flight.metrics() == {"coalesced_leaders": 1, "coalesced_followers": 7, "prompts_in_flight": 0}
+
+
+def test_followers_see_the_leaders_error():
+    flight = main.SingleFlight()
+    started = threading.Event()
+
+    def boom():
+        started.set()
+        time.sleep(0.05)
+        raise ValueError("model down")
+
+    leader = ThreadPoolExecutor(1).submit(flight.do, "k", boom)
+    started.wait(1)
+    with pytest.raises(ValueError):
+        flight.do("k", lambda: "never")
+    with pytest.raises(ValueError):
+        leader.result()
+    # Nothing is left behind: the next call runs afresh.
+    assert flight.do("k", lambda: "again") == "again"
+
+
+def test_async_callers_join_a_sync_leader():
+    flight = main.SingleFlight()
+    release = threading.Event()
+    leader = ThreadPoolExecutor(1).submit(flight.do, "k", lambda: release.wait(1) and "shared")
+    time.sleep(0.02)
+
+    async def follow():
+        async def never():
+            raise AssertionError("follower ran the call")
+        waiter = asyncio.ensure_future(flight.ado("k", never, timeout=1))
+        await asyncio.sleep(0.02)
+        release.set()
+        return await waiter
+
+    assert asyncio.run(follow()) == "shared"
+    assert leader.result() == "shared"
+
+
+def test_identical_prompts_make_one_model_call(ws, monkeypatch):
+    calls = []
+
+    class CountingHF:
+        async def chat_completion(self, messages, **kwargs):
+            calls.append(messages)
+            await asyncio.sleep(0.1)
+            reply = types.SimpleNamespace(content="shared reply")
+            return types.SimpleNamespace(choices=[types.SimpleNamespace(message=reply)])
+
+    monkeypatch.setattr(main, "hf_client", CountingHF())
+    monkeypatch.setattr(main, "HF_SINGLE_FLIGHT", main.SingleFlight())
+    bp, oc, contact = main.BusinessProfile(), main.OwnerCoverSettings(), main.Contact(id="sf")
+    text = f"hours? {time.time()}"
+    with ThreadPoolExecutor(4) as pool:
+        futures = [pool.submit(main.contextvars.copy_context().run, main.hf_reply, bp, oc, contact, text, "chat") for _ in range(4)]
+        replies = [f.result() for f in futures]
+    assert replies == ["shared reply"] * 4 and len(calls) == 1